@@ -0,0 +1,292 @@
+import datetime
+import functools
+import itertools
+import threading
+import time
+
+import cache
+import models
+import versions
+
+# ---- WORKOUT ANALYTICS CONFIG ----
+# weeks     - default window, in weeks ending today (days are UTC)
+# max_weeks - longest window a request may ask for
+# top_users - users listed on the analytics page, most workouts first
+ANALYTICS_CONFIG = {
+    "weeks": 12,
+    "max_weeks": 52,
+    "top_users": 20,
+}
+
+DAY = 24 * 3600
+# the columns only change with these; "fit_workouts_rewritten" means rows
+# were deleted or replaced, so they can't just be appended to
+VERSIONS = ("fit_workouts", "fit_workouts_rewritten")
+
+
+def _numpy():
+    # imported on the first analytics request, not when the app starts
+    import numpy
+    return numpy
+
+
+# ---- COLUMNS ----
+class WorkoutColumns:
+    """Every dated workout as NumPy columns user, sport, intensity and day
+    (UTC days since 1970), sorted by day so a time window is a slice.
+
+    Loaded once per process; after that only workouts added since are read
+    and appended. Deletes and rewrites reload everything.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.versions = None
+        self.last_id = 0
+        self.columns = None
+
+    def _read(self, after_id):
+        np = _numpy()
+        last_id, cursor = models.iter_workout_columns(after_id)
+        # fetchmany batches: no per-row Python call, straight into one array
+        batches = iter(functools.partial(cursor.fetchmany, 10000), [])
+        data = np.fromiter(itertools.chain.from_iterable(itertools.chain.from_iterable(batches)), dtype=np.int64)
+        data = data.reshape(-1, 4)
+        return last_id, (data[:, 0].astype(np.int32), data[:, 1].astype(np.int32), data[:, 2].astype(np.int32),
+                         (data[:, 3] // DAY).astype(np.int32))
+
+    def _sorted(self, columns):
+        np = _numpy()
+        day = columns[3]
+        if len(day) and (np.diff(day) < 0).any():
+            # rows come in id order, which is time order except for imports
+            order = np.argsort(day, kind="stable")
+            columns = tuple(column[order] for column in columns)
+        return columns
+
+    def get(self):
+        """((user, sport, intensity, day) arrays, versions they are current for)."""
+        np = _numpy()
+        current = versions.get(*VERSIONS)
+        with self.lock:
+            if self.columns is None or current[1] != self.versions[1]:
+                self.last_id, columns = self._read(0)
+                self.columns = self._sorted(columns)
+            elif current[0] != self.versions[0]:
+                self.last_id, added = self._read(self.last_id)
+                if len(added[0]):
+                    columns = tuple(np.concatenate(pair) for pair in zip(self.columns, added))
+                    if len(self.columns[3]) and added[3].min() < self.columns[3][-1]:
+                        columns = self._sorted(columns)
+                    self.columns = columns
+            self.versions = current
+            return self.columns, current
+
+
+_columns = WorkoutColumns()
+
+
+# ---- REPORT ----
+def _slopes(groups, x, y, size):
+    """Least-squares slope of y over x per group (NaN with fewer than two distinct x)."""
+    np = _numpy()
+    n = np.bincount(groups, minlength=size)
+    sx = np.bincount(groups, x, minlength=size)
+    sy = np.bincount(groups, y, minlength=size)
+    sxx = np.bincount(groups, x * x, minlength=size)
+    sxy = np.bincount(groups, x * y, minlength=size)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (n * sxy - sx * sy) / (n * sxx - sx * sx)
+
+
+class Report:
+    """Analytics of the workouts in the weeks up to and including today.
+
+    Weeks are rolling: the last one is the last 7 days. Everything per user
+    and per sport is an array indexed by id, computed in a few vectorized
+    passes over the window's slice of the columns.
+    """
+
+    def __init__(self, columns, today, weeks):
+        np = _numpy()
+        self.today, self.weeks = today, weeks
+        days = weeks * 7
+        self.first = today - days + 1
+        user, sport, intensity, day = columns
+        # 6 days before the window, so its first rolling week is a full one
+        lo, start, hi = np.searchsorted(day, [self.first - 6, self.first, today + 1])
+        daily = np.bincount(day[lo:hi] - (self.first - 6), minlength=days + 6)
+        self.rolling = np.convolve(daily, np.ones(7, dtype=np.int64), "valid")
+
+        user, sport, intensity = user[start:hi], sport[start:hi], intensity[start:hi]
+        day = day[start:hi] - self.first
+        week = day // 7
+        self.columns = (user, intensity, week)
+        self.users = int(user.max()) + 1 if len(user) else 1
+        self.sports = int(sport.max()) + 1 if len(sport) else 1
+
+        # whole window
+        self.weekly = np.bincount(week, minlength=weeks)
+        self.weekly_intensity = np.bincount(week, intensity, minlength=weeks)
+
+        # per sport: weekly volume and intensity, trend in intensity per week
+        x, y = week.astype(np.float64), intensity.astype(np.float64)
+        self.sport_weekly = np.bincount(sport * weeks + week, minlength=self.sports * weeks).reshape(self.sports, weeks)
+        self.sport_intensity = np.bincount(sport, intensity, minlength=self.sports)
+        self.sport_trend = _slopes(sport, x, y, self.sports)
+
+        # per user: volume, this and last week, intensity trend
+        self.user_count = np.bincount(user, minlength=self.users)
+        self.user_intensity = np.bincount(user, intensity, minlength=self.users)
+        self.user_this_week = np.bincount(user[week == weeks - 1], minlength=self.users)
+        self.user_last_week = np.bincount(user[week == weeks - 2], minlength=self.users) if weeks > 1 else None
+        self.user_trend = _slopes(user, x, y, self.users)
+
+        # percentile rank by volume among users active in the window:
+        # share of them with as many workouts or fewer
+        active = np.sort(self.user_count[self.user_count > 0])
+        self.active_users = len(active)
+        self.user_percentile = np.searchsorted(active, self.user_count, side="right") * 100.0 / max(len(active), 1)
+
+        # streaks of consecutive days with a workout, one step per day over
+        # that day's slice (the columns are sorted by day)
+        run = np.zeros(self.users, dtype=np.int32)
+        last_day = np.full(self.users, -2, dtype=np.int32)
+        self.user_longest = np.zeros(self.users, dtype=np.int32)
+        bounds = np.searchsorted(day, np.arange(days + 1))
+        for d in range(days):
+            on_day = user[bounds[d]:bounds[d + 1]]
+            if not len(on_day):
+                continue
+            # several workouts of one user on a day all compute the same value
+            run[on_day] = np.where(last_day[on_day] == d - 1, run[on_day] + 1, 1)
+            last_day[on_day] = d
+            self.user_longest[on_day] = np.maximum(self.user_longest[on_day], run[on_day])
+        # still going if it reached today or yesterday
+        self.user_streak = np.where(last_day >= days - 2, run, 0)
+
+    def date(self, day):
+        return datetime.date.fromordinal(datetime.date(1970, 1, 1).toordinal() + int(day)).isoformat()
+
+    def _user_row(self, user_id):
+        return {
+            "id": int(user_id),
+            "workouts": int(self.user_count[user_id]),
+            "avg_intensity": _round(self.user_intensity[user_id] / self.user_count[user_id]),
+            "this_week": int(self.user_this_week[user_id]),
+            "last_week": int(self.user_last_week[user_id]) if self.user_last_week is not None else None,
+            "trend": _round(self.user_trend[user_id], 3),
+            "streak": int(self.user_streak[user_id]),
+            "longest_streak": int(self.user_longest[user_id]),
+            "percentile": _round(self.user_percentile[user_id], 1),
+        }
+
+    def summary(self, top_users):
+        """JSON-able overview: weekly totals, rolling weekly volume, sports, top users."""
+        np = _numpy()
+        top = np.argsort(-self.user_count, kind="stable")[:top_users]
+        top = top[self.user_count[top] > 0]
+        sports = np.flatnonzero(self.sport_weekly.sum(axis=1))
+        return {
+            "from": self.date(self.first),
+            "to": self.date(self.today),
+            "weeks": self.weeks,
+            "workouts": int(self.weekly.sum()),
+            "active_users": self.active_users,
+            "weekly": [{"from": self.date(self.first + 7 * w), "workouts": int(n),
+                        "avg_intensity": _round(self.weekly_intensity[w] / n) if n else None}
+                       for w, n in enumerate(self.weekly)],
+            "rolling_weekly": [int(n) for n in self.rolling],
+            "sports": [{"id": int(s), "weekly": [int(n) for n in self.sport_weekly[s]],
+                        "workouts": int(self.sport_weekly[s].sum()),
+                        "avg_intensity": _round(self.sport_intensity[s] / self.sport_weekly[s].sum()),
+                        "trend": _round(self.sport_trend[s], 3)}
+                       for s in sports],
+            "top_users": [self._user_row(u) for u in top],
+        }
+
+    def user(self, user_id):
+        """JSON-able analytics of one user, with their weekly series; None without workouts in the window."""
+        np = _numpy()
+        if not 0 <= user_id < self.users or not self.user_count[user_id]:
+            return None
+        user, intensity, week = self.columns
+        mine = user == user_id
+        weekly = np.bincount(week[mine], minlength=self.weeks)
+        intensity = np.bincount(week[mine], intensity[mine], minlength=self.weeks)
+        row = self._user_row(user_id)
+        row["weekly"] = [{"from": self.date(self.first + 7 * w), "workouts": int(n),
+                          "avg_intensity": _round(intensity[w] / n) if n else None}
+                         for w, n in enumerate(weekly)]
+        return row
+
+
+def _round(value, digits=2):
+    value = float(value)
+    return None if value != value else round(value, digits)  # NaN: not enough data
+
+
+# ---- CACHED ----
+# The last few reports per process, for the user lookups; the JSON-able
+# results also go through cache.py keyed by the data versions and the day.
+_reports = {}
+_reports_lock = threading.Lock()
+MAX_REPORTS = 4
+
+
+def weeks_arg(value):
+    return min(max(value or ANALYTICS_CONFIG["weeks"], 1), ANALYTICS_CONFIG["max_weeks"])
+
+
+def get_report(weeks, today=None):
+    today = int(time.time() // DAY) if today is None else today
+    rows, current = _columns.get()
+    key = (current, today, weeks)
+    with _reports_lock:
+        report = _reports.get(key)
+    if report is None:
+        report = Report(rows, today, weeks)
+        with _reports_lock:
+            _reports[key] = report
+            while len(_reports) > MAX_REPORTS:
+                _reports.pop(next(iter(_reports)))
+    return report
+
+
+def _names(summary):
+    ids = [u["id"] for u in summary["top_users"]]
+    names = models.get_fit_user_names(ids)
+    for u in summary["top_users"]:
+        u["name"] = names.get(u["id"])
+    titles = {row["id"]: row["title"] for row in models.get_all_sports()}
+    for s in summary["sports"]:
+        s["title"] = titles.get(s["id"])
+    return summary
+
+
+def get_summary(weeks):
+    today = int(time.time() // DAY)
+    key = (versions.get("fit_workouts", "fit_users", "fit_sports"), today, weeks)
+    return cache.get_or_set("fit_analytics", key,
+                            lambda: _names(get_report(weeks, today).summary(ANALYTICS_CONFIG["top_users"])))
+
+
+def get_user(user_id, weeks):
+    today = int(time.time() // DAY)
+    key = (versions.get("fit_workouts", "fit_users"), today, weeks, user_id)
+    return cache.get_or_set("fit_analytics", key, lambda: get_report(weeks, today).user(user_id))
+
+
+def configure(**options):
+    for name, value in options.items():
+        if value is not None:
+            ANALYTICS_CONFIG[name] = value
+
+
+# ---- FLASK ----
+def init_app(app):
+    configure(
+        weeks=app.config.get("ANALYTICS_WEEKS"),
+        max_weeks=app.config.get("ANALYTICS_MAX_WEEKS"),
+        top_users=app.config.get("ANALYTICS_TOP_USERS"),
+    )
@@ -1,219 +1,672 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-import os
+from flask import Flask, current_app, render_template, request, redirect, url_for, session, flash, jsonify
+from flask.cli import AppGroup
+import gc
 import json
-import random
+import os
+import threading
+import types
+
+import click
 
+import archive
+import cache
+import credentials
+import db
+import gamestate
+import httpcache
+import levels
+import metrics
+import migrations
+import rules
+import templating
+import versions
+import writebehind
 import models  # Your combined models.py (see below)
+from pages import page_size_arg, stream_template
+
+# ---- CONFIG ----
+# Importing this module only defines things; create_app() builds the app.
+# Pass overrides to create_app(), e.g. create_app({"CACHE_BACKEND": "file"}).
+DEFAULT_CONFIG = {
+    "SECRET_KEY": "fitnesa_secret_change_this",
+
+    # --- DB CONNECTION POOL ---
+    "DB_POOL_SIZE": 16,
+    "DB_TIMEOUT": 5.0,
+    "DB_PRAGMAS": {"foreign_keys": "ON", "synchronous": "NORMAL", "busy_timeout": 5000},
+    "DB_JOURNAL_MODE": "WAL",
+    "DB_FILES": ["playgame.db", "fitnesstracker.db"],
+    # Migrate the DBs on the first request of each worker (one small read when
+    # they are current). Off: the deploy runs `flask migrate` once instead.
+    "DB_AUTO_MIGRATE": True,
+
+    # --- CACHE (leaderboard pages, dashboard data) ---
+    # "lru" is per worker; "file" shares entries and invalidations between workers
+    "CACHE_BACKEND": "lru",
+    "CACHE_TTL": 30.0,
+    "CACHE_MAX_ENTRIES": 1024,
+
+    # --- AUDIT LOG (workout adds/deletes, JSONL, buffered) ---
+    "AUDIT_LOG": "kontrole.jsonl",
+    "AUDIT_FLUSH_MS": 500,
+    "AUDIT_MAX_BYTES": 10 * 1024 * 1024,
+    "AUDIT_MAX_AGE": 24 * 3600,
+    "AUDIT_COMPRESS": True,
+
+    # --- WRITE-BEHIND (batched game/workout inserts) ---
+    # Off by default so every write is committed before the response
+    "WRITE_BEHIND": False,
+    "WRITE_BEHIND_FLUSH_MS": 50,
+    "WRITE_BEHIND_BATCH_ROWS": 500,
+    "WRITE_BEHIND_MAX_QUEUE": 10000,
+
+    # --- HTTP CACHING (ETags from data versions, fingerprinted static files) ---
+    # "file" versions are shared by all workers; "memory" only for a single worker
+    "VERSIONS_BACKEND": "file",
+    "STATIC_MAX_AGE": 365 * 24 * 3600,
+
+    # --- TEMPLATES (bytecode cache on disk, {% fragment %} blocks) ---
+    "TEMPLATE_BYTECODE_DIR": None,  # default: <tmp>/pseudoxfit_jinja
+    "TEMPLATE_FRAGMENTS": True,
+
+    # --- PASSWORDS (scrypt in a bounded worker pool, login rate limit) ---
+    "PASSWORD_SCRYPT_N": 2 ** 14,
+    "PASSWORD_WORKERS": 2,
+    "PASSWORD_EXECUTOR": "thread",
+    "PASSWORD_MAX_QUEUE": 32,
+    "LOGIN_ATTEMPTS": 10,
+    "LOGIN_WINDOW": 60.0,
+
+    # --- GAME STATE (health/battle points of running games) ---
+    # The session cookie only carries the game id. "memory" is fastest but only
+    # works with a single worker; "sqlite" is shared by all workers on the host.
+    "GAME_STATE_BACKEND": "sqlite",
+    "GAME_STATE_DB": "gamestate.db",
+    "GAME_STATE_TTL": 3600.0,
+    "GAME_STATE_MAX_GAMES": 100000,
+
+    # --- GAME ARCHIVE (`flask archive-games`, e.g. nightly from cron) ---
+    # Old games move to ARCHIVE_DB in batches of ARCHIVE_BATCH_ROWS, one short
+    # write lock each; /my_games pages on into them
+    "ARCHIVE_DB": "playgame_archive.db",
+    "ARCHIVE_AFTER_DAYS": 180,
+    "ARCHIVE_BATCH_ROWS": 2000,
+    "ARCHIVE_PAUSE_MS": 20,
+    "ARCHIVE_VACUUM_PAGES": 2000,
+
+    # --- METRICS (/metrics for Prometheus, slow-query log, ?profile=1) ---
+    "METRICS": True,
+    "METRICS_SQL": True,  # per-statement timings; the costlier half
+    "METRICS_ALLOW_IPS": ("127.0.0.1", "::1"),
+    "SLOW_QUERY_MS": 100.0,
+    "SLOW_QUERY_LOG": "slow_queries.log",
+    # ?profile=1 answers with sampled stacks of that request instead of the page
+    "PROFILE": False,
+    "PROFILE_USERS": (),  # user ids allowed to profile
+
+    # --- FITNESS TRACKER (/majasdarbi/fitnesstracker, fitness.py) ---
+    "FITNESS_TRACKER": True,
+    # --- BULK IMPORT / EXPORT (fitness users, sports, workouts) ---
+    "BULK_BATCH_ROWS": 5000,
+    "BULK_PROGRESS_EVERY": 50000,
+    # --- WORKOUT ANALYTICS (/majasdarbi/fitnesstracker/analytics, numpy) ---
+    "ANALYTICS_WEEKS": 12,
+    "ANALYTICS_MAX_WEEKS": 52,
+    "ANALYTICS_TOP_USERS": 20,
+
+    # --- SHARED DATA (loaded once, before the server forks workers) ---
+    "TEXTS_FILE": "texts.json",
+    "LEVELS_FILE": "level_requirements.json",
+    # gc.freeze() what startup allocated, so the collector never writes to
+    # those objects and forked workers keep sharing their pages
+    "GC_FREEZE": True,
+}
+
+# Routes and commands of the game, added to each app by create_app()
+ROUTES = []
+cli = AppGroup("pseudoxfit")
+
+def route(rule, **options):
+    def decorator(view):
+        ROUTES.append((rule, view, options))
+        return view
+    return decorator
+
 
-app = Flask(__name__)
-app.secret_key = "fitnesa_secret_change_this"
+# ---- APP FACTORY ----
+def freeze(value):
+    """Read-only copy of parsed JSON: dicts become mappingproxies, lists tuples."""
+    if isinstance(value, dict):
+        return types.MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
 
-# --- DB INITS ---
-# Ensure both DBs exist, or combine into one if you wish
-if not os.path.exists("playgame.db"):
-    models.init_db("playgame.db")
-if not os.path.exists("fitnesstracker.db"):
-    models.init_db("fitnesstracker.db", fitness_mode=True)
+def create_app(config=None):
+    """Build the app: configure the modules, load shared data, add routes.
 
-# --- PSEUDO GAME (default homepage) ---
-with open("texts.json", encoding="utf-8") as f:
-    TEXTS = json.load(f)
+    Touches no database; they are migrated by `flask migrate` or, with
+    DB_AUTO_MIGRATE, on the first request.
+    """
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    app.config.update(config or {})
 
-with open("level_requirements.json") as f:
-    LEVELS = {int(k): v for k,v in json.load(f).items()}
+    db.init_app(app)
+    metrics.init_app(app)
+    cache.init_app(app)
+    writebehind.init_app(app)
+    versions.init_app(app)
+    httpcache.init_app(app)
+    templating.init_app(app)
+    credentials.init_app(app)
+    gamestate.init_app(app)
+    archive.init_app(app)
 
+    for rule, view, options in ROUTES:
+        app.add_url_rule(rule, view_func=view, **options)
+    for command in cli.commands.values():
+        app.cli.add_command(command)
+    if app.config["FITNESS_TRACKER"]:
+        # only apps that serve the tracker import it (and bulk import/export)
+        import fitness
+        fitness.init_app(app)
+    # route latency and model function timings for /metrics
+    metrics.instrument_views(app)
+    metrics.instrument_module(models)
+
+    # every template can use TEXTS without it being passed in
+    with open(app.config["TEXTS_FILE"], encoding="utf-8") as f:
+        app.jinja_env.globals["TEXTS"] = freeze(json.load(f))
+    # Level curve: loaded once, bisect lookups, reloaded when the JSON file changes
+    levels.init_app(app)
+    # compile all templates now instead of on the first requests of each worker
+    templating.precompile(app)
+
+    if app.config["DB_AUTO_MIGRATE"]:
+        app.before_request(ensure_databases)
+    if app.config["GC_FREEZE"]:
+        gc.collect()
+        gc.freeze()
+    return app
+
+
+# ---- DB INIT ----
+_db_ready = False
+_db_lock = threading.Lock()
+
+def init_databases(dbfiles, sync_levels=True):
+    """Create or upgrade the DBs (migrations.py) and switch them to WAL.
+
+    Returns {dbfile: [(version, description)]} of the migrations run.
+    Stored levels are resynced with the level curve when the game db changed,
+    unless sync_levels is off (the caller does it).
+    """
+    applied = {dbfile: migrations.migrate(dbfile) for dbfile in dbfiles}
+    # the archive db only exists once `flask archive-games` has run
+    if os.path.exists(archive.ARCHIVE_CONFIG["path"]):
+        applied[archive.ARCHIVE_CONFIG["path"]] = archive.init_db()
+    if sync_levels and applied.get("playgame.db"):
+        models.sync_user_levels()
+    db.release_connections()
+    # WAL so /rangs and /dashboard readers don't wait for /play writers
+    for dbfile in dbfiles:
+        db.init_storage(dbfile)
+    return applied
+
+def ensure_databases():
+    # once per worker process, on its first request
+    global _db_ready
+    if _db_ready:
+        return
+    with _db_lock:
+        if not _db_ready:
+            init_databases(current_app.config["DB_FILES"])
+            _db_ready = True
+
+
+# ---- PSEUDO GAME (default homepage) ----
 def get_level_and_next_exp(experience):
-    level = 1
-    for lvl, need_exp in sorted(LEVELS.items()):
-        if experience >= need_exp:
-            level = lvl + 1
-        else:
-            break
-    req = LEVELS.get(level, None)
-    return level, req - experience if req else None
+    return levels.get_curve().lookup(experience)
 
-@app.route("/")
+@route("/")
 def index():
-    return render_template("index.html", TEXTS=TEXTS)
+    return render_template("index.html")
 
-@app.route("/register", methods=["GET", "POST"])
+def register_user(username, password):
+    """False if the name is taken. Raises credentials.Busy."""
+    if models.get_game_user(username):
+        return False
+    models.add_game_user(username, credentials.hash_password(password))
+    return True
+
+def check_login(username, password):
+    """The user row if the password matches, else None. Raises credentials.Busy.
+
+    Plain-text passwords (and hashes with old cost settings) are replaced
+    by a current hash on the first successful login.
+    """
+    user = models.get_game_user(username)
+    matches, needs_rehash = credentials.verify_password(user["password"] if user else None, password)
+    if not matches:
+        return None
+    if needs_rehash:
+        try:
+            models.update_game_user_password(user["id"], credentials.hash_password(password))
+        except credentials.Busy:
+            pass  # try again on the next login
+    return user
+
+@route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "POST":
         username = request.form["username"]
         password = request.form["password"]
-        if models.get_game_user(username):
+        if not credentials.allow_attempt(f"register:{request.remote_addr}"):
+            flash("Too many attempts, try again later.")
+            return render_template("register.html"), 429
+        try:
+            registered = register_user(username, password)
+        except credentials.Busy:
+            flash("Server busy, try again.")
+            return render_template("register.html"), 503
+        if not registered:
             flash("Username taken!")
             return redirect(url_for("register"))
-        models.add_game_user(username, password)
         flash("Registered! Please login.")
         return redirect(url_for("login"))
-    return render_template("register.html", TEXTS=TEXTS)
+    return render_template("register.html")
 
-@app.route("/login", methods=["GET", "POST"])
+@route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
         username = request.form["username"]
         password = request.form["password"]
-        user = models.get_game_user(username)
-        if user and user["password"] == password:
+        # checked before any hashing, so a flood costs no CPU
+        if not credentials.allow_attempt(f"ip:{request.remote_addr}", f"login:{username}"):
+            flash("Too many attempts, try again later.")
+            return render_template("login.html"), 429
+        try:
+            user = check_login(username, password)
+        except credentials.Busy:
+            flash("Server busy, try again.")
+            return render_template("login.html"), 503
+        if user:
             session["user_id"] = user["id"]
             return redirect(url_for("dashboard"))
         else:
             flash("Login failed!")
-    return render_template("login.html", TEXTS=TEXTS)
+    return render_template("login.html")
 
-@app.route("/logout")
+@route("/logout")
 def logout():
     session.clear()
     return redirect(url_for("index"))
 
-@app.route("/dashboard")
+def load_dashboard_user(user_id):
+    user = models.get_dashboard_summary(user_id)
+    if user:
+        user["level"], user["exp_needed"] = get_level_and_next_exp(user["experience"])
+    return user
+
+def get_dashboard_user(user_id):
+    # a game that just ended may still be in the write-behind queue
+    writebehind.wait_for(f"user:{user_id}")
+    return cache.get_or_set(f"user:{user_id}", ("dashboard", versions.get("game_users")),
+                            lambda: load_dashboard_user(user_id))
+
+@route("/dashboard")
+@httpcache.etag_for("game_users", per_user=True)
 def dashboard():
-    user = None
-    exp_needed = 0
-    games_count = 0
-    if "user_id" in session:
-        user_row = models.get_game_user_by_id(session["user_id"])
-        level, next_exp = get_level_and_next_exp(user_row["experience"])
-        games = models.get_user_games(session['user_id'])
-        games_count = len(games)
-        exp_needed = next_exp
-        user = dict(user_row)
-        user["level"] = level
-        user["exp_needed"] = exp_needed
-        user["games_count"] = games_count
-    return render_template("dashboard.html", TEXTS=TEXTS, user=user)
-
-@app.route("/start_game", methods=["GET"])
+    user = get_dashboard_user(session["user_id"]) if "user_id" in session else None
+    return render_template("dashboard.html", user=user)
+
+@route("/start_game", methods=["GET"])
 def start_game():
     if "user_id" not in session:
         flash("Please login")
         return redirect(url_for("login"))
-    session["game"] = {"health": 100, "battle_points": 0}
-    return render_template("game.html", TEXTS=TEXTS, health=100, battle_points=0)
+    game_id, game = gamestate.start(session["user_id"])
+    session["game_id"] = game_id
+    return render_template("game.html", health=game.health, battle_points=game.battle_points)
+
+def save_game(user_id, game):
+    models.finish_game(user_id, rules.final_health(game.health), game.battle_points)
+
+def game_over():
+    session.pop("game_id", None)
+    flash(current_app.jinja_env.globals["TEXTS"]["game_over"])
+    return redirect(url_for("dashboard"))
 
-@app.route("/play", methods=["POST"])
+@route("/play", methods=["POST"])
 def play():
-    if "game" not in session or "user_id" not in session:
+    if "game_id" not in session or "user_id" not in session:
         flash("Please start a new game.")
         return redirect(url_for("dashboard"))
-    game = session["game"]
+    user_id, game_id = session["user_id"], session["game_id"]
     action = request.form["action"]
     if action == "fight":
-        loss = random.randint(12, 26)
-        gain = random.randint(10, 30)
-        game["health"] -= loss
-        game["battle_points"] += gain
-        if game["health"] <= 0:
-            models.add_game(session["user_id"], 0, game["battle_points"])
-            models.update_user_experience(session["user_id"], game["battle_points"])
-            session.pop("game")
-            flash(TEXTS["game_over"])
+        game, over = gamestate.apply(game_id, user_id, rules.fight)
+        if game is None:
+            session.pop("game_id", None)
+            flash("Please start a new game.")
             return redirect(url_for("dashboard"))
+        if over:
+            save_game(user_id, game)
+            return game_over()
         else:
-            session["game"] = game
-            return render_template("game.html", TEXTS=TEXTS, health=game["health"], battle_points=game["battle_points"])
+            return render_template("game.html", health=game.health, battle_points=game.battle_points)
     elif action == "run":
-        models.add_game(session["user_id"], game["health"], game["battle_points"])
-        models.update_user_experience(session["user_id"], game["battle_points"])
-        session.pop("game")
-        flash(TEXTS["game_over"])
-        return redirect(url_for("dashboard"))
+        # only the request that actually ends the game saves it
+        game = gamestate.end(game_id, user_id)
+        if game is not None:
+            save_game(user_id, game)
+        return game_over()
     else:
         flash("Invalid action")
         return redirect(url_for("dashboard"))
 
-@app.route("/my_games")
+@route("/my_games")
+@httpcache.etag_for("games", per_user=True, login_required=True)
 def my_games():
     if "user_id" not in session:
         flash("Please login!")
         return redirect(url_for("login"))
-    games = models.get_user_games(session["user_id"])
-    return render_template("games_list.html", TEXTS=TEXTS, games=games)
+    writebehind.wait_for(f"user:{session['user_id']}")
+    if request.args.get("stream"):
+        # whole history, rendered while rows are read from the cursor
+        games = models.iter_user_games(session["user_id"])
+        return stream_template("games_list.html", games=games, next_before=None)
+    size = page_size_arg()
+    games, next_before = models.get_user_games_page(session["user_id"], request.args.get("before", type=int), size)
+    return render_template("games_list.html", games=games, next_before=next_before, size=size)
+
+
+def load_rangs(sort, after, size):
+    """Cached leaderboard page and the logged-in user's rank (or None)."""
+    def load_page():
+        ranga, next_after = models.get_ranga_page(sort, after, size)
+        return {"ranga": [dict(r) for r in ranga], "next_after": next_after,
+                "start_rank": models.get_rank_after(after, sort)}
+
+    # keyed by data version too, so a write in another worker is seen at once
+    version = versions.get("game_users")
+    page = cache.get_or_set("rangs", (sort, after, size, version), load_page)
+    my_rank = None
+    if "user_id" in session:
+        user_id = session["user_id"]
+        writebehind.wait_for(f"user:{user_id}")
+        my_rank = cache.get_or_set("rangs", ("my_rank", user_id, sort, version),
+                                   lambda: models.get_user_rank(user_id, sort))
+    return page, my_rank
 
-from models import get_ranga_tabula
+def sort_arg():
+    sort = request.args.get("sort", "game_count")
+    return sort if sort in models.LEADERBOARD_SORTS else "game_count"
 
-@app.route('/rangs')
+@route('/rangs')
+@httpcache.etag_for("game_users", per_user=True)
 def rangs():
-    ranga = get_ranga_tabula()
-    return render_template('rangs.html', ranga=ranga)
+    sort = sort_arg()
+    size = page_size_arg()
+    after = request.args.get("after")
+    page, my_rank = load_rangs(sort, after, size)
+    return render_template('rangs.html', ranga=page["ranga"], sort=sort, after=after, size=size,
+                           next_after=page["next_after"], start_rank=page["start_rank"], my_rank=my_rank)
 
-# --- FITNESS TRACKER SECTION ---
-@app.route("/majasdarbi/fitnesstracker/")
-def fitnesstracker_main():
-    return render_template("fitnesstracker/fit_menu.html")
+@route('/cache_stats')
+@metrics.internal_only
+def cache_stats():
+    return jsonify(cache.stats())
 
-@app.route("/majasdarbi/fitnesstracker/new_user", methods=["GET", "POST"])
-def fit_new_user():
-    if request.method == "POST":
-        name = request.form["name"].strip()
-        surname = request.form["surname"].strip()
-        if name and surname:
-            models.add_fit_user(name, surname)
-            flash("Lietotājs pievienots!")
-        else:
-            flash("Aizpildi visus laukus!")
-        return redirect(url_for("fitnesstracker_main"))
-    return render_template("fitnesstracker/new_user.html")
+@route('/auth_stats')
+@metrics.internal_only
+def auth_stats():
+    return jsonify(credentials.stats())
 
-@app.route("/majasdarbi/fitnesstracker/new_sport", methods=["GET", "POST"])
-def fit_new_sport():
-    if request.method == "POST":
-        title = request.form["title"].strip()
-        if title:
-            models.add_sport(title)
-            flash("Sporta veids pievienots!")
-        else:
-            flash("Ievadi sporta veida nosaukumu!")
-        return redirect(url_for("fitnesstracker_main"))
-    return render_template("fitnesstracker/new_sport.html")
-
-@app.route("/majasdarbi/fitnesstracker/new_workout", methods=["GET", "POST"])
-def fit_new_workout():
-    users = models.get_all_fit_users()
-    sports = models.get_all_sports()
-    if request.method == "POST":
-        user_id = request.form["user_id"]
-        sport_id = request.form["sport_id"]
-        intensity = request.form["intensity"]
-        day_time = request.form["day_time"]
-        if user_id and sport_id and intensity and day_time:
-            models.add_workout(user_id, sport_id, intensity, day_time)
-            print(f"Treniņš: Lietotājs {user_id}, Sports {sport_id}, Intensitāte {intensity}, Laiks {day_time}")
-            with open("kontrole.txt", "a", encoding="utf-8") as f:
-                f.write(f"Lietotājs {user_id}, Sports {sport_id}, Intensitāte {intensity}, Laiks {day_time}\n")
-            flash("Treniņš pievienots!")
-        else:
-            flash("Aizpildi visus laukus!")
-        return redirect(url_for("fitnesstracker_main"))
-    return render_template("fitnesstracker/new_workout.html", users=users, sports=sports)
-
-@app.route("/majasdarbi/fitnesstracker/sports")
-def fit_sports_list():
-    sports = models.get_all_sports()
-    return render_template("fitnesstracker/sports_list.html", sports=sports)
-
-@app.route("/majasdarbi/fitnesstracker/workouts")
-def fit_workouts_list():
-    workouts = models.get_all_workouts()
-    return render_template("fitnesstracker/workouts_list.html", workouts=workouts)
-
-@app.route("/majasdarbi/fitnesstracker/users")
-def fit_users_list():
-    users = models.get_all_fit_users()
-    userstats = []
-    for user in users:
-        fav_sport, avg_intensity, fav_time = models.get_user_stats(user["id"])
-        userstats.append({
-            "name": user["name"],
-            "surname": user["surname"],
-            "fav_sport": fav_sport,
-            "avg_intensity": avg_intensity,
-            "fav_time": fav_time
-        })
-    return render_template("fitnesstracker/users_list.html", userstats=userstats)
-
-@app.route("/majasdarbi/fitnesstracker/delete_workout/<int:workout_id>", methods=["GET", "POST"])
-def fit_delete_workout_confirm(workout_id):
-    if request.method == "POST":
-        models.delete_workout(work)
\ No newline at end of file
+# --- JSON API (/api/v1) ---
+# For bots and the mobile UI. Logged in with the same session cookie as the
+# pages. Reads send an ETag from the data versions and answer 304 if the
+# client already has the data.
+API_MAX_ACTIONS = 100
+
+def api_error(message, status):
+    return jsonify(error=message), status
+
+def api_body():
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
+
+def api_credentials():
+    data = api_body()
+    return str(data.get("username", "")), str(data.get("password", ""))
+
+def api_retry_later(message, status, seconds):
+    response = jsonify(error=message)
+    response.status_code = status
+    response.headers["Retry-After"] = str(int(seconds))
+    return response
+
+@route("/api/v1/register", methods=["POST"])
+def api_register():
+    username, password = api_credentials()
+    if not username or not password:
+        return api_error("username and password required", 400)
+    if not credentials.allow_attempt(f"register:{request.remote_addr}"):
+        return api_retry_later("too many attempts", 429, credentials.CREDENTIALS_CONFIG["window"])
+    try:
+        if not register_user(username, password):
+            return api_error("username taken", 409)
+    except credentials.Busy:
+        return api_retry_later("server busy", 503, 1)
+    return jsonify(id=models.get_game_user(username)["id"]), 201
+
+@route("/api/v1/login", methods=["POST"])
+def api_login():
+    username, password = api_credentials()
+    if not credentials.allow_attempt(f"ip:{request.remote_addr}", f"login:{username}"):
+        return api_retry_later("too many attempts", 429, credentials.CREDENTIALS_CONFIG["window"])
+    try:
+        user = check_login(username, password)
+    except credentials.Busy:
+        return api_retry_later("server busy", 503, 1)
+    if not user:
+        return api_error("login failed", 401)
+    session["user_id"] = user["id"]
+    return jsonify(id=user["id"])
+
+@route("/api/v1/logout", methods=["POST"])
+def api_logout():
+    session.clear()
+    return "", 204
+
+@route("/api/v1/start", methods=["POST"])
+def api_start():
+    if "user_id" not in session:
+        return api_error("login required", 401)
+    game_id, game = gamestate.start(session["user_id"])
+    session["game_id"] = game_id
+    return jsonify(health=game.health, battle_points=game.battle_points), 201
+
+# {"actions": ["fight", "fight", "run"]} (or {"action": "fight"}) is played
+# in order in one request; actions after the game is over are ignored.
+# The game state is written once per request and the game saved once at the end.
+@route("/api/v1/play", methods=["POST"])
+def api_play():
+    if "user_id" not in session:
+        return api_error("login required", 401)
+    if "game_id" not in session:
+        return api_error("no game running", 409)
+    data = api_body()
+    actions = data.get("actions", [data["action"]] if "action" in data else [])
+    if not isinstance(actions, list) or not 0 < len(actions) <= API_MAX_ACTIONS:
+        return api_error(f"send 1-{API_MAX_ACTIONS} actions", 400)
+    if any(action not in ("fight", "run") for action in actions):
+        return api_error("actions are fight or run", 400)
+    user_id, game_id = session["user_id"], session["game_id"]
+    played = 0
+
+    def play_actions(game):
+        nonlocal played
+        played = 0
+        for action in actions:
+            played += 1
+            if action == "run" or rules.fight(game):
+                return True
+        return False
+
+    game, over = gamestate.apply(game_id, user_id, play_actions)
+    if game is None:
+        session.pop("game_id", None)
+        return api_error("no game running", 409)
+    if over:
+        save_game(user_id, game)
+        session.pop("game_id", None)
+    return jsonify(health=rules.final_health(game.health), battle_points=game.battle_points, over=over, played=played)
+
+@route("/api/v1/dashboard")
+@httpcache.etag_for("game_users", per_user=True, login_required=True)
+def api_dashboard():
+    if "user_id" not in session:
+        return api_error("login required", 401)
+    user = get_dashboard_user(session["user_id"])
+    if user is None:
+        return api_error("no such user", 404)
+    return jsonify(user)
+
+@route("/api/v1/rangs")
+@httpcache.etag_for("game_users", per_user=True)
+def api_rangs():
+    sort = sort_arg()
+    page, my_rank = load_rangs(sort, request.args.get("after"), page_size_arg())
+    return jsonify(dict(page, sort=sort, my_rank=my_rank))
+
+@cli.command("sync-levels")
+def sync_levels_command():
+    """Recompute users.level for every player from the current level curve."""
+    changed = models.sync_user_levels()
+    click.echo(f"{changed} players moved to a different level")
+    db.release_connections()
+
+@cli.command("check-plans")
+def check_plans_command():
+    """Fail if a hot query (models.hot_queries) full-scans a table or reads one it shouldn't."""
+    failed = False
+    for name, dbfile, sql, params, forbid in models.hot_queries():
+        problems = db.plan_problems(dbfile, sql, params, forbid_tables=forbid)
+        for problem in problems:
+            click.echo(f"{name}: {problem}")
+        failed = failed or bool(problems)
+    db.release_connections()
+    if failed:
+        raise SystemExit(1)
+    click.echo("query plans OK")
+
+@cli.command("simulate")
+@click.option("--strategy", "strategies", multiple=True, default=("fight",), show_default=True,
+              help='"fight" (until death) or "run-at:HEALTH"; repeatable')
+@click.option("--sweep", type=int, default=None, help="Also run-at every multiple of this health")
+@click.option("--games", type=int, default=1000000, show_default=True, help="Games per strategy")
+@click.option("--players", type=int, default=10000, show_default=True, help="Careers per strategy (games to level)")
+@click.option("--levels", "levels_file", default=None, help="Level curve to try (default: LEVELS_FILE)")
+@click.option("--workers", type=int, default=None, help="Processes (default: one per CPU)")
+@click.option("--seed", type=int, default=None)
+@click.option("--json", "json_path", default=None, help="Also write the results here")
+@click.option("--check", is_flag=True, help="Compare with games played one by one through rules.fight")
+def simulate_command(strategies, sweep, games, players, levels_file, workers, seed, json_path, check):
+    """Monte Carlo game balance: battle points, games to level, experience per level."""
+    try:
+        import simulate  # numpy; only this command needs it
+    except ImportError as e:
+        raise click.ClickException(f"simulate needs numpy ({e})")
+    try:
+        run_ats = [simulate.parse_strategy(text) for text in strategies]
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--strategy")
+    if sweep:
+        run_ats += range(sweep, rules.START_HEALTH, sweep)
+    run_ats = sorted(set(run_ats))
+    results, seed = simulate.run(run_ats, games, players, levels_file or current_app.config["LEVELS_FILE"],
+                                 workers, seed)
+    for name, result in results.items():
+        g = result["games"]
+        points = g["battle_points"]
+        click.echo(f"{name}: {g['games']} games, battle points {points['mean']:.1f} +- {points['std']:.1f} "
+                   f"(p10 {points['p10']}, p50 {points['p50']}, p90 {points['p90']}), "
+                   f"{g['fights_per_game']:.2f} fights, {g['deaths']:.0%} deaths, "
+                   f"{g['experience_per_game']:.1f} exp per game")
+        click.echo(f"  {'level':>5} {'exp':>6} {'reached':>8} {'games':>7} {'p50':>5} {'p90':>5} "
+                   f"{'at prev.':>8} {'exp on arrival':>14}")
+        for row in result["careers"]["levels"]:
+            values = [row["games_mean"], row["games_p50"], row["games_p90"], row["games_at_previous_level"],
+                      row["experience_on_arrival"]]
+            mean, p50, p90, previous, arrival = ("-" if v is None else f"{v:.1f}" for v in values)
+            click.echo(f"  {row['level']:>5} {row['threshold']:>6} {row['reached']:>8.1%} {mean:>7} {p50:>5} "
+                       f"{p90:>5} {previous:>8} {arrival:>14}")
+        if check:
+            one_by_one, batched = simulate.check_rules(run_ats[list(results).index(name)], 100000, seed)
+            click.echo(f"  check: rules.fight {one_by_one:.2f}, batched {batched:.2f} mean battle points")
+    click.echo(f"seed {seed}")
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump({"seed": seed, "results": results}, f, indent=2)
+
+def echo_archive_progress(stats):
+    if stats["batches"] % 50 == 0:
+        click.echo(f"  {stats['games']} games moved, longest write lock {stats['longest_lock_ms']:.1f} ms", err=True)
+
+@cli.command("archive-games")
+@click.option("--days", type=int, default=None, help="Archive games older than this (default: ARCHIVE_AFTER_DAYS)")
+@click.option("--batch-rows", type=int, default=None, help="Games per transaction (default: ARCHIVE_BATCH_ROWS)")
+@click.option("--max-batches", type=int, default=None, help="Stop after this many; the next run goes on from there")
+@click.option("--no-vacuum", is_flag=True, help="Leave the freed pages in playgame.db")
+@click.option("--full-vacuum", is_flag=True,
+              help="First switch an older playgame.db to incremental auto-vacuum (one VACUUM, locks the db)")
+@click.option("--verify", "verify_only", is_flag=True, help="Only check that live plus archived games add up")
+def archive_games_command(days, batch_rows, max_batches, no_vacuum, full_vacuum, verify_only):
+    """Move old games to the archive db, keeping per-user totals, and reclaim the space."""
+    if not verify_only:
+        if full_vacuum:
+            db.full_vacuum("playgame.db")
+            click.echo("playgame.db: rewritten with auto_vacuum = INCREMENTAL")
+        stats = archive.archive_games(days, batch_rows, max_batches, echo_archive_progress)
+        click.echo(f"{stats['games']} games played before {stats['cutoff']} UTC moved to "
+                   f"{archive.ARCHIVE_CONFIG['path']} in {stats['batches']} batches, "
+                   f"longest write lock {stats['longest_lock_ms']:.1f} ms")
+        if not no_vacuum:
+            sizes = archive.reclaim_space("playgame.db")
+            if sizes is None:
+                click.echo("playgame.db: not in incremental auto-vacuum mode, space not reclaimed "
+                           "(run once with --full-vacuum)")
+            else:
+                click.echo(f"playgame.db: {sizes[0] / 2**20:.1f} MiB -> {sizes[1] / 2**20:.1f} MiB")
+    mismatched, archived, summarized = archive.verify()
+    db.release_connections()
+    click.echo(f"{archived} archived games, {summarized} in the per-user summaries")
+    if mismatched or archived != summarized:
+        click.echo(f"{len(mismatched)} users don't add up, e.g. {mismatched[:10]}")
+        raise SystemExit(1)
+    click.echo("live plus archived games match every user's totals")
+
+@cli.command("migrate")
+def migrate_command():
+    """Bring both databases up to the latest schema version (run once per deploy)."""
+    dbfiles = current_app.config["DB_FILES"]
+    # levels are synced once below, after every db is migrated
+    for dbfile, applied in init_databases(dbfiles, sync_levels=False).items():
+        for version, description in applied:
+            click.echo(f"{dbfile}: {version} {description}")
+    for dbfile in dbfiles:
+        click.echo(f"{dbfile}: at version {migrations.current_version(db.get_connection(dbfile))}")
+    click.echo(f"{models.sync_user_levels()} players moved to a different level")
+    db.release_connections()
+
+
+# WSGI servers and `flask` load `app` from this module; it is only built when
+# first asked for, so importing the module stays cheap.
+def __getattr__(name):
+    global app
+    if name == "app":
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
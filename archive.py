@@ -0,0 +1,207 @@
+import datetime
+import itertools
+import os
+import time
+
+import db
+import migrations
+
+# ---- GAME ARCHIVE CONFIG ----
+# path         - archive db the old games move to (migrations.py "archive" schema)
+# after_days   - games older than this are archived
+# batch_rows   - games moved per transaction; playgame.db is write-locked for
+#                one batch at a time, so requests wait at most that long
+# pause_ms     - sleep between batches, to let waiting writers in
+# vacuum_pages - free pages given back to the file system per incremental
+#                VACUUM step, also one short write each
+ARCHIVE_CONFIG = {
+    "path": "playgame_archive.db",
+    "after_days": 180,
+    "batch_rows": 2000,
+    "pause_ms": 20,
+    "vacuum_pages": 2000,
+}
+
+GAME_DB = "playgame.db"
+
+
+def init_db():
+    """Create or upgrade the archive db; returns the migrations run."""
+    applied = migrations.migrate(ARCHIVE_CONFIG["path"], "archive")
+    db.init_storage(ARCHIVE_CONFIG["path"])
+    return applied
+
+
+# ---- MOVING ----
+# Oldest first by id, which is the order games were played in, so each batch
+# is a range of ids and the archived games always have the lowest ones.
+OLDEST_GAMES = "SELECT id, user_id, health, battle_points, timestamp FROM games ORDER BY id LIMIT ?"
+
+# Sums up one batch per user into archived_game_stats (games without a user
+# are moved, but have no leaderboard columns to add up to)
+ROLL_UP = """
+    INSERT INTO archived_game_stats (user_id, game_count, battle_points_total, best_battle_points,
+                                     first_played, last_played)
+    SELECT user_id, COUNT(*), IFNULL(SUM(battle_points), 0), IFNULL(MAX(battle_points), 0),
+           MIN(timestamp), MAX(timestamp)
+    FROM games WHERE id BETWEEN ? AND ? AND user_id IS NOT NULL GROUP BY user_id
+    ON CONFLICT(user_id) DO UPDATE SET
+        game_count = game_count + excluded.game_count,
+        battle_points_total = battle_points_total + excluded.battle_points_total,
+        best_battle_points = MAX(best_battle_points, excluded.best_battle_points),
+        first_played = COALESCE(MIN(first_played, excluded.first_played), first_played, excluded.first_played),
+        last_played = COALESCE(MAX(last_played, excluded.last_played), last_played, excluded.last_played)
+"""
+
+
+def _cutoff(after_days):
+    # games.timestamp is CURRENT_TIMESTAMP: UTC, "YYYY-MM-DD HH:MM:SS"
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=after_days)
+    return cutoff.strftime("%Y-%m-%d %H:%M:%S")
+
+
+@db.retry_on_busy
+def _copy(games):
+    conn = db.get_connection(ARCHIVE_CONFIG["path"])
+    # OR IGNORE: a batch copied before a crash, but not yet deleted, is copied again
+    conn.executemany("INSERT OR IGNORE INTO games (id, user_id, health, battle_points, timestamp) "
+                     "VALUES (?, ?, ?, ?, ?)", games)
+    conn.commit()
+
+
+@db.retry_on_busy
+def _roll_up(first, last):
+    """Add games first..last to the summaries and delete them, in one write; (deleted, seconds locked)."""
+    conn = db.get_connection(GAME_DB)
+    if conn.in_transaction:
+        conn.commit()
+    start = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # summed from what is still there, so a batch that another run
+        # already moved adds nothing
+        conn.execute(ROLL_UP, (first, last))
+        deleted = conn.execute("DELETE FROM games WHERE id BETWEEN ? AND ?", (first, last)).rowcount
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return deleted, time.perf_counter() - start
+
+
+def archive_games(after_days=None, batch_rows=None, max_batches=None, progress=None):
+    """Move games older than after_days into the archive db, batch_rows at a time.
+
+    Each batch is copied and committed to the archive first, then summed up
+    and deleted from playgame.db in one short transaction, so a crash in
+    between leaves the games in both places and the next run finishes the
+    move. Returns {"games", "batches", "longest_lock_ms", "cutoff"}.
+    """
+    after_days = ARCHIVE_CONFIG["after_days"] if after_days is None else after_days
+    batch_rows = batch_rows or ARCHIVE_CONFIG["batch_rows"]
+    init_db()
+    cutoff = _cutoff(after_days)
+    stats = {"games": 0, "batches": 0, "longest_lock_ms": 0.0, "cutoff": cutoff}
+    conn = db.get_connection(GAME_DB)
+    while max_batches is None or stats["batches"] < max_batches:
+        rows = conn.execute(OLDEST_GAMES, (batch_rows,)).fetchall()
+        old = [tuple(g) for g in itertools.takewhile(lambda g: (g["timestamp"] or "") < cutoff, rows)]
+        if not old:
+            break
+        _copy(old)
+        deleted, seconds = _roll_up(old[0][0], old[-1][0])
+        stats["games"] += deleted
+        stats["batches"] += 1
+        stats["longest_lock_ms"] = max(stats["longest_lock_ms"], seconds * 1000)
+        if progress:
+            progress(stats)
+        if len(old) < batch_rows:
+            break  # reached the first game that is new enough to stay
+        time.sleep(ARCHIVE_CONFIG["pause_ms"] / 1000)
+    return stats
+
+
+def reclaim_space(dbfile=GAME_DB, max_steps=None):
+    """Give the free pages of dbfile back with incremental VACUUM steps.
+
+    Returns (bytes before, bytes after), or None when the db is not in
+    auto_vacuum = INCREMENTAL mode (see db.full_vacuum).
+    """
+    mode, pages, free, page_size = db.space(dbfile)
+    if mode != 2:  # 2: INCREMENTAL
+        return None
+    before = os.path.getsize(dbfile)
+    steps = 0
+    while free and (max_steps is None or steps < max_steps):
+        free = db.incremental_vacuum(dbfile, ARCHIVE_CONFIG["vacuum_pages"])
+        steps += 1
+        time.sleep(ARCHIVE_CONFIG["pause_ms"] / 1000)
+    # in WAL mode the file only shrinks once the truncation is checkpointed
+    db.checkpoint(dbfile, "TRUNCATE")
+    return before, os.path.getsize(dbfile)
+
+
+# ---- CHECKING ----
+# Users whose leaderboard columns don't match live games plus their summary
+USER_TOTALS_MISMATCH = """
+    SELECT u.id FROM users u
+    LEFT JOIN (SELECT user_id, COUNT(*) AS n, SUM(battle_points) AS total, MAX(battle_points) AS best
+               FROM games GROUP BY user_id) g ON g.user_id = u.id
+    LEFT JOIN archived_game_stats a ON a.user_id = u.id
+    WHERE u.game_count != IFNULL(g.n, 0) + IFNULL(a.game_count, 0)
+       OR u.battle_points_total != IFNULL(g.total, 0) + IFNULL(a.battle_points_total, 0)
+       OR u.best_battle_points != MAX(IFNULL(g.best, 0), IFNULL(a.best_battle_points, 0))
+"""
+
+
+def verify():
+    """(user ids that don't add up, games in the archive db, games the summaries count)."""
+    conn = db.get_connection(GAME_DB)
+    mismatched = [row["id"] for row in conn.execute(USER_TOTALS_MISMATCH)]
+    summarized = conn.execute("SELECT IFNULL(SUM(game_count), 0) FROM archived_game_stats").fetchone()[0]
+    archived = 0
+    if os.path.exists(ARCHIVE_CONFIG["path"]):
+        archived = db.get_connection(ARCHIVE_CONFIG["path"]).execute(
+            "SELECT COUNT(*) FROM games WHERE user_id IS NOT NULL").fetchone()[0]
+    return mismatched, archived, summarized
+
+
+# ---- READING ----
+STATS_QUERY = "SELECT * FROM archived_game_stats WHERE user_id = ?"
+GAMES_BY_USER = "SELECT * FROM games WHERE user_id = ?"
+
+
+def get_stats(user_id):
+    """What was archived of the user's games, or None when nothing was."""
+    row = db.get_connection(GAME_DB).execute(STATS_QUERY, (user_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def user_games(user_id, before=None):
+    """Cursor over the user's archived games older than game id before, newest
+    first; None when the user has none, without opening the archive db."""
+    if get_stats(user_id) is None:
+        return None
+    c = db.get_connection(ARCHIVE_CONFIG["path"]).cursor()
+    if before:
+        c.execute(GAMES_BY_USER + " AND id < ? ORDER BY id DESC", (user_id, before))
+    else:
+        c.execute(GAMES_BY_USER + " ORDER BY id DESC", (user_id,))
+    return c
+
+
+def configure(**options):
+    for name, value in options.items():
+        if value is not None:
+            ARCHIVE_CONFIG[name] = value
+
+
+# ---- FLASK ----
+def init_app(app):
+    configure(
+        path=app.config.get("ARCHIVE_DB"),
+        after_days=app.config.get("ARCHIVE_AFTER_DAYS"),
+        batch_rows=app.config.get("ARCHIVE_BATCH_ROWS"),
+        pause_ms=app.config.get("ARCHIVE_PAUSE_MS"),
+        vacuum_pages=app.config.get("ARCHIVE_VACUUM_PAGES"),
+    )
@@ -0,0 +1,237 @@
+import atexit
+import datetime
+import glob
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: one worker process, so write_lock is enough
+    fcntl = None
+
+# ---- AUDIT LOG CONFIG ----
+# path        - current JSONL segment; rotated ones get a timestamp suffix
+# buffer_size - events buffered before a write; if the flusher falls behind,
+#               the request that fills the buffer writes it out itself
+#               (counted as an inline flush), so no event is ever dropped
+# flush_ms    - how often the background thread writes the buffer out
+# max_bytes / max_age - rotate the segment when either is reached
+# compress    - gzip rotated segments
+# Workers take an flock on <path>.lock to append or rotate, so none can
+# append to a segment another has just rotated away.
+AUDIT_CONFIG = {
+    "path": "kontrole.jsonl",
+    "buffer_size": 10000,
+    "flush_ms": 500,
+    "max_bytes": 10 * 1024 * 1024,
+    "max_age": 24 * 3600,
+    "compress": True,
+}
+
+
+class AuditLog:
+    def __init__(self, path, buffer_size, flush_ms, max_bytes, max_age, compress):
+        self.path = path
+        self.flush_s = flush_ms / 1000.0
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compress = compress
+        self.segment_started = None
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.stats = {"events": 0, "inline_flushes": 0, "flushes": 0, "rotations": 0, "write_errors": 0}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="audit-log", daemon=True)
+        self.thread.start()
+
+    def log(self, event, **fields):
+        record = {"ts": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds"),
+                  "event": event}
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.buffer.append(line)
+            self.stats["events"] += 1
+            full = len(self.buffer) >= self.buffer_size
+            if full:
+                self.stats["inline_flushes"] += 1
+        if full:
+            # a gap would make the log useless for replay: slow this caller down instead
+            self.flush()
+
+    def _run(self):
+        while not self.stop_event.wait(self.flush_s):
+            try:
+                self.flush()
+            except OSError:
+                pass  # counted in stats; retried on the next tick
+        self.flush()
+
+    def flush(self):
+        # batches are taken under write_lock, so they are written in order
+        with self.write_lock:
+            with self.lock:
+                if not self.buffer:
+                    return
+                lines, self.buffer = self.buffer, []
+            rotated = None
+            try:
+                with open(self.path + ".lock", "a") as lock_file:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    rotated = self._maybe_rotate()
+                    # one write per batch; O_APPEND keeps lines from other workers whole
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write("".join(lines))
+            except OSError:
+                # keep them for the next flush, ahead of anything logged since
+                with self.lock:
+                    self.buffer[:0] = lines
+                    self.stats["write_errors"] += 1
+                raise
+            finally:
+                # outside the flock: nobody appends to a rotated segment
+                if rotated and self.compress:
+                    _compress(rotated)
+            self.stats["flushes"] += 1
+
+    def _maybe_rotate(self):
+        """Rename the segment away when it is due; returns the new name, or None."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self.segment_started = None
+            return None
+        if self.segment_started is None:
+            self.segment_started = _segment_started(self.path, st)
+        if st.st_size < self.max_bytes and time.time() - self.segment_started < self.max_age:
+            return None
+        # microseconds keep the names unique and in order when sorted
+        rotated = f"{self.path}.{datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+        os.replace(self.path, rotated)
+        self.segment_started = None
+        self.stats["rotations"] += 1
+        return rotated
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+
+def _compress(rotated):
+    with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(rotated)
+
+
+def _segment_started(path, st):
+    # first record's timestamp; fall back to the file's ctime
+    try:
+        with open(path, encoding="utf-8") as f:
+            ts = json.loads(f.readline())["ts"]
+        return datetime.datetime.fromisoformat(ts).timestamp()
+    except (OSError, ValueError, KeyError):
+        return st.st_ctime
+
+
+_log = None
+_log_pid = None
+_log_lock = threading.Lock()
+
+
+def _get_log():
+    # started lazily, so a forked worker gets its own flusher thread
+    global _log, _log_pid
+    if _log is None or _log_pid != os.getpid():
+        with _log_lock:
+            if _log is None or _log_pid != os.getpid():
+                _log = AuditLog(**AUDIT_CONFIG)
+                _log_pid = os.getpid()
+    return _log
+
+
+def log(event, **fields):
+    _get_log().log(event, **fields)
+
+
+def flush():
+    """Write buffered events now, e.g. after a bulk batch."""
+    if _log is not None and _log_pid == os.getpid():
+        _log.flush()
+
+
+def stats():
+    return dict(_log.stats) if _log is not None else {}
+
+
+@atexit.register
+def shutdown():
+    global _log
+    if _log is not None and _log_pid == os.getpid():
+        _log.stop()
+    _log = None
+
+
+def configure(**options):
+    shutdown()
+    for name, value in options.items():
+        if value is not None:
+            AUDIT_CONFIG[name] = value
+
+
+# ---- REPLAY ----
+def segments(path=None):
+    """Rotated segments oldest first, then the current one."""
+    path = path or AUDIT_CONFIG["path"]
+    rotated = sorted(p for p in glob.glob(glob.escape(path) + ".*") if not p.endswith((".tmp", ".lock")))
+    return rotated + ([path] if os.path.exists(path) else [])
+
+
+def read_events(path=None):
+    for segment in segments(path):
+        opener = gzip.open if segment.endswith(".gz") else open
+        with opener(segment, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def replay_workouts(events):
+    """workout id -> (user_id, sport_id, intensity, day_time, created_at) after applying every event."""
+    workouts = {}
+    for event in events:
+        if event["event"] == "workout_added":
+            # events from before workouts had created_at have none
+            workouts[event["workout_id"]] = (event["user_id"], event["sport_id"], event["intensity"], event["day_time"],
+                                             event.get("created_at"))
+        elif event["event"] == "workout_deleted":
+            workouts.pop(event["workout_id"], None)
+    return workouts
+
+
+def first_added_workout(events):
+    """Id of the first workout the log saw added, or None; workouts with lower
+    ids were added before the log was kept."""
+    for event in events:
+        if event["event"] == "workout_added":
+            return event["workout_id"]
+    return None
+
+
+# ---- FLASK ----
+def init_app(app):
+    configure(
+        path=app.config.get("AUDIT_LOG"),
+        buffer_size=app.config.get("AUDIT_BUFFER_SIZE"),
+        flush_ms=app.config.get("AUDIT_FLUSH_MS"),
+        max_bytes=app.config.get("AUDIT_MAX_BYTES"),
+        max_age=app.config.get("AUDIT_MAX_AGE"),
+        compress=app.config.get("AUDIT_COMPRESS"),
+    )
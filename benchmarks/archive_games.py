@@ -0,0 +1,87 @@
+"""Game archival: how long writers wait on it, space given back, /my_games in the archive.
+
+    python benchmarks/archive_games.py --games 1000000 --batch-rows 2000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from common import load_app, login_client, timed
+from loadtest import seed_games
+
+
+def writer(models, users, stop, latencies):
+    rng = random.Random(0)
+    while not stop.is_set():
+        start = time.perf_counter()
+        models.add_game(rng.randint(1, users), 0, rng.randint(10, 300))
+        latencies.append(time.perf_counter() - start)
+    models.db.release_connections()
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return [latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1000 for p in (0.5, 0.99, 1.0)]
+
+
+def while_writing(models, users, func, *args):
+    stop = threading.Event()
+    latencies = []
+    thread = threading.Thread(target=writer, args=(models, users, stop, latencies))
+    thread.start()
+    seconds, result = timed(func, *args)
+    stop.set()
+    thread.join()
+    return seconds, result, latencies
+
+
+def page_ms(client, path, repeat):
+    seconds, _ = timed(lambda: [client.get(path) for _ in range(repeat)])
+    return seconds / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--batch-rows", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=180)
+    args = parser.parse_args()
+
+    app_module = load_app()
+    models, archive = app_module.models, app_module.archive
+    conn = sqlite3.connect("playgame.db")
+    seed_games(conn, random.Random(1), args.users, args.games, "bench")
+    conn.commit()
+    conn.close()
+    client = login_client(app_module.app, "bench")
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+    before_size = os.path.getsize("playgame.db")
+
+    _, _, idle = while_writing(models, args.users, time.sleep, 2.0)
+    seconds, stats, busy = while_writing(models, args.users, archive.archive_games, args.days, args.batch_rows)
+    vacuum_seconds, _, vacuum = while_writing(models, args.users, archive.reclaim_space)
+    models.db.release_connections()
+
+    print(f"{stats['games']} of {args.games} games archived in {seconds:.1f}s, {stats['batches']} batches, "
+          f"longest write lock {stats['longest_lock_ms']:.1f} ms; incremental VACUUM {vacuum_seconds:.1f}s")
+    print(f"playgame.db {before_size / 2**20:.1f} MiB -> {os.path.getsize('playgame.db') / 2**20:.1f} MiB, "
+          f"archive {os.path.getsize(archive.ARCHIVE_CONFIG['path']) / 2**20:.1f} MiB")
+    print(f"{'add_game while':<22} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, latencies in (("idle", idle), ("archiving", busy), ("vacuuming", vacuum)):
+        print(f"{name:<22} " + " ".join(f"{value:>8.2f}" for value in percentiles(latencies)))
+
+    with app_module.app.app_context():
+        oldest_live = models.get_db("playgame.db").execute(
+            "SELECT MIN(id) FROM games WHERE user_id = 1").fetchone()[0]
+        models.db.release_connections()
+    print(f"/my_games first page {page_ms(client, '/my_games', 200):.2f} ms, "
+          f"archived page {page_ms(client, f'/my_games?before={oldest_live}', 200):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
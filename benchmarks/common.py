@@ -0,0 +1,34 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(workdir=None):
+    """Import app.py with a fresh playgame.db/fitnesstracker.db in workdir."""
+    workdir = workdir or tempfile.mkdtemp(prefix="bench_")
+    for name in ("texts.json", "level_requirements.json"):
+        shutil.copy(os.path.join(ROOT, name), workdir)
+    os.chdir(workdir)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import app as app_module
+    app_module.app.testing = True
+    app_module.init_databases(app_module.app.config["DB_FILES"])
+    return app_module
+
+
+def login_client(app, username, password="bench"):
+    client = app.test_client()
+    client.post("/register", data={"username": username, "password": password})
+    client.post("/login", data={"username": username, "password": password})
+    return client
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
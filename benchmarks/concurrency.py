@@ -0,0 +1,69 @@
+"""Reader throughput on /rangs and /dashboard while writers hammer /play.
+
+    python benchmarks/concurrency.py --journal-mode WAL
+    python benchmarks/concurrency.py --journal-mode DELETE
+"""
+import argparse
+import threading
+import time
+
+from common import load_app, login_client
+
+
+def writer(client, stop, stats):
+    while not stop.is_set():
+        client.get("/start_game")
+        r = client.post("/play", data={"action": "run"})
+        key = "writes" if r.status_code == 302 else "write_errors"
+        stats[key] += 1
+
+
+def reader(client, stop, stats):
+    paths = ["/rangs", "/dashboard"]
+    i = 0
+    while not stop.is_set():
+        r = client.get(paths[i % 2])
+        i += 1
+        key = "reads" if r.status_code == 200 else "read_errors"
+        stats[key] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--journal-mode", default="WAL")
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    app_module = load_app()
+    app = app_module.app
+    app.config["PROPAGATE_EXCEPTIONS"] = False
+    db = app_module.db
+    for dbfile in app.config["DB_FILES"]:
+        print(dbfile, "journal_mode =", db.init_storage(dbfile, args.journal_mode))
+
+    stop = threading.Event()
+    threads, all_stats = [], []
+    for i in range(args.writers + args.readers):
+        stats = {"writes": 0, "write_errors": 0, "reads": 0, "read_errors": 0}
+        client = login_client(app, f"bench{i}")
+        target = writer if i < args.writers else reader
+        threads.append(threading.Thread(target=target, args=(client, stop, stats)))
+        all_stats.append(stats)
+
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    total = {k: sum(s[k] for s in all_stats) for k in all_stats[0]}
+    print(f"writers={args.writers} readers={args.readers} seconds={args.seconds}")
+    print(f"reads/s   {total['reads'] / args.seconds:10.1f}  errors {total['read_errors']}")
+    print(f"writes/s  {total['writes'] / args.seconds:10.1f}  errors {total['write_errors']}")
+
+
+if __name__ == "__main__":
+    main()
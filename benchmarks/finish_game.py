@@ -0,0 +1,66 @@
+"""Game-over commits/sec: add_game + update_user_experience vs. finish_game.
+
+    python benchmarks/finish_game.py --games 2000
+    python benchmarks/finish_game.py --games 2000 --write-behind
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+from common import ROOT, timed
+
+
+def two_commits(models, user_ids, games):
+    for _ in range(games):
+        user_id, points = random.choice(user_ids), random.randint(10, 300)
+        models.add_game(user_id, 0, points)
+        models.update_user_experience(user_id, points)
+
+
+def one_commit(models, user_ids, games):
+    for _ in range(games):
+        models.finish_game(random.choice(user_ids), 0, random.randint(10, 300))
+
+
+def one_commit_batched(models, user_ids, games):
+    import writebehind
+    writebehind.configure(enabled=True)
+    one_commit(models, user_ids, games)
+    # include the time to drain the queue
+    writebehind.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--synchronous", default="NORMAL", help="PRAGMA synchronous for the run")
+    parser.add_argument("--write-behind", action="store_true", help="also run finish_game through the batching queue")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    os.chdir(tempfile.mkdtemp(prefix="bench_"))
+    shutil.copy(os.path.join(ROOT, "level_requirements.json"), ".")
+    import db
+    import models
+
+    db.configure(pragmas={"synchronous": args.synchronous})
+    models.init_db("playgame.db")
+    db.init_storage("playgame.db")
+    for i in range(args.users):
+        models.add_game_user(f"bench{i}", "bench")
+    user_ids = list(range(1, args.users + 1))
+
+    runs = [("add_game + update_user_experience", two_commits), ("finish_game", one_commit)]
+    if args.write_behind:
+        runs.append(("finish_game (write-behind)", one_commit_batched))
+    for name, run in runs:
+        seconds, _ = timed(run, models, user_ids, args.games)
+        print(f"{name:<36} {args.games / seconds:10.1f} games/s")
+
+
+if __name__ == "__main__":
+    main()
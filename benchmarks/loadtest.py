@@ -0,0 +1,469 @@
+"""Load test of the game and fitness flows on seeded data: p50/p95/p99
+latency, throughput and peak RSS per route, saved as JSON so a CI run can
+be compared with a baseline.
+
+    python benchmarks/loadtest.py --users 100000 --games 1000000 --workouts 1000000 --out run.json
+    python benchmarks/loadtest.py --out run.json --baseline main.json --max-regression 15
+
+Against a running server instead of the Flask test client: seed a directory,
+start the app there with a high LOGIN_ATTEMPTS (all virtual users log in from
+one address), then point the test at it with the same scale options.
+
+    python benchmarks/loadtest.py --seed-only /srv/bench
+    cd /srv/bench && flask --app "app:create_app({'LOGIN_ATTEMPTS': 1000000000})" run
+    python benchmarks/loadtest.py --url http://127.0.0.1:5000 --server-pid 4242
+
+The seeded dbs are kept in --data-dir, one set per scale and seed, so only
+the first run at a scale pays for seeding; every run starts from a copy.
+"""
+import argparse
+import datetime
+import functools
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from common import ROOT
+
+DATA_FILES = ("texts.json", "level_requirements.json")
+DB_FILES = ("playgame.db", "fitnesstracker.db")
+PASSWORD = "bench"
+DAY_TIMES = ("Rīta treniņš", "Vakara treniņš")
+FITNESS = "/majasdarbi/fitnesstracker"
+
+
+# ---- SEEDING ----
+def seed_key(args):
+    import migrations
+    schema = "-".join(str(migrations.latest_version(name)) for name in migrations.MIGRATIONS)
+    return (f"u{args.users}-g{args.games}-f{args.fit_users}-s{args.sports}-w{args.workouts}"
+            f"-r{args.seed}-v{schema}")
+
+
+def seed_games(conn, rng, users, games, password):
+    # games first, in time order over the last year, so the users rows can
+    # carry the same leaderboard totals add_game would have kept
+    count, best, total, last = [0] * users, [0] * users, [0] * users, [None] * users
+    start = datetime.datetime.now() - datetime.timedelta(days=365)
+    step = 365 * 24 * 3600 / max(games, 1)
+
+    def game_rows():
+        for i in range(games):
+            user = rng.randrange(users)
+            points = rng.randint(10, 300)
+            health = 0 if rng.random() < 0.8 else rng.randint(1, 100)
+            timestamp = (start + datetime.timedelta(seconds=i * step)).strftime("%Y-%m-%d %H:%M:%S")
+            count[user] += 1
+            best[user] = max(best[user], points)
+            total[user] += points
+            last[user] = timestamp
+            yield user + 1, health, points, timestamp
+
+    conn.executemany("INSERT INTO games (user_id, health, battle_points, timestamp) VALUES (?, ?, ?, ?)",
+                     game_rows())
+    import levels
+    user_levels = levels.LevelCurve(os.path.join(ROOT, "level_requirements.json")).levels_for(total)
+    conn.executemany(
+        """INSERT INTO users (id, username, password, level, experience, game_count, best_battle_points,
+                              battle_points_total, last_played) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        ((i + 1, f"user{i + 1}", password, user_levels[i][0], total[i], count[i], best[i], total[i], last[i])
+         for i in range(users)))
+
+
+def seed_fitness(conn, rng, users, sports, workouts):
+    conn.executemany("INSERT INTO users (name, surname) VALUES (?, ?)",
+                     ((f"Vārds{i}", f"Uzvārds{rng.randrange(users)}") for i in range(users)))
+    conn.executemany("INSERT INTO sports (title) VALUES (?)", ((f"Sports{i}",) for i in range(sports)))
+    # logged over the last year, in id order; the user stats triggers keep the aggregates as they go
+    start = int(time.time()) - 365 * 24 * 3600
+    step = 365 * 24 * 3600 / max(workouts, 1)
+    conn.executemany(
+        "INSERT INTO workouts (user_id, sport_id, intensity, day_time, created_at) VALUES (?, ?, ?, ?, ?)",
+        ((rng.randint(1, users), rng.randint(1, sports), rng.randint(1, 5), rng.choice(DAY_TIMES), start + int(i * step))
+         for i in range(workouts)))
+
+
+def seed(args):
+    """Directory holding seeded copies of both dbs at the requested scale."""
+    directory = os.path.join(args.data_dir, seed_key(args))
+    manifest = os.path.join(directory, "seed.json")
+    if os.path.exists(manifest):
+        return directory
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    import credentials
+    import db
+    import migrations
+
+    start = time.perf_counter()
+    rng = random.Random(args.seed)
+    password = credentials.hash_password(PASSWORD)
+    for dbfile in DB_FILES:
+        path = os.path.join(directory, dbfile)
+        migrations.migrate(path)
+        db.release_connections()
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA synchronous = OFF")
+        if dbfile == "playgame.db":
+            seed_games(conn, rng, args.users, args.games, password)
+        else:
+            seed_fitness(conn, rng, args.fit_users, args.sports, args.workouts)
+        conn.commit()
+        conn.close()
+    seconds = time.perf_counter() - start
+    # written last: a directory without it is a seeding that didn't finish
+    with open(manifest, "w") as f:
+        json.dump({"key": seed_key(args), "seconds": seconds}, f)
+    print(f"seeded {directory} in {seconds:.1f}s", file=sys.stderr)
+    return directory
+
+
+def copy_seed(seed_dir, workdir):
+    os.makedirs(workdir, exist_ok=True)
+    for name in DB_FILES:
+        shutil.copy(os.path.join(seed_dir, name), workdir)
+    for name in DATA_FILES:
+        shutil.copy(os.path.join(ROOT, name), workdir)
+
+
+# ---- CLIENTS ----
+# A session is one virtual user: request(method, path, data) -> status code.
+# Neither follows redirects, so a redirect is timed as its own request.
+class TestClientSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code
+
+
+class HTTPSession:
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        self.conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=30)
+        self.prefix = parsed.path.rstrip("/")
+        self.cookies = {}
+
+    def request(self, method, path, data=None):
+        headers = {}
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+        body = None
+        if data is not None:
+            body = urllib.parse.urlencode(data)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        try:
+            self.conn.request(method, self.prefix + path, body, headers)
+            response = self.conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            return 0
+        for header in response.headers.get_all("Set-Cookie") or ():
+            name, _, value = header.split(";", 1)[0].partition("=")
+            self.cookies[name.strip()] = value
+        return response.status
+
+
+# ---- RSS ----
+def rss_reader(pids):
+    """Function returning the summed RSS of pids in bytes (None: this process)."""
+    page = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+    paths = [f"/proc/{pid or 'self'}/statm" for pid in pids or [None]]
+    if all(os.path.exists(path) for path in paths):
+        def read():
+            total = 0
+            for path in paths:
+                with open(path, "rb") as f:
+                    total += int(f.read().split()[1]) * page
+            return total
+        return read
+    if pids:
+        raise SystemExit("--server-pid needs /proc")
+    import resource
+    # no /proc (macOS): the peak so far, which only ever grows; bytes on macOS, KiB elsewhere
+    scale = 1 if sys.platform == "darwin" else 1024
+    return lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+# ---- FLOWS ----
+# What a virtual user does next, picked by --mix weights. Each is a list of
+# requests; the game flow fights until the game is over (a redirect).
+def flow_game(session, rng, record):
+    record(session, "GET", "/start_game")
+    for _ in range(50):
+        if record(session, "POST", "/play", {"action": "fight"}) != 200:
+            break
+    record(session, "GET", "/dashboard")
+
+def flow_dashboard(session, rng, record):
+    record(session, "GET", "/dashboard")
+
+def flow_rangs(session, rng, record):
+    record(session, "GET", "/rangs?sort=" + rng.choice(("game_count", "experience", "level")))
+
+def flow_fitness(session, rng, record):
+    record(session, "GET", FITNESS + "/users")
+    record(session, "GET", FITNESS + "/workouts")
+    record(session, "GET", FITNESS + "/analytics.json")
+
+def flow_login(session, rng, record, users=1):
+    # back in as one of the seeded users, who have a game history
+    record(session, "GET", "/logout")
+    record(session, "POST", "/login", {"username": f"user{rng.randint(1, users)}", "password": PASSWORD})
+
+FLOWS = {
+    "game": flow_game,
+    "dashboard": flow_dashboard,
+    "rangs": flow_rangs,
+    "fitness": flow_fitness,
+    "login": flow_login,
+}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in FLOWS:
+            raise SystemExit(f"unknown flow {name!r}, expected one of {', '.join(FLOWS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# ---- RUN ----
+class Recorder:
+    """Per-route latencies, errors and the highest RSS seen right after one."""
+
+    def __init__(self, read_rss, warmup_until):
+        self.read_rss = read_rss
+        self.warmup_until = warmup_until
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def __call__(self, session, method, path, data=None):
+        start = time.perf_counter()
+        status = session.request(method, path, data)
+        end = time.perf_counter()
+        if start >= self.warmup_until:
+            rss = self.read_rss()
+            label = f"{method} {path.split('?')[0]}"
+            with self.lock:
+                route = self.routes.get(label)
+                if route is None:
+                    route = self.routes[label] = {"latencies": [], "errors": 0, "rss": 0}
+                route["latencies"].append(end - start)
+                route["errors"] += status == 0 or status >= 400
+                route["rss"] = max(route["rss"], rss)
+        return status
+
+
+def virtual_user(number, make_session, args, mix, record, stop):
+    rng = random.Random(f"{args.seed}:{number}")
+    session = make_session()
+    username = f"load{args.seed}_{number}_{os.getpid()}"
+    record(session, "POST", "/register", {"username": username, "password": PASSWORD})
+    record(session, "POST", "/login", {"username": username, "password": PASSWORD})
+    names, weights = list(mix), list(mix.values())
+    flows = 0
+    while not stop.is_set() and (args.flows is None or flows < args.flows):
+        name = rng.choices(names, weights)[0]
+        if name == "login":
+            flow_login(session, rng, record, args.users)
+        else:
+            FLOWS[name](session, rng, record)
+        flows += 1
+
+
+def percentile(ordered, p):
+    # nearest rank
+    return ordered[max(int(round(p / 100 * len(ordered) + 0.5)) - 1, 0)]
+
+
+def summarize(routes, seconds):
+    summary = {}
+    for label, route in sorted(routes.items()):
+        ordered = sorted(route["latencies"])
+        summary[label] = {
+            "count": len(ordered),
+            "errors": route["errors"],
+            "rps": len(ordered) / seconds,
+            "mean_ms": sum(ordered) / len(ordered) * 1000,
+            "p50_ms": percentile(ordered, 50) * 1000,
+            "p95_ms": percentile(ordered, 95) * 1000,
+            "p99_ms": percentile(ordered, 99) * 1000,
+            "max_ms": ordered[-1] * 1000,
+            "peak_rss_mb": route["rss"] / 2 ** 20,
+        }
+    return summary
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args, mix):
+    if args.url:
+        target = args.url
+        make_session = functools.partial(HTTPSession, args.url)
+        read_rss = rss_reader(args.server_pid)
+    else:
+        target = "test-client"
+        workdir = tempfile.mkdtemp(prefix="bench_load_")
+        copy_seed(seed(args), workdir)
+        os.chdir(workdir)
+        import app as app_module
+        config = {"LOGIN_ATTEMPTS": 10 ** 9, "VERSIONS_DIR": os.path.join(workdir, "versions")}
+        config.update(json.loads(args.config))
+        app = app_module.create_app(config)
+        make_session = functools.partial(TestClientSession, app)
+        read_rss = rss_reader(None)
+
+    stop = threading.Event()
+    measured = time.perf_counter() + args.warmup
+    record = Recorder(read_rss, measured)
+    threads = [threading.Thread(target=virtual_user, args=(i, make_session, args, mix, record, stop), daemon=True)
+               for i in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    deadline = measured + args.duration
+    while any(t.is_alive() for t in threads) and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    stop.set()
+    for t in threads:
+        t.join()
+    seconds = max(time.perf_counter() - measured, 1e-9)
+    if not args.url:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    routes = summarize(record.routes, seconds)
+    count = sum(r["count"] for r in routes.values())
+    return {
+        "meta": {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "target": target,
+            "scale": {"users": args.users, "games": args.games, "fit_users": args.fit_users,
+                      "sports": args.sports, "workouts": args.workouts},
+            "seed": args.seed,
+            "concurrency": args.concurrency,
+            "seconds": seconds,
+            "mix": mix,
+            "config": json.loads(args.config),
+        },
+        "total": {
+            "count": count,
+            "errors": sum(r["errors"] for r in routes.values()),
+            "rps": count / seconds,
+            "peak_rss_mb": max((r["peak_rss_mb"] for r in routes.values()), default=0),
+        },
+        "routes": routes,
+    }
+
+
+# ---- REPORT ----
+def print_report(result):
+    print(f"{'route':<40} {'count':>8} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'RSS MB':>7}")
+    for label, r in result["routes"].items():
+        print(f"{label:<40} {r['count']:>8} {r['errors']:>5} {r['rps']:>8.1f} {r['p50_ms']:>8.2f} "
+              f"{r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['peak_rss_mb']:>7.1f}")
+    total = result["total"]
+    print(f"{'total':<40} {total['count']:>8} {total['errors']:>5} {total['rps']:>8.1f} {'':>26} "
+          f"{total['peak_rss_mb']:>7.1f}")
+
+
+def compare(result, baseline, max_regression, min_count):
+    """Routes whose p95 (or the total throughput) got worse by more than max_regression percent."""
+    failures = []
+    print(f"\n{'vs. baseline':<40} {'p95 ms':>17} {'change':>8}")
+    for label, r in result["routes"].items():
+        base = baseline["routes"].get(label)
+        if base is None or min(base["count"], r["count"]) < min_count:
+            continue
+        change = (r["p95_ms"] / base["p95_ms"] - 1) * 100
+        print(f"{label:<40} {base['p95_ms']:>8.2f}->{r['p95_ms']:>7.2f} {change:>+7.1f}%")
+        if change > max_regression:
+            failures.append(f"{label} p95 {change:+.1f}%")
+    change = (result["total"]["rps"] / baseline["total"]["rps"] - 1) * 100
+    print(f"{'total req/s':<40} {baseline['total']['rps']:>8.1f}->{result['total']['rps']:>7.1f} {change:>+7.1f}%")
+    if -change > max_regression:
+        failures.append(f"throughput {change:+.1f}%")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    scale = parser.add_argument_group("seeded data")
+    scale.add_argument("--users", type=int, default=10000, help="Game users")
+    scale.add_argument("--games", type=int, default=100000)
+    scale.add_argument("--fit-users", type=int, default=10000, help="Fitness tracker users")
+    scale.add_argument("--sports", type=int, default=50)
+    scale.add_argument("--workouts", type=int, default=100000)
+    scale.add_argument("--seed", type=int, default=1, help="Random seed for the data and the virtual users")
+    scale.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "pseudoxfit_loadtest"))
+    scale.add_argument("--seed-only", metavar="DIR", help="Copy the seeded dbs to DIR for a server and exit")
+    load = parser.add_argument_group("load")
+    load.add_argument("--url", help="Running server (default: the Flask test client in this process)")
+    load.add_argument("--server-pid", type=int, nargs="+", help="Its worker pids, for RSS (default: this process)")
+    load.add_argument("--config", default="{}", help="JSON overrides for create_app(), test client only")
+    load.add_argument("--concurrency", type=int, default=8, help="Virtual users, one thread each")
+    load.add_argument("--duration", type=float, default=30.0, help="Seconds measured")
+    load.add_argument("--warmup", type=float, default=3.0, help="Seconds run before measuring")
+    load.add_argument("--flows", type=int, default=None, help="Stop each virtual user after this many flows")
+    load.add_argument("--mix", default="game=5,dashboard=2,rangs=2,fitness=1,login=0.2",
+                      help=f"Flow weights; flows: {', '.join(FLOWS)}")
+    output = parser.add_argument_group("results")
+    output.add_argument("--out", help="Write the results as JSON")
+    output.add_argument("--baseline", help="Results JSON to compare with")
+    output.add_argument("--max-regression", type=float, default=10.0, help="Percent, for --baseline")
+    output.add_argument("--min-count", type=int, default=50, help="Requests a route needs to be compared")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    # run() changes into the test client's work dir
+    for name in ("data_dir", "seed_only", "out", "baseline"):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    if args.seed_only:
+        copy_seed(seed(args), args.seed_only)
+        print(f"seeded dbs copied to {args.seed_only}")
+        return
+
+    result = run(args, mix)
+    print_report(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        failures = compare(result, baseline, args.max_regression, args.min_count)
+        for failure in failures:
+            print(f"FAIL {failure}")
+        sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""/play time with metrics (route histograms, SQL and model timings) on and
+off. Each round times both, in random order, and the overhead is the median
+of the per-round ratios, so drift and noise hit both alike. Exits 1 when the
+overhead is over --max-overhead percent.
+
+    python benchmarks/metrics_overhead.py --rounds 60 --plays 20 --max-overhead 2
+"""
+import argparse
+import random
+import statistics
+import time
+
+from common import load_app, login_client
+
+
+def play_round(client, plays):
+    start = time.perf_counter()
+    for _ in range(plays):
+        client.get("/start_game")
+        while client.post("/play", data={"action": "fight"}).status_code == 200:
+            pass
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=60)
+    parser.add_argument("--plays", type=int, default=20, help="Games per round")
+    parser.add_argument("--max-overhead", type=float, default=None, help="Percent")
+    parser.add_argument("--no-sql", action="store_true", help="Leave per-statement timing off")
+    args = parser.parse_args()
+
+    app_module = load_app()
+    metrics = app_module.metrics
+    metrics.configure(sql=not args.no_sql)
+    client = login_client(app_module.app, "player")
+    play_round(client, 10)  # warm up
+
+    times = {False: [], True: []}
+    ratios = []
+    for _ in range(args.rounds):
+        for enabled in random.sample([False, True], 2):
+            metrics.configure(enabled=enabled)
+            times[enabled].append(play_round(client, args.plays))
+        ratios.append(times[True][-1] / times[False][-1])
+    off, on = statistics.median(times[False]), statistics.median(times[True])
+    overhead = (statistics.median(ratios) - 1) * 100
+    print(f"metrics off {off * 1000:.1f} ms/round, on {on * 1000:.1f} ms/round: {overhead:+.2f}% overhead")
+    if args.max_overhead is not None and overhead > args.max_overhead:
+        print(f"FAIL overhead over {args.max_overhead}%")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
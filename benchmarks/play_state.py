@@ -0,0 +1,74 @@
+"""/play latency and bytes on the wire per game-state backend (cookie vs. server side).
+
+    python benchmarks/play_state.py --players 8 --games 50
+"""
+import argparse
+import re
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common import load_app, login_client
+
+
+def header_bytes(headers):
+    return sum(len(name) + len(value) + 4 for name, value in headers.items())
+
+
+def play_games(app, username, games, latencies, wire):
+    client = login_client(app, username)
+    for _ in range(games):
+        client.get("/start_game")
+        while True:
+            cookie = client.get_cookie("session")
+            start = time.perf_counter()
+            response = client.post("/play", data={"action": "fight"})
+            latencies.append(time.perf_counter() - start)
+            # what the browser sends (cookie) and gets back (headers + page)
+            wire.append(len(cookie.value) + header_bytes(response.headers) + len(response.data))
+            if response.status_code != 200:
+                break
+
+
+def health(response):
+    return int(re.search(r": (-?\d+)</p>", response.get_data(as_text=True)).group(1))
+
+
+def replayable(app, username):
+    """Does re-sending the cookie from before a fight bring the old health back?"""
+    client = login_client(app, username)
+    client.get("/start_game")
+    before = client.get_cookie("session").value
+    after_one = health(client.post("/play", data={"action": "fight"}))
+    client.set_cookie("session", before)
+    after_two = health(client.post("/play", data={"action": "fight"}))
+    # a fight costs at least 12 health unless the first one was undone
+    return after_two > after_one - 12
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--players", type=int, default=8)
+    parser.add_argument("--games", type=int, default=50)
+    parser.add_argument("--backends", nargs="+", default=["cookie", "memory", "sqlite"])
+    args = parser.parse_args()
+
+    app_module = load_app()
+    print(f"{'backend':>8} {'plays':>7} {'p50 ms':>7} {'p95 ms':>7} {'bytes/play':>10} {'replayable':>10}")
+    for backend in args.backends:
+        app_module.gamestate.configure(backend=backend)
+        per_player = [([], []) for _ in range(args.players)]
+        with ThreadPoolExecutor(args.players) as pool:
+            futures = [pool.submit(play_games, app_module.app, f"{backend}{i}", args.games, lat, wire)
+                       for i, (lat, wire) in enumerate(per_player)]
+            for future in futures:
+                future.result()
+        latencies = sorted(x for lat, _ in per_player for x in lat)
+        wire = [x for _, w in per_player for x in w]
+        p95 = latencies[int(len(latencies) * 0.95)]
+        print(f"{backend:>8} {len(latencies):>7} {statistics.median(latencies) * 1000:>7.2f} {p95 * 1000:>7.2f} "
+              f"{statistics.mean(wire):>10.0f} {'yes' if replayable(app_module.app, backend + '_r') else 'no':>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Render time per route with and without {% fragment %} caching, and template
+compile time for a cold worker with and without the bytecode cache.
+
+    python benchmarks/render.py --requests 200 --rows 2000
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+
+from jinja2 import FileSystemBytecodeCache
+
+from common import load_app, login_client, timed
+
+ROUTES = ["/", "/dashboard", "/rangs", "/majasdarbi/fitnesstracker/sports",
+          "/majasdarbi/fitnesstracker/users", "/majasdarbi/fitnesstracker/workouts"]
+
+
+def seed(models, rows):
+    for i in range(rows // 10):
+        models.add_game_user(f"player{i}", "bench")
+        models.add_fit_user(f"Vārds{i}", f"Uzvārds{i}")
+    for i in range(20):
+        models.add_sport(f"Sports {i}")
+    now = int(time.time())
+    models.add_workouts([(random.randint(1, rows // 10), random.randint(1, 20), random.randint(1, 5),
+                          random.choice(["Rīta treniņš", "Vakara treniņš"]), now - random.randint(0, 365 * 86400))
+                         for _ in range(rows)])
+    for i in range(rows):
+        models.finish_game(random.randint(1, rows // 10), 0, random.randint(10, 300))
+
+
+def per_request_ms(client, path, requests):
+    seconds, _ = timed(lambda: [client.get(path) for _ in range(requests)])
+    return seconds / requests * 1000
+
+
+def compile_ms(app_module, bytecode_dir):
+    env = app_module.app.jinja_env
+    env.bytecode_cache = FileSystemBytecodeCache(bytecode_dir) if bytecode_dir else None
+    env.cache.clear()
+    seconds, count = timed(app_module.templating.precompile, app_module.app)
+    return seconds * 1000, count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=2000)
+    args = parser.parse_args()
+
+    app_module = load_app()
+    with app_module.app.app_context():
+        seed(app_module.models, args.rows)
+    client = login_client(app_module.app, "player0")
+
+    print(f"{'route':<38} {'no fragments ms':>15} {'fragments ms':>13}")
+    for path in ROUTES:
+        app_module.templating.configure(fragments=False)
+        plain = per_request_ms(client, path, args.requests)
+        app_module.templating.configure(fragments=True)
+        cached = per_request_ms(client, path, args.requests)
+        print(f"{path:<38} {plain:>15.2f} {cached:>13.2f}")
+
+    bytecode_dir = tempfile.mkdtemp(prefix="bench_jinja_")
+    no_cache, count = compile_ms(app_module, None)
+    compile_ms(app_module, bytecode_dir)  # fill the bytecode cache
+    warm, _ = compile_ms(app_module, bytecode_dir)
+    shutil.rmtree(bytecode_dir)
+    print(f"\ncompile {count} templates: {no_cache:.1f} ms from source, {warm:.1f} ms from bytecode cache")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Cold start of one worker: importing app.py, create_app() and the first
+request, each in a fresh interpreter. Exits 1 when the median of a step is
+over its limit, so it can gate a deploy.
+
+    python benchmarks/startup.py --runs 5 --max-import-ms 300 --max-create-ms 500
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from common import ROOT
+
+# Runs in the fresh interpreter; prints the step times as JSON
+WORKER = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import app as app_module
+imported = time.perf_counter()
+app = app_module.create_app({config!r})
+created = time.perf_counter()
+app.test_client().get("/")
+served = time.perf_counter()
+print(json.dumps({{"import": imported - start, "create": created - imported, "first_request": served - created,
+                  "modules": len(sys.modules)}}))
+"""
+
+
+def run_worker(workdir, config):
+    code = WORKER.format(root=ROOT, config=config)
+    out = subprocess.run([sys.executable, "-c", code], cwd=workdir, check=True, capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def measure(workdir, config, runs):
+    results = [run_worker(workdir, config) for _ in range(runs)]
+    return {step: statistics.median(r[step] for r in results) for step in results[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=None)
+    parser.add_argument("--max-create-ms", type=float, default=None)
+    parser.add_argument("--max-first-request-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    for name in ("texts.json", "level_requirements.json"):
+        shutil.copy(os.path.join(ROOT, name), workdir)
+    # the first run creates the dbs, so the timed runs see them current like a restarted worker
+    run_worker(workdir, {})
+
+    setups = [("full app", {}), ("without fitness tracker", {"FITNESS_TRACKER": False})]
+    print(f"{'setup':<26} {'import ms':>10} {'create ms':>10} {'1st request ms':>15} {'modules':>8}")
+    results = {}
+    for name, config in setups:
+        m = results[name] = measure(workdir, config, args.runs)
+        print(f"{name:<26} {m['import'] * 1000:>10.1f} {m['create'] * 1000:>10.1f} "
+              f"{m['first_request'] * 1000:>15.1f} {m['modules']:>8.0f}")
+    shutil.rmtree(workdir)
+
+    full = results["full app"]
+    limits = [("import", args.max_import_ms), ("create", args.max_create_ms),
+              ("first_request", args.max_first_request_ms)]
+    over = [(step, full[step] * 1000, limit) for step, limit in limits if limit is not None and full[step] * 1000 > limit]
+    for step, ms, limit in over:
+        print(f"FAIL {step}: {ms:.1f} ms > {limit:.1f} ms")
+    sys.exit(1 if over else 0)
+
+
+if __name__ == "__main__":
+    main()
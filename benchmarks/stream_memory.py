@@ -0,0 +1,52 @@
+"""Peak Python memory of /my_games?stream=1 vs. the whole history in a list, by history size.
+
+    python benchmarks/stream_memory.py --games 100 10000 1000000
+"""
+import argparse
+import tracemalloc
+
+from common import load_app, login_client, timed
+
+
+def consume(client, path):
+    response = client.get(path, buffered=False)
+    size = 0
+    for chunk in response.response:
+        size += len(chunk)
+    response.close()
+    return size
+
+
+def peak(func, *args):
+    tracemalloc.start()
+    seconds, size = timed(func, *args)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak_bytes, seconds, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, nargs="+", default=[100, 10000, 100000])
+    args = parser.parse_args()
+
+    app_module = load_app()
+    models = app_module.models
+    client = login_client(app_module.app, "bench")
+    conn = models.get_db("playgame.db")
+    total = 0
+    print(f"{'games':>9} {'mode':>8} {'peak MiB':>9} {'seconds':>8} {'body MiB':>9}")
+    for count in args.games:
+        conn.executemany("INSERT INTO games (user_id, health, battle_points) VALUES (1, 0, ?)",
+                         ((i % 300,) for i in range(count - total)))
+        conn.commit()
+        total = count
+        peak_bytes, seconds, size = peak(consume, client, "/my_games?stream=1")
+        print(f"{count:>9} {'stream':>8} {peak_bytes / 2**20:>9.1f} {seconds:>8.2f} {size / 2**20:>9.1f}")
+        with app_module.app.app_context():
+            peak_bytes, seconds, _ = peak(lambda: list(models.iter_user_games(1)))
+        print(f"{count:>9} {'list':>8} {peak_bytes / 2**20:>9.1f} {seconds:>8.2f} {'-':>9}")
+
+
+if __name__ == "__main__":
+    main()
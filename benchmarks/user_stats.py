@@ -0,0 +1,77 @@
+"""The original N+1 loop (four queries over workouts per user) vs. get_all_user_stats.
+
+    python benchmarks/user_stats.py --workouts 1000 10000 100000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+from common import ROOT, timed
+
+
+def seed(models, users, sports, workouts):
+    conn = models.get_db("fitnesstracker.db")
+    conn.executemany("INSERT INTO users (name, surname) VALUES (?, ?)",
+                     [(f"Name{i}", f"Surname{i}") for i in range(users)])
+    conn.executemany("INSERT INTO sports (title) VALUES (?)", [(f"Sport{i}",) for i in range(sports)])
+    conn.executemany(
+        "INSERT INTO workouts (user_id, sport_id, intensity, day_time) VALUES (?, ?, ?, ?)",
+        [(random.randint(1, users), random.randint(1, sports), random.randint(1, 5),
+          random.choice(["Rīta treniņš", "Vakara treniņš"])) for _ in range(workouts)])
+    conn.commit()
+
+
+# get_user_stats as it was before the stats tables: it scans each user's
+# workouts, where models.get_user_stats now reads one row per table
+def n_plus_one(models):
+    c = models.get_db("fitnesstracker.db").cursor()
+    userstats = []
+    for user in models.get_all_fit_users():
+        c.execute("""SELECT sport_id, COUNT(*) as cnt
+                     FROM workouts WHERE user_id=?
+                     GROUP BY sport_id ORDER BY cnt DESC LIMIT 1""", (user["id"],))
+        row = c.fetchone()
+        fav_sport_id = row["sport_id"] if row else None
+        c.execute("SELECT AVG(intensity) as avg_i FROM workouts WHERE user_id=?", (user["id"],))
+        avg_i_row = c.fetchone()
+        avg_intensity = round(avg_i_row["avg_i"], 2) if avg_i_row and avg_i_row["avg_i"] else None
+        c.execute("""SELECT day_time, COUNT(*) as cnt FROM workouts WHERE user_id=?
+                     GROUP BY day_time ORDER BY cnt DESC LIMIT 1""", (user["id"],))
+        time_row = c.fetchone()
+        fav_time = time_row["day_time"] if time_row else None
+        fav_sport = None
+        if fav_sport_id:
+            c.execute("SELECT title FROM sports WHERE id=?", (fav_sport_id,))
+            sport_row = c.fetchone()
+            if sport_row:
+                fav_sport = sport_row["title"]
+        userstats.append((user["name"], user["surname"], fav_sport, avg_intensity, fav_time))
+    return userstats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workouts", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--sports", type=int, default=20)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    import db
+    import models
+
+    print(f"{'workouts':>10} {'users':>7} {'n+1 (s)':>10} {'bulk (s)':>10} {'speedup':>8}")
+    for count in args.workouts:
+        os.chdir(tempfile.mkdtemp(prefix="bench_"))
+        db.close_all()
+        models.init_db("fitnesstracker.db", fitness_mode=True)
+        seed(models, args.users, args.sports, count)
+        slow, _ = timed(n_plus_one, models)
+        fast, _ = timed(models.get_all_user_stats)
+        print(f"{count:>10} {args.users:>7} {slow:>10.3f} {fast:>10.3f} {slow / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
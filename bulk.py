@@ -0,0 +1,321 @@
+import csv
+import gzip
+import io
+import json
+import time
+
+import audit
+import db
+import models
+import versions
+
+# ---- BULK CONFIG ----
+# batch_rows     - rows per executemany, each batch is one transaction
+# progress_every - call the progress callback after about this many rows
+# max_errors     - rejected records listed in the summary (all are counted)
+BULK_CONFIG = {
+    "batch_rows": 5000,
+    "progress_every": 50000,
+    "max_errors": 20,
+}
+
+DBFILE = "fitnesstracker.db"
+
+# kind -> fields of one record; workouts refer to users and sports by name,
+# so an export from one db can be imported into another
+FIELDS = {
+    "users": ("name", "surname"),
+    "sports": ("title",),
+    "workouts": ("name", "surname", "sport", "intensity", "day_time", "created_at"),
+}
+FORMATS = ("csv", "jsonl")
+MIMETYPES = {"csv": "text/csv", "jsonl": "application/x-ndjson"}
+
+
+class BulkError(ValueError):
+    pass
+
+
+# ---- FILES ----
+def format_for(path):
+    """csv or jsonl from the file name; a .gz suffix is allowed."""
+    name = path[:-3] if path.endswith(".gz") else path
+    ext = name.rsplit(".", 1)[-1].lower()
+    if ext in ("jsonl", "ndjson"):
+        return "jsonl"
+    if ext == "csv":
+        return "csv"
+    raise BulkError(f"can't tell the format of {path}, use .csv or .jsonl")
+
+
+def open_file(path, mode="r"):
+    opener = gzip.open if path.endswith(".gz") else open
+    return opener(path, mode + "t", encoding="utf-8", newline="")
+
+
+def read_records(f, fmt):
+    """Records from a text stream, one at a time; an unreadable JSON line is yielded as None."""
+    if fmt == "csv":
+        yield from csv.DictReader(f)
+        return
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+class Progress:
+    def __init__(self, report=None, every=None):
+        self.report = report
+        self.every = every or BULK_CONFIG["progress_every"]
+        self.rows = 0
+        self.next_report = self.every
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        return self.rows / self.elapsed if self.elapsed > 0 else 0.0
+
+    def add(self, rows):
+        self.rows += rows
+        if self.report is not None and self.rows >= self.next_report:
+            self.report(self)
+            self.next_report = (self.rows // self.every + 1) * self.every
+
+    def finish(self):
+        if self.report is not None:
+            self.report(self)
+
+
+# ---- IMPORT ----
+def _field(record, name):
+    value = record.get(name)
+    value = "" if value is None else str(value).strip()
+    if not value:
+        raise BulkError(f"missing {name}")
+    return value
+
+
+class _Importer:
+    """Turns records into insert rows, resolving names through dicts loaded once.
+
+    With commit=False the batches are only kept; write_all() then inserts
+    them in one transaction.
+    """
+
+    def __init__(self, kind, commit=True):
+        self.kind = kind
+        self.commit = commit
+        self.batches = []
+        self.added = []
+        if kind == "users":
+            self.seen = models.get_fit_user_ids()
+        elif kind == "sports":
+            self.seen = models.get_sport_ids()
+        else:
+            self.user_ids = models.get_fit_user_ids()
+            self.sport_ids = models.get_sport_ids()
+
+    def row(self, record):
+        """Insert row for record, None for a duplicate; BulkError if it can't be imported."""
+        if not isinstance(record, dict):
+            raise BulkError("not a JSON object")
+        if self.kind == "users":
+            key = (_field(record, "name"), _field(record, "surname"))
+            return self._new(key)
+        if self.kind == "sports":
+            title = _field(record, "title")
+            return self._new(title)
+        name, surname = _field(record, "name"), _field(record, "surname")
+        user_id = self.user_ids.get((name, surname))
+        if user_id is None:
+            raise BulkError(f"unknown user {name} {surname}")
+        sport = _field(record, "sport")
+        sport_id = self.sport_ids.get(sport)
+        if sport_id is None:
+            raise BulkError(f"unknown sport {sport}")
+        try:
+            intensity = int(_field(record, "intensity"))
+        except ValueError:
+            raise BulkError("intensity must be a whole number")
+        # optional: exports from before workouts were timestamped have none
+        created_at = record.get("created_at")
+        created_at = "" if created_at is None else str(created_at).strip()
+        try:
+            created_at = int(created_at) if created_at else None
+        except ValueError:
+            raise BulkError("created_at must be unix seconds")
+        return (user_id, sport_id, intensity, _field(record, "day_time"), created_at)
+
+    def _new(self, key):
+        # users and sports already in the db (or earlier in the file) are skipped
+        if key in self.seen:
+            return None
+        self.seen[key] = None
+        return key
+
+    def write(self, rows):
+        if not self.commit:
+            self.batches.append(rows)
+        elif self.kind == "users":
+            models.add_fit_users(rows)
+        elif self.kind == "sports":
+            models.add_sports(rows)
+        else:
+            models.add_workouts(rows)
+            # write the batch's events in one go, not one inline flush per buffer_size
+            audit.flush()
+
+    def _insert(self, rows):
+        if self.kind == "users":
+            models.insert_fit_users(rows)
+        elif self.kind == "sports":
+            models.insert_sports(rows)
+        else:
+            self.added += models.insert_workouts(rows)
+
+    @db.retry_on_busy
+    def write_all(self):
+        # retried as a whole: every row is already in memory
+        conn = db.get_connection(DBFILE)
+        if conn.in_transaction:
+            conn.commit()
+        # take the write lock up front, so no insert of the transaction can hit a busy db
+        conn.execute("BEGIN IMMEDIATE")
+        self.added = []
+        try:
+            for rows in self.batches:
+                self._insert(rows)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        if self.kind == "workouts":
+            models.workouts_added(self.added)
+            audit.flush()
+        else:
+            versions.bump(f"fit_{self.kind}")
+
+
+def _load(importer, records, summary, progress, batch_rows):
+    batch = []
+    for n, record in enumerate(records, 1):
+        summary["read"] += 1
+        try:
+            row = importer.row(record)
+        except BulkError as e:
+            summary["rejected"] += 1
+            if len(summary["errors"]) < BULK_CONFIG["max_errors"]:
+                summary["errors"].append(f"record {n}: {e}")
+            continue
+        if row is None:
+            summary["skipped"] += 1
+            continue
+        batch.append(row)
+        if len(batch) >= batch_rows:
+            importer.write(batch)
+            summary["inserted"] += len(batch)
+            progress.add(len(batch))
+            batch = []
+    if batch:
+        importer.write(batch)
+        summary["inserted"] += len(batch)
+        progress.add(len(batch))
+
+
+def import_records(kind, records, progress=None, batch_rows=None, offline=False):
+    """Insert records of one kind in batches of batch_rows; returns a summary dict.
+
+    Online (the HTTP import) every record is read and checked first, then all
+    batches are written in one transaction, with indexes and triggers in
+    place: readers see all of the import or none of it, and a slow upload
+    never holds the write lock. The rows are kept in memory until then. Offline
+    (fit-import, nobody else writing) each batch is committed, indexes and
+    triggers on the target table are dropped for the load and recreated at
+    the end, then the workout stats are rebuilt.
+    """
+    if kind not in FIELDS:
+        raise BulkError(f"unknown kind {kind}")
+    batch_rows = batch_rows or BULK_CONFIG["batch_rows"]
+    progress = progress or Progress()
+    summary = {"kind": kind, "read": 0, "inserted": 0, "skipped": 0, "rejected": 0, "errors": []}
+    if offline:
+        importer = _Importer(kind)
+        try:
+            with db.deferred_indexes(DBFILE, kind):
+                _load(importer, records, summary, progress, batch_rows)
+        finally:
+            if kind == "workouts":
+                models.rebuild_user_stats(DBFILE)
+    else:
+        importer = _Importer(kind, commit=False)
+        _load(importer, records, summary, progress, batch_rows)
+        importer.write_all()
+    progress.finish()
+    summary["seconds"] = round(progress.elapsed, 3)
+    return summary
+
+
+def import_file(kind, path, fmt=None, progress=None, batch_rows=None, offline=True):
+    with open_file(path) as f:
+        return import_records(kind, read_records(f, fmt or format_for(path)), progress, batch_rows, offline)
+
+
+# ---- EXPORT ----
+def iter_export(kind, fmt, progress=None, batch_rows=None):
+    """Export of one kind as text chunks of batch_rows rows; memory use does not grow with the table."""
+    if kind not in FIELDS:
+        raise BulkError(f"unknown kind {kind}")
+    if fmt not in FORMATS:
+        raise BulkError(f"unknown format {fmt}")
+    batch_rows = batch_rows or BULK_CONFIG["batch_rows"]
+    progress = progress or Progress()
+    fields = FIELDS[kind]
+    buf = io.StringIO()
+    writer = csv.writer(buf) if fmt == "csv" else None
+    if writer is not None:
+        writer.writerow(fields)
+    rows = 0
+    for row in models.iter_fit_export(kind):
+        if writer is not None:
+            writer.writerow(tuple(row))
+        else:
+            buf.write(json.dumps(dict(zip(fields, row)), ensure_ascii=False) + "\n")
+        rows += 1
+        if rows == batch_rows:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            progress.add(rows)
+            rows = 0
+    if rows or buf.tell():
+        yield buf.getvalue()
+    progress.add(rows)
+    progress.finish()
+
+
+def export_file(kind, path, fmt=None, progress=None, batch_rows=None):
+    with open_file(path, "w") as f:
+        for chunk in iter_export(kind, fmt or format_for(path), progress, batch_rows):
+            f.write(chunk)
+
+
+def configure(**options):
+    for name, value in options.items():
+        if value is not None:
+            BULK_CONFIG[name] = value
+
+
+# ---- FLASK ----
+def init_app(app):
+    configure(
+        batch_rows=app.config.get("BULK_BATCH_ROWS"),
+        progress_every=app.config.get("BULK_PROGRESS_EVERY"),
+    )
@@ -0,0 +1,210 @@
+import collections
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+# ---- CACHE CONFIG ----
+# backend     - "lru" (per process) or "file" (shared by all workers on the host;
+#               point dir at /dev/shm to keep it in shared memory)
+# ttl         - seconds before an entry is recomputed even without invalidation
+# max_entries - LRU size per process; for "file", entries in the whole dir
+#               (the oldest written are removed first)
+CACHE_CONFIG = {
+    "backend": "lru",
+    "ttl": 30.0,
+    "max_entries": 1024,
+    "dir": os.path.join(tempfile.gettempdir(), "pseudoxfit_cache"),
+}
+
+
+# ---- BACKENDS ----
+# Entries live in namespaces so that one write can drop every related key,
+# e.g. all leaderboard pages or everything cached for one user.
+class LRUBackend:
+    def __init__(self, max_entries, stats):
+        self.max_entries = max_entries
+        self.stats = stats
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, namespace, key):
+        with self.lock:
+            entry = self.entries.get((namespace, key))
+            if entry is not None:
+                self.entries.move_to_end((namespace, key))
+            return entry
+
+    def set(self, namespace, key, entry):
+        with self.lock:
+            self.entries[(namespace, key)] = entry
+            self.entries.move_to_end((namespace, key))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, namespace):
+        with self.lock:
+            for k in [k for k in self.entries if k[0] == namespace]:
+                del self.entries[k]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class FileBackend:
+    def __init__(self, directory, max_entries, stats):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.stats = stats
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # entries at the last count plus those written since; other workers
+        # write too, so this only says when to count again
+        self.entries = len(self._files())
+
+    def _files(self):
+        files = []
+        for namespace in os.scandir(self.directory):
+            if namespace.is_dir():
+                try:
+                    files += [entry for entry in os.scandir(namespace.path)
+                              if entry.is_file() and not entry.name.endswith(".tmp")]
+                except FileNotFoundError:
+                    pass  # invalidated meanwhile
+        return files
+
+    def _evict(self):
+        # down to 90%, so the directory is only listed every max_entries / 10 writes
+        files = []
+        for entry in self._files():
+            try:
+                files.append((entry.stat().st_mtime_ns, entry.path))
+            except FileNotFoundError:
+                pass
+        files.sort()
+        excess = len(files) - int(self.max_entries * 0.9)
+        removed = 0
+        for _, path in files[:max(excess, 0)]:
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        with self.lock:
+            self.entries = len(files) - removed
+            self.stats["evictions"] += removed
+
+    def _path(self, namespace, key):
+        name = hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, namespace.replace("/", "_"), name)
+
+    def get(self, namespace, key):
+        try:
+            with open(self._path(namespace, key), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, namespace, key, entry):
+        path = self._path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, so other workers never read a half-written file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+        with self.lock:
+            self.entries += 1
+            full = self.entries > self.max_entries
+        if full:
+            self._evict()
+
+    def invalidate(self, namespace):
+        shutil.rmtree(os.path.join(self.directory, namespace.replace("/", "_")), ignore_errors=True)
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock:
+            self.entries = 0
+
+
+# ---- CACHE ----
+class Cache:
+    def __init__(self, backend="lru", ttl=30.0, max_entries=1024, directory=None):
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+        if backend == "file":
+            self.backend = FileBackend(directory or CACHE_CONFIG["dir"], max_entries, self.stats)
+        else:
+            self.backend = LRUBackend(max_entries, self.stats)
+
+    def _count(self, name):
+        with self.backend.lock:
+            self.stats[name] += 1
+
+    def get_or_set(self, namespace, key, compute):
+        """Cached value for (namespace, key); key must be hashable, compute() must return JSON-able data."""
+        entry = self.backend.get(namespace, key)
+        if entry is not None:
+            expires, value = entry
+            if expires > time.time():
+                self._count("hits")
+                return value
+            self._count("expired")
+        self._count("misses")
+        value = compute()
+        self.backend.set(namespace, key, [time.time() + self.ttl, value])
+        return value
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            self.backend.invalidate(namespace)
+            self._count("invalidations")
+
+    def clear(self):
+        self.backend.clear()
+
+
+cache = Cache(CACHE_CONFIG["backend"], CACHE_CONFIG["ttl"], CACHE_CONFIG["max_entries"])
+
+
+def configure(backend=None, ttl=None, max_entries=None, directory=None):
+    global cache
+    if backend is not None:
+        CACHE_CONFIG["backend"] = backend
+    if ttl is not None:
+        CACHE_CONFIG["ttl"] = ttl
+    if max_entries is not None:
+        CACHE_CONFIG["max_entries"] = max_entries
+    if directory is not None:
+        CACHE_CONFIG["dir"] = directory
+    cache = Cache(CACHE_CONFIG["backend"], CACHE_CONFIG["ttl"], CACHE_CONFIG["max_entries"], CACHE_CONFIG["dir"])
+
+
+def get_or_set(namespace, key, compute):
+    return cache.get_or_set(namespace, key, compute)
+
+
+def invalidate(*namespaces):
+    cache.invalidate(*namespaces)
+
+
+def stats():
+    with cache.backend.lock:
+        return dict(cache.stats)
+
+
+# ---- FLASK ----
+def init_app(app):
+    configure(
+        backend=app.config.get("CACHE_BACKEND"),
+        ttl=app.config.get("CACHE_TTL"),
+        max_entries=app.config.get("CACHE_MAX_ENTRIES"),
+        directory=app.config.get("CACHE_DIR"),
+    )
@@ -0,0 +1,211 @@
+import base64
+import collections
+import concurrent.futures
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+# ---- CREDENTIALS CONFIG ----
+# n, r, p      - scrypt cost; stored with each hash, so raising them only
+#                rehashes users as they log in
+# workers      - hashes computed at the same time (the CPU cap)
+# executor     - "thread" (hashlib.scrypt releases the GIL) or "process"
+# max_queue    - hashes waiting for a worker; beyond that callers get Busy
+#                right away instead of piling up request threads
+# timeout      - seconds a caller waits for its hash before giving up
+# attempts / window - login attempts allowed per IP and per username
+#                     in window seconds, checked before any hashing
+CREDENTIALS_CONFIG = {
+    "n": 2 ** 14,
+    "r": 8,
+    "p": 1,
+    "workers": 2,
+    "executor": "thread",
+    "max_queue": 32,
+    "timeout": 5.0,
+    "attempts": 10,
+    "window": 60.0,
+}
+
+PREFIX = "scrypt"
+
+
+class Busy(Exception):
+    pass
+
+
+# ---- HASHING ----
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, maxmem=256 * r * n, dklen=32)
+
+
+def _hash(password, n, r, p):
+    salt = os.urandom(16)
+    return f"{PREFIX}${n}${r}${p}${_b64(salt)}${_b64(_scrypt(password, salt, n, r, p))}"
+
+
+def _verify(stored, password):
+    """(matches, needs_rehash); rows from before hashing hold the plain password."""
+    if not stored.startswith(PREFIX + "$"):
+        return hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8")), True
+    _, n, r, p, salt, expected = stored.split("$")
+    n, r, p = int(n), int(r), int(p)
+    matches = hmac.compare_digest(_scrypt(password, base64.b64decode(salt), n, r, p), base64.b64decode(expected))
+    return matches, (n, r, p) != (CREDENTIALS_CONFIG["n"], CREDENTIALS_CONFIG["r"], CREDENTIALS_CONFIG["p"])
+
+
+# ---- WORKER POOL ----
+class HashPool:
+    def __init__(self, workers, executor, max_queue, timeout):
+        self.max_pending = workers + max_queue
+        self.timeout = timeout
+        if executor == "process":
+            self.executor = concurrent.futures.ProcessPoolExecutor(workers)
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="credentials")
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.stats = {"submitted": 0, "completed": 0, "rejected": 0, "timeouts": 0,
+                      "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+
+    def run(self, func, *args):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise Busy("too many password hashes queued")
+            self.pending += 1
+            self.stats["submitted"] += 1
+        start = time.perf_counter()
+        future = self.executor.submit(func, *args)
+        try:
+            result = future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            with self.lock:
+                self.stats["timeouts"] += 1
+            raise Busy("password hash timed out")
+        finally:
+            # time in the queue plus the hash itself
+            waited = time.perf_counter() - start
+            with self.lock:
+                self.pending -= 1
+                self.stats["wait_seconds"] += waited
+                self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], waited)
+        with self.lock:
+            self.stats["completed"] += 1
+        return result
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# ---- RATE LIMIT ----
+class RateLimiter:
+    """At most `attempts` per key in any `window` seconds (sliding log)."""
+
+    def __init__(self, attempts, window):
+        self.attempts = attempts
+        self.window = window
+        self.hits = {}
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def allow(self, *keys):
+        now = time.monotonic()
+        with self.lock:
+            if len(self.hits) > 10000:
+                # forget keys that have been quiet for a whole window
+                self.hits = {k: q for k, q in self.hits.items() if q and q[-1] > now - self.window}
+            logs = [self.hits.setdefault(key, collections.deque()) for key in keys]
+            for log in logs:
+                while log and log[0] <= now - self.window:
+                    log.popleft()
+            if any(len(log) >= self.attempts for log in logs):
+                self.rejected += 1
+                return False
+            for log in logs:
+                log.append(now)
+            return True
+
+
+_pool = None
+_limiter = None
+_setup_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _setup_lock:
+            if _pool is None:
+                _pool = HashPool(CREDENTIALS_CONFIG["workers"], CREDENTIALS_CONFIG["executor"],
+                                 CREDENTIALS_CONFIG["max_queue"], CREDENTIALS_CONFIG["timeout"])
+    return _pool
+
+
+def _get_limiter():
+    global _limiter
+    if _limiter is None:
+        with _setup_lock:
+            if _limiter is None:
+                _limiter = RateLimiter(CREDENTIALS_CONFIG["attempts"], CREDENTIALS_CONFIG["window"])
+    return _limiter
+
+
+# A hash to check against when the user doesn't exist, so a login for an
+# unknown name takes as long as one with a wrong password
+_dummy_hash = None
+
+
+def hash_password(password):
+    """scrypt hash for storing; raises Busy when the pool is saturated."""
+    return _get_pool().run(_hash, password, CREDENTIALS_CONFIG["n"], CREDENTIALS_CONFIG["r"], CREDENTIALS_CONFIG["p"])
+
+
+def verify_password(stored, password):
+    """(matches, needs_rehash) for a stored hash, or None stored for an unknown user."""
+    global _dummy_hash
+    if stored is None:
+        if _dummy_hash is None:
+            _dummy_hash = hash_password("")
+        _get_pool().run(_verify, _dummy_hash, password)
+        return False, False
+    return _get_pool().run(_verify, stored, password)
+
+
+def allow_attempt(*keys):
+    return _get_limiter().allow(*keys)
+
+
+def stats():
+    data = dict(_pool.stats, pending=_pool.pending) if _pool is not None else {}
+    data["rate_limited"] = _limiter.rejected if _limiter is not None else 0
+    return data
+
+
+def configure(**options):
+    global _pool, _limiter, _dummy_hash
+    for name, value in options.items():
+        if value is not None:
+            CREDENTIALS_CONFIG[name] = value
+    if _pool is not None:
+        _pool.shutdown()
+    _pool = _limiter = _dummy_hash = None
+
+
+# ---- FLASK ----
+def init_app(app):
+    configure(
+        n=app.config.get("PASSWORD_SCRYPT_N"),
+        workers=app.config.get("PASSWORD_WORKERS"),
+        executor=app.config.get("PASSWORD_EXECUTOR"),
+        max_queue=app.config.get("PASSWORD_MAX_QUEUE"),
+        attempts=app.config.get("LOGIN_ATTEMPTS"),
+        window=app.config.get("LOGIN_WINDOW"),
+    )
@@ -0,0 +1,317 @@
+import contextlib
+import functools
+import random
+import re
+import sqlite3
+import threading
+import time
+
+import click
+
+# ---- POOL CONFIG ----
+# size    - max open connections per database file (one per worker thread)
+# timeout - seconds to wait for a free connection / for a locked database
+# pragmas - executed on every new connection
+# factory - sqlite3.Connection subclass for new connections (metrics.py sets one)
+POOL_CONFIG = {
+    "size": 16,
+    "timeout": 5.0,
+    "pragmas": {
+        "foreign_keys": "ON",
+        # WAL readers never block on a writer; NORMAL only fsyncs at checkpoint
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "mmap_size": 268435456,
+        "cache_size": -16000,
+        # automatic checkpoint once the WAL grows past this many pages
+        "wal_autocheckpoint": 1000,
+    },
+    "factory": sqlite3.Connection,
+}
+
+# ---- STORAGE CONFIG ----
+# journal_mode is stored in the db file, so it is set once at startup;
+# auto_vacuum too, when migrations.py creates the file. INCREMENTAL lets
+# free pages be handed back in small steps (PRAGMA incremental_vacuum)
+STORAGE_CONFIG = {
+    "journal_mode": "WAL",
+    "checkpoint_mode": "TRUNCATE",
+    "auto_vacuum": "INCREMENTAL",
+}
+
+# ---- WRITE RETRY CONFIG ----
+RETRY_CONFIG = {
+    "attempts": 6,
+    "base_delay": 0.01,
+    "max_delay": 0.5,
+}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# ---- POOL ----
+class ConnectionPool:
+    def __init__(self, dbfile, size, timeout, pragmas, factory=sqlite3.Connection):
+        self.dbfile = dbfile
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = dict(pragmas)
+        self.factory = factory
+        self.idle = []
+        self.open_count = 0
+        self.opened = 0  # connections ever opened, for metrics
+        self.cond = threading.Condition()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.dbfile, timeout=self.timeout, check_same_thread=False, factory=self.factory)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def acquire(self):
+        with self.cond:
+            while not self.idle and self.open_count >= self.size:
+                if not self.cond.wait(self.timeout):
+                    raise PoolTimeout(f"no free connection for {self.dbfile} after {self.timeout}s")
+            if self.idle:
+                return self.idle.pop()
+            self.open_count += 1
+            self.opened += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self.cond:
+                self.open_count -= 1
+                self.cond.notify()
+            raise
+
+    def release(self, conn):
+        # never hand a half-finished transaction to the next thread
+        if conn.in_transaction:
+            conn.rollback()
+        with self.cond:
+            self.idle.append(conn)
+            self.cond.notify()
+
+    def close_all(self):
+        with self.cond:
+            for conn in self.idle:
+                conn.close()
+            self.open_count -= len(self.idle)
+            self.idle = []
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_local = threading.local()
+
+
+def configure(size=None, timeout=None, pragmas=None, factory=None):
+    if factory is not None:
+        POOL_CONFIG["factory"] = factory
+    if size is not None:
+        POOL_CONFIG["size"] = size
+    if timeout is not None:
+        POOL_CONFIG["timeout"] = timeout
+    if pragmas is not None:
+        POOL_CONFIG["pragmas"].update(pragmas)
+    close_all()
+
+
+def get_pool(dbfile):
+    pool = _pools.get(dbfile)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(dbfile)
+            if pool is None:
+                pool = ConnectionPool(dbfile, POOL_CONFIG["size"], POOL_CONFIG["timeout"], POOL_CONFIG["pragmas"],
+                                      POOL_CONFIG["factory"])
+                _pools[dbfile] = pool
+    return pool
+
+
+# ---- PER-THREAD CONNECTIONS ----
+def get_connection(dbfile):
+    """Connection bound to the current thread until release_connections()."""
+    held = getattr(_local, "held", None)
+    if held is None:
+        held = _local.held = {}
+    conn = held.get(dbfile)
+    if conn is None:
+        conn = get_pool(dbfile).acquire()
+        held[dbfile] = conn
+    return conn
+
+
+def release_connections(exc=None):
+    held = getattr(_local, "held", None)
+    if not held:
+        return
+    _local.held = {}
+    for dbfile, conn in held.items():
+        get_pool(dbfile).release(conn)
+
+
+def pool_stats():
+    """{dbfile: {"open", "idle", "opened"}} for every pool of this process."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.dbfile: {"open": pool.open_count, "idle": len(pool.idle), "opened": pool.opened} for pool in pools}
+
+
+def close_all():
+    release_connections()
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close_all()
+        _pools.clear()
+
+
+# ---- STORAGE ----
+def init_storage(dbfile, journal_mode=None):
+    conn = sqlite3.connect(dbfile, timeout=POOL_CONFIG["timeout"])
+    try:
+        mode = conn.execute(f"PRAGMA journal_mode = {journal_mode or STORAGE_CONFIG['journal_mode']}").fetchone()[0]
+    finally:
+        conn.close()
+    return mode
+
+
+def checkpoint(dbfile, mode=None):
+    """Returns (busy, wal_pages, checkpointed_pages) like PRAGMA wal_checkpoint."""
+    conn = get_connection(dbfile)
+    row = conn.execute(f"PRAGMA wal_checkpoint({mode or STORAGE_CONFIG['checkpoint_mode']})").fetchone()
+    return tuple(row)
+
+
+def space(dbfile):
+    """(auto_vacuum mode, page count, free pages, page size) of dbfile."""
+    conn = get_connection(dbfile)
+    return tuple(conn.execute(f"PRAGMA {name}").fetchone()[0]
+                 for name in ("auto_vacuum", "page_count", "freelist_count", "page_size"))
+
+
+def incremental_vacuum(dbfile, pages):
+    """Give up to pages free pages back to the file system, in one short write.
+
+    Only does something in auto_vacuum = INCREMENTAL dbs; returns the free pages left.
+    """
+    conn = get_connection(dbfile)
+    if conn.in_transaction:
+        conn.commit()
+    # executescript steps the pragma to the end; execute() would free one page
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def full_vacuum(dbfile, auto_vacuum=None):
+    """Rewrite the whole db (locks it throughout), switching its auto_vacuum mode."""
+    conn = get_connection(dbfile)
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute(f"PRAGMA auto_vacuum = {auto_vacuum or STORAGE_CONFIG['auto_vacuum']}")
+    conn.execute("VACUUM")
+
+
+@contextlib.contextmanager
+def deferred_indexes(dbfile, table):
+    """Drop table's indexes and triggers for a bulk load; recreate them on exit.
+
+    Building an index once at the end is much cheaper than updating it on
+    every insert. Triggers are skipped too, so derived data must be rebuilt.
+    """
+    conn = get_connection(dbfile)
+    saved = conn.execute("""SELECT type, name, sql FROM sqlite_master
+                            WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL""",
+                         (table,)).fetchall()
+    for row in saved:
+        conn.execute(f"DROP {row['type'].upper()} IF EXISTS \"{row['name']}\"")
+    conn.commit()
+    try:
+        yield
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        for row in saved:
+            conn.execute(row["sql"])
+        conn.commit()
+
+
+# ---- QUERY PLANS ----
+def query_plan(dbfile, sql, params=()):
+    return [row["detail"] for row in get_connection(dbfile).execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+# "FROM games g" / "JOIN games AS g": plans name the table by its alias
+_TABLE_ALIAS = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)\s+(?:AS\s+)?(\w+)", re.IGNORECASE)
+_NOT_ALIASES = {"WHERE", "ON", "USING", "JOIN", "LEFT", "INNER", "CROSS", "NATURAL", "GROUP", "ORDER", "LIMIT",
+                "UNION", "EXCEPT", "INTERSECT", "WINDOW", "HAVING"}
+
+
+def plan_problems(dbfile, sql, params=(), forbid_tables=()):
+    """Plan steps that full-scan a table or touch one of forbid_tables."""
+    tables = {alias: table for table, alias in _TABLE_ALIAS.findall(sql) if alias.upper() not in _NOT_ALIASES}
+    problems = []
+    for detail in query_plan(dbfile, sql, params):
+        words = detail.split()
+        if words[0] == "SCAN" and "INDEX" not in words:
+            problems.append(f"full scan: {detail}")
+        if len(words) > 1 and words[0] in ("SCAN", "SEARCH"):
+            table = tables.get(words[1], words[1])
+            if table in forbid_tables:
+                problems.append(f"reads {table}: {detail}")
+    return problems
+
+
+# ---- WRITE RETRY ----
+def _is_busy(error):
+    msg = str(error).lower()
+    return "locked" in msg or "busy" in msg
+
+
+def rollback_held():
+    """Roll back whatever the current thread's connections left uncommitted."""
+    for conn in getattr(_local, "held", {}).values():
+        if conn.in_transaction:
+            conn.rollback()
+
+
+def retry_on_busy(func):
+    """Re-run a write with exponential backoff while the database is locked."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        delay = RETRY_CONFIG["base_delay"]
+        for attempt in range(RETRY_CONFIG["attempts"]):
+            try:
+                return func(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if not _is_busy(e) or attempt == RETRY_CONFIG["attempts"] - 1:
+                    raise
+                rollback_held()
+                time.sleep(delay * random.uniform(0.5, 1.5))
+                delay = min(delay * 2, RETRY_CONFIG["max_delay"])
+    return wrapper
+
+
+# ---- FLASK ----
+def init_app(app):
+    configure(
+        size=app.config.get("DB_POOL_SIZE"),
+        timeout=app.config.get("DB_TIMEOUT"),
+        pragmas=app.config.get("DB_PRAGMAS"),
+    )
+    if app.config.get("DB_JOURNAL_MODE"):
+        STORAGE_CONFIG["journal_mode"] = app.config["DB_JOURNAL_MODE"]
+    app.teardown_appcontext(release_connections)
+
+    @app.cli.command("checkpoint")
+    @click.option("--mode", default=None, help="PASSIVE, FULL, RESTART or TRUNCATE")
+    def checkpoint_command(mode):
+        """Checkpoint the WAL of every database into the main db file."""
+        for dbfile in app.config.get("DB_FILES", []):
+            busy, wal_pages, done = checkpoint(dbfile, mode)
+            click.echo(f"{dbfile}: busy={busy} wal_pages={wal_pages} checkpointed={done}")
+        release_connections()
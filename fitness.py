@@ -0,0 +1,228 @@
+import io
+
+from flask import (Blueprint, current_app, flash, jsonify, redirect, render_template, request, session,
+                   stream_with_context, url_for)
+import click
+
+import analytics
+import audit
+import bulk
+import db
+import httpcache
+import models
+import writebehind
+from pages import page_size_arg, stream_template
+
+# ---- FITNESS TRACKER ----
+# Registered by create_app() (app.py), which imports this module only when
+# FITNESS_TRACKER is on. Its commands are top level: `flask fit-import ...`.
+bp = Blueprint("fitness", __name__, url_prefix="/majasdarbi/fitnesstracker", cli_group=None)
+
+# Pages that read workouts. A workout just added may still be in the
+# write-behind queue, so they wait for it, before the ETag is computed.
+WORKOUT_READERS = {"fitness.fit_workouts_list", "fitness.fit_users_list", "fitness.fit_analytics",
+                   "fitness.fit_analytics_json", "fitness.fit_bulk_export"}
+
+@bp.before_request
+def wait_for_queued_workouts():
+    if request.endpoint in WORKOUT_READERS:
+        writebehind.wait_for_kind("workouts")
+
+
+@bp.route("/")
+def fitnesstracker_main():
+    return render_template("fitnesstracker/fit_menu.html")
+
+@bp.route("/new_user", methods=["GET", "POST"])
+def fit_new_user():
+    if request.method == "POST":
+        name = request.form["name"].strip()
+        surname = request.form["surname"].strip()
+        if name and surname:
+            models.add_fit_user(name, surname)
+            flash("Lietotājs pievienots!")
+        else:
+            flash("Aizpildi visus laukus!")
+        return redirect(url_for("fitness.fitnesstracker_main"))
+    return render_template("fitnesstracker/new_user.html")
+
+@bp.route("/new_sport", methods=["GET", "POST"])
+def fit_new_sport():
+    if request.method == "POST":
+        title = request.form["title"].strip()
+        if title:
+            models.add_sport(title)
+            flash("Sporta veids pievienots!")
+        else:
+            flash("Ievadi sporta veida nosaukumu!")
+        return redirect(url_for("fitness.fitnesstracker_main"))
+    return render_template("fitnesstracker/new_sport.html")
+
+@bp.route("/new_workout", methods=["GET", "POST"])
+def fit_new_workout():
+    users = models.get_all_fit_users()
+    sports = models.get_all_sports()
+    if request.method == "POST":
+        user_id = request.form["user_id"]
+        sport_id = request.form["sport_id"]
+        intensity = request.form["intensity"]
+        day_time = request.form["day_time"]
+        if not (user_id and sport_id and intensity and day_time):
+            flash("Aizpildi visus laukus!")
+        elif not (user_id.isdigit() and int(user_id) in {u["id"] for u in users}
+                  and sport_id.isdigit() and int(sport_id) in {s["id"] for s in sports}):
+            # checked now: a queued workout failing its foreign key would
+            # only be logged, after this page had already said it was added
+            flash("Nezināms lietotājs vai sporta veids!")
+        elif not intensity.isdigit():
+            flash("Intensitātei jābūt veselam skaitlim!")
+        else:
+            # logged to the audit log (kontrole.jsonl) by the model once committed
+            models.add_workout(user_id, sport_id, int(intensity), day_time)
+            flash("Treniņš pievienots!")
+        return redirect(url_for("fitness.fitnesstracker_main"))
+    return render_template("fitnesstracker/new_workout.html", users=users, sports=sports)
+
+@bp.route("/sports")
+@httpcache.etag_for("fit_sports")
+def fit_sports_list():
+    # called inside the template's fragment, only when it isn't cached
+    return render_template("fitnesstracker/sports_list.html", sports=models.get_all_sports)
+
+@bp.route("/workouts")
+@httpcache.etag_for("fit_workouts", "fit_users", "fit_sports")
+def fit_workouts_list():
+    if request.args.get("stream"):
+        workouts = models.iter_all_workouts()
+        return stream_template("fitnesstracker/workouts_list.html", workouts=workouts, next_before=None)
+    size = page_size_arg()
+    workouts, next_before = models.get_workouts_page(request.args.get("before", type=int), size)
+    return render_template("fitnesstracker/workouts_list.html", workouts=workouts, next_before=next_before, size=size)
+
+@bp.route("/users")
+@httpcache.etag_for("fit_users", "fit_workouts", "fit_sports")
+def fit_users_list():
+    return render_template("fitnesstracker/users_list.html", userstats=models.get_all_user_stats)
+
+@bp.route("/delete_workout/<int:workout_id>", methods=["GET", "POST"])
+def fit_delete_workout_confirm(workout_id):
+    if request.method == "POST":
+        models.delete_workout(workout_id)
+        flash("Treniņš dzēsts!")
+        return redirect(url_for("fitness.fit_workouts_list"))
+    return render_template("fitnesstracker/delete_workout_confirm.html", workout_id=workout_id)
+
+# Weekly volume, intensity trends, streaks and percentile ranks over the last
+# ?weeks=N weeks; ?user_id=N adds one user's weekly series
+def analytics_args():
+    return analytics.weeks_arg(request.args.get("weeks", type=int)), request.args.get("user_id", type=int)
+
+@bp.route("/analytics")
+def fit_analytics():
+    weeks, user_id = analytics_args()
+    user = analytics.get_user(user_id, weeks) if user_id is not None else None
+    return render_template("fitnesstracker/analytics.html", report=analytics.get_summary(weeks), user=user,
+                           user_id=user_id, weeks=weeks)
+
+@bp.route("/analytics.json")
+def fit_analytics_json():
+    weeks, user_id = analytics_args()
+    if user_id is None:
+        return jsonify(analytics.get_summary(weeks))
+    user = analytics.get_user(user_id, weeks)
+    if user is None:
+        return jsonify(error=f"no workouts for user {user_id} in the last {weeks} weeks"), 404
+    return jsonify(user)
+
+# Body is CSV (Content-Type: text/csv) or JSONL, read and checked in full
+# before anything is written. Needs a logged-in game user (session cookie).
+# e.g. curl -b cookies.txt --data-binary @workouts.csv -H "Content-Type: text/csv" .../bulk/workouts
+@bp.route("/bulk/<kind>", methods=["POST"])
+def fit_bulk_import(kind):
+    if "user_id" not in session:
+        return jsonify(error="login required"), 401
+    if kind not in bulk.FIELDS:
+        return jsonify(error=f"unknown kind {kind}"), 404
+    fmt = request.args.get("format") or ("csv" if request.mimetype == "text/csv" else "jsonl")
+    if fmt not in bulk.FORMATS:
+        return jsonify(error=f"unknown format {fmt}"), 400
+    body = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+    return jsonify(bulk.import_records(kind, bulk.read_records(body, fmt)))
+
+@bp.route("/export/<kind>.<fmt>")
+def fit_bulk_export(kind, fmt):
+    if kind not in bulk.FIELDS or fmt not in bulk.FORMATS:
+        return jsonify(error=f"unknown export {kind}.{fmt}"), 404
+    return current_app.response_class(stream_with_context(bulk.iter_export(kind, fmt)), mimetype=bulk.MIMETYPES[fmt],
+                                      headers={"Content-Disposition": f"attachment; filename={kind}.{fmt}"})
+
+
+# ---- CLI ----
+def echo_progress(progress):
+    click.echo(f"{progress.rows} rows, {progress.elapsed:.1f}s, {progress.rate:.0f} rows/s", err=True)
+
+@bp.cli.command("fit-import")
+@click.argument("kind", type=click.Choice(list(bulk.FIELDS)))
+@click.argument("path")
+@click.option("--format", "fmt", type=click.Choice(bulk.FORMATS), default=None, help="Default: from the file name")
+@click.option("--batch-rows", type=int, default=None, help="Rows per transaction")
+def fit_import_command(kind, path, fmt, batch_rows):
+    """Import fitness users, sports or workouts from a CSV/JSONL file (.gz ok)."""
+    summary = bulk.import_file(kind, path, fmt, bulk.Progress(echo_progress), batch_rows)
+    click.echo(f"{summary['inserted']} inserted, {summary['skipped']} already there, "
+               f"{summary['rejected']} rejected of {summary['read']} read")
+    for error in summary["errors"]:
+        click.echo(f"  {error}")
+    db.release_connections()
+
+@bp.cli.command("fit-export")
+@click.argument("kind", type=click.Choice(list(bulk.FIELDS)))
+@click.argument("path")
+@click.option("--format", "fmt", type=click.Choice(bulk.FORMATS), default=None, help="Default: from the file name")
+def fit_export_command(kind, path, fmt):
+    """Export fitness users, sports or workouts to a CSV/JSONL file (.gz ok)."""
+    bulk.export_file(kind, path, fmt, bulk.Progress(echo_progress))
+    db.release_connections()
+
+@bp.cli.command("user-stats")
+@click.option("--rebuild", is_flag=True, help="Recompute the aggregates from workouts")
+def user_stats_command(rebuild):
+    """Verify the materialized fitness user stats against workouts."""
+    drift = models.verify_user_stats()
+    for table, (missing, extra) in drift.items():
+        click.echo(f"{table}: {len(missing)} rows missing or wrong, {len(extra)} rows stale")
+    if not drift:
+        click.echo("user stats OK")
+    elif rebuild:
+        models.rebuild_user_stats()
+        click.echo("user stats rebuilt")
+    db.release_connections()
+
+@bp.cli.command("audit-replay")
+@click.option("--rebuild", is_flag=True, help="Replace workouts with the state replayed from the log")
+def audit_replay_command(rebuild):
+    """Replay the audit log and compare the result with the workouts table.
+
+    Workouts older than the first one the log saw added predate the log;
+    they are left out of the comparison and kept by --rebuild.
+    """
+    since_id = audit.first_added_workout(audit.read_events())
+    if since_id is None:
+        click.echo("no workouts in the audit log, nothing to compare")
+        return
+    logged = audit.replay_workouts(audit.read_events())
+    missing, extra, changed = models.verify_workouts_against_log(logged, since_id)
+    click.echo(f"{len(logged)} workouts in log since id {since_id}: {len(missing)} missing, "
+               f"{len(extra)} not in log, {len(changed)} differ")
+    if rebuild and (missing or extra or changed):
+        models.rebuild_workouts_from_log(logged, since_id)
+        click.echo(f"workouts from id {since_id} on rebuilt from the audit log")
+    db.release_connections()
+
+
+# ---- FLASK ----
+def init_app(app):
+    analytics.init_app(app)
+    audit.init_app(app)
+    bulk.init_app(app)
+    app.register_blueprint(bp)
@@ -0,0 +1,236 @@
+import collections
+import secrets
+import threading
+import time
+
+from flask import session
+
+import db
+from rules import START_HEALTH
+
+# ---- GAME STATE CONFIG ----
+# backend   - "memory": dict in this process, fastest, but only for a single worker
+#             "sqlite": table in path, shared by every worker on the host
+#                       (point path at /dev/shm to keep it in shared memory)
+#             "cookie": the old signed-cookie session["game"]; replayable, kept
+#                       only for comparison
+# ttl       - seconds an untouched game is kept
+# max_games - memory backend: the oldest games are dropped beyond this
+GAME_STATE_CONFIG = {
+    "backend": "sqlite",
+    "ttl": 3600.0,
+    "max_games": 100000,
+    "path": "gamestate.db",
+}
+
+class GameState:
+    __slots__ = ("user_id", "health", "battle_points", "expires")
+
+    def __init__(self, user_id, health, battle_points, expires):
+        self.user_id = user_id
+        self.health = health
+        self.battle_points = battle_points
+        self.expires = expires
+
+
+def new_game_id():
+    return secrets.token_urlsafe(16)
+
+
+# ---- BACKENDS ----
+# Every backend: start(user_id) -> (game_id, state),
+# apply(game_id, user_id, step) -> (state, over) or (None, False) for an
+# unknown game, end(game_id, user_id) -> final state or None.
+# step(state) changes the state in place and returns True when the game is
+# over; it runs atomically, and a game that is over is removed in the same
+# step. A game is handed out as over only once, so two racing requests
+# can't both save it.
+class MemoryBackend:
+    def __init__(self, ttl, max_games):
+        self.ttl = ttl
+        self.max_games = max_games
+        # least recently touched first, so expired games are found at the front
+        self.games = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def _evict(self, now):
+        while self.games:
+            game_id, state = next(iter(self.games.items()))
+            if state.expires > now and len(self.games) <= self.max_games:
+                return
+            del self.games[game_id]
+
+    def start(self, user_id):
+        game_id = new_game_id()
+        now = time.time()
+        state = GameState(user_id, START_HEALTH, 0, now + self.ttl)
+        with self.lock:
+            self.games[game_id] = state
+            self._evict(now)
+        return game_id, state
+
+    def _get(self, game_id, user_id, now):
+        state = self.games.get(game_id)
+        if state is None or state.user_id != user_id or state.expires <= now:
+            return None
+        return state
+
+    def apply(self, game_id, user_id, step):
+        now = time.time()
+        with self.lock:
+            state = self._get(game_id, user_id, now)
+            if state is None:
+                return None, False
+            over = step(state)
+            if over:
+                del self.games[game_id]
+                return state, True
+            state.expires = now + self.ttl
+            self.games.move_to_end(game_id)
+            return GameState(state.user_id, state.health, state.battle_points, state.expires), False
+
+    def end(self, game_id, user_id):
+        with self.lock:
+            state = self._get(game_id, user_id, time.time())
+            if state is not None:
+                del self.games[game_id]
+            return state
+
+
+class SQLiteBackend:
+    SCHEMA = """CREATE TABLE IF NOT EXISTS game_state (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        health INTEGER NOT NULL,
+        battle_points INTEGER NOT NULL,
+        expires REAL NOT NULL
+    ) WITHOUT ROWID"""
+    SWEEP_SECONDS = 60.0
+
+    def __init__(self, ttl, path):
+        self.ttl = ttl
+        self.path = path
+        self.swept_at = 0.0
+        db.init_storage(path)
+        conn = db.get_connection(path)
+        conn.execute(self.SCHEMA)
+        conn.commit()
+
+    def _state(self, row):
+        return GameState(row["user_id"], row["health"], row["battle_points"], row["expires"]) if row else None
+
+    @db.retry_on_busy
+    def start(self, user_id):
+        game_id = new_game_id()
+        now = time.time()
+        conn = db.get_connection(self.path)
+        if now - self.swept_at > self.SWEEP_SECONDS:
+            self.swept_at = now
+            conn.execute("DELETE FROM game_state WHERE expires <= ?", (now,))
+        conn.execute("INSERT INTO game_state (id, user_id, health, battle_points, expires) VALUES (?, ?, ?, 0, ?)",
+                     (game_id, user_id, START_HEALTH, now + self.ttl))
+        conn.commit()
+        return game_id, GameState(user_id, START_HEALTH, 0, now + self.ttl)
+
+    @db.retry_on_busy
+    def apply(self, game_id, user_id, step):
+        now = time.time()
+        conn = db.get_connection(self.path)
+        # take the write lock before reading, so no other worker changes the game in between
+        conn.execute("BEGIN IMMEDIATE")
+        state = self._state(conn.execute("""SELECT user_id, health, battle_points, expires FROM game_state
+                                            WHERE id = ? AND user_id = ? AND expires > ?""",
+                                         (game_id, user_id, now)).fetchone())
+        if state is None:
+            conn.rollback()
+            return None, False
+        over = step(state)
+        if over:
+            conn.execute("DELETE FROM game_state WHERE id = ?", (game_id,))
+        else:
+            state.expires = now + self.ttl
+            conn.execute("UPDATE game_state SET health = ?, battle_points = ?, expires = ? WHERE id = ?",
+                         (state.health, state.battle_points, state.expires, game_id))
+        conn.commit()
+        return state, over
+
+    @db.retry_on_busy
+    def end(self, game_id, user_id):
+        conn = db.get_connection(self.path)
+        row = conn.execute("""DELETE FROM game_state WHERE id = ? AND user_id = ? AND expires > ?
+                              RETURNING user_id, health, battle_points, expires""",
+                           (game_id, user_id, time.time())).fetchone()
+        conn.commit()
+        return self._state(row)
+
+
+class CookieBackend:
+    # the state travels in the signed session cookie; no server storage
+    def start(self, user_id):
+        session["game"] = {"health": START_HEALTH, "battle_points": 0}
+        return "cookie", GameState(user_id, START_HEALTH, 0, None)
+
+    def apply(self, game_id, user_id, step):
+        game = session.get("game")
+        if game is None:
+            return None, False
+        state = GameState(user_id, game["health"], game["battle_points"], None)
+        over = step(state)
+        if over:
+            session.pop("game")
+        else:
+            session["game"] = {"health": state.health, "battle_points": state.battle_points}
+        return state, over
+
+    def end(self, game_id, user_id):
+        game = session.pop("game", None)
+        return GameState(user_id, game["health"], game["battle_points"], None) if game else None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = GAME_STATE_CONFIG["backend"]
+                if backend == "memory":
+                    _store = MemoryBackend(GAME_STATE_CONFIG["ttl"], GAME_STATE_CONFIG["max_games"])
+                elif backend == "cookie":
+                    _store = CookieBackend()
+                else:
+                    _store = SQLiteBackend(GAME_STATE_CONFIG["ttl"], GAME_STATE_CONFIG["path"])
+    return _store
+
+
+def start(user_id):
+    return get_store().start(user_id)
+
+
+def apply(game_id, user_id, step):
+    return get_store().apply(game_id, user_id, step)
+
+
+def end(game_id, user_id):
+    return get_store().end(game_id, user_id)
+
+
+def configure(**options):
+    global _store
+    for name, value in options.items():
+        if value is not None:
+            GAME_STATE_CONFIG[name] = value
+    _store = None
+
+
+# ---- FLASK ----
+def init_app(app):
+    configure(
+        backend=app.config.get("GAME_STATE_BACKEND"),
+        ttl=app.config.get("GAME_STATE_TTL"),
+        max_games=app.config.get("GAME_STATE_MAX_GAMES"),
+        path=app.config.get("GAME_STATE_DB"),
+    )
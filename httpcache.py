@@ -0,0 +1,117 @@
+import functools
+import hashlib
+import os
+
+from flask import make_response, request, session
+
+import versions
+import writebehind
+
+# ---- HTTP CACHE CONFIG ----
+# static_max_age - Cache-Control max-age for fingerprinted static files
+HTTP_CACHE_CONFIG = {
+    "static_max_age": 365 * 24 * 3600,
+}
+
+# Changes whenever templates, texts or code are deployed, so old ETags die
+# with the release that produced them. Set by init_app.
+APP_VERSION = ""
+
+
+def _tree_version(paths):
+    stamps = []
+    for path in paths:
+        for root, _, files in os.walk(path):
+            for name in files:
+                st = os.stat(os.path.join(root, name))
+                stamps.append((os.path.join(root, name), st.st_mtime_ns, st.st_size))
+        if os.path.isfile(path):
+            st = os.stat(path)
+            stamps.append((path, st.st_mtime_ns, st.st_size))
+    return hashlib.sha1(repr(sorted(stamps)).encode()).hexdigest()[:12]
+
+
+# ---- CONDITIONAL PAGES ----
+def etag_for(*tables, per_user=False, login_required=False):
+    """Answer 304 from data versions alone, before the view touches the db or Jinja.
+
+    The ETag covers the URL, the versions of tables, the release and, with
+    per_user, the logged-in user. Pages with a pending flash message are
+    never cached, the message must be shown. With login_required, a request
+    without a logged-in user goes straight to the view, which turns it away.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if login_required and session.get("user_id") is None:
+                return view(*args, **kwargs)
+            if "_flashes" in session:
+                response = make_response(view(*args, **kwargs))
+                response.cache_control.no_store = True
+                return response
+            parts = [APP_VERSION, request.path, request.query_string, versions.get(*tables)]
+            if per_user:
+                user_id = session.get("user_id")
+                # read-your-writes: a finished game may still be queued
+                if user_id is not None:
+                    writebehind.wait_for(f"user:{user_id}")
+                parts.append(user_id)
+            etag = hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+            if etag in request.if_none_match:
+                response = make_response("", 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.cache_control.no_cache = True
+            response.cache_control.private = per_user or None
+            return response
+        return wrapper
+    return decorator
+
+
+# ---- STATIC FINGERPRINTS ----
+_fingerprints = {}
+
+
+def fingerprint(static_folder, filename):
+    """Short content hash of a static file, recomputed when the file changes."""
+    path = os.path.join(static_folder, filename)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    cached = _fingerprints.get(path)
+    if cached is not None and cached[0] == (st.st_mtime_ns, st.st_size):
+        return cached[1]
+    with open(path, "rb") as f:
+        digest = hashlib.md5(f.read()).hexdigest()[:10]
+    _fingerprints[path] = ((st.st_mtime_ns, st.st_size), digest)
+    return digest
+
+
+# ---- FLASK ----
+def init_app(app):
+    global APP_VERSION
+    if app.config.get("STATIC_MAX_AGE") is not None:
+        HTTP_CACHE_CONFIG["static_max_age"] = app.config["STATIC_MAX_AGE"]
+    APP_VERSION = _tree_version([os.path.join(app.root_path, "templates"), os.path.join(app.root_path, "app.py"),
+                                 app.config["TEXTS_FILE"]])
+
+    # url_for('static', filename=...) -> /static/...?v=<hash>; a new file gets a new URL
+    @app.url_defaults
+    def static_fingerprint(endpoint, values):
+        if endpoint == "static" and "filename" in values and "v" not in values:
+            digest = fingerprint(app.static_folder, values["filename"])
+            if digest:
+                values["v"] = digest
+
+    @app.after_request
+    def static_cache_headers(response):
+        if request.endpoint == "static" and request.args.get("v") and response.status_code in (200, 304):
+            response.cache_control.public = True
+            response.cache_control.max_age = HTTP_CACHE_CONFIG["static_max_age"]
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        return response
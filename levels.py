@@ -0,0 +1,147 @@
+import array
+import bisect
+import json
+import os
+import threading
+import time
+
+# numpy is imported by the first levels_for() call (level syncs), so workers
+# that only serve pages don't pay for loading it
+_np = None
+
+
+def _numpy():
+    global _np
+    if _np is None:
+        try:
+            import numpy
+        except ImportError:  # batch lookups fall back to a sorted merge
+            numpy = False
+        _np = numpy
+    return _np
+
+LEVELS_FILE = "level_requirements.json"
+RELOAD_CHECK_SECONDS = 1.0
+
+
+# ---- LEVEL CURVE ----
+# level_requirements.json maps level -> experience needed to leave that level,
+# e.g. {"1": 100, "2": 250}: 0-99 exp is level 1, 100-249 level 2, 250+ level 3.
+class LevelCurve:
+    def __init__(self, path=LEVELS_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.checked_at = 0.0
+        self.load()
+
+    def load(self):
+        mtime = os.path.getmtime(self.path)
+        with open(self.path) as f:
+            items = sorted((int(k), v) for k, v in json.load(f).items())
+        keys = array.array("q", [k for k, _ in items])
+        thresholds = array.array("q", [v for _, v in items])
+        if any(a > b for a, b in zip(thresholds, thresholds[1:])):
+            raise ValueError(f"{self.path}: experience thresholds must not decrease with level")
+        # swap both arrays in at once so readers never see a mix of old and new
+        self.curve = (keys, thresholds)
+        self.mtime = mtime
+
+    def maybe_reload(self):
+        """Reload when the file changed; True if the thresholds did."""
+        now = time.monotonic()
+        if now - self.checked_at < RELOAD_CHECK_SECONDS:
+            return False
+        with self.lock:
+            if now - self.checked_at < RELOAD_CHECK_SECONDS:
+                return False
+            self.checked_at = now
+            try:
+                if os.path.getmtime(self.path) == self.mtime:
+                    return False
+                old = self.curve
+                self.load()
+            except (OSError, ValueError):
+                # keep serving the last good curve while the file is being edited
+                return False
+            if self.curve == old:
+                return False
+        for callback in _reload_callbacks:
+            # not on the request that noticed: it may be inside a transaction
+            threading.Thread(target=callback, args=(self,), name="levels-reload", daemon=True).start()
+        return True
+
+    @staticmethod
+    def _next_exp(keys, thresholds, level, experience):
+        i = bisect.bisect_left(keys, level)
+        if i < len(keys) and keys[i] == level:
+            return thresholds[i] - experience
+        return None
+
+    def lookup(self, experience):
+        """(level, experience still needed for the next level or None at max level)."""
+        self.maybe_reload()
+        keys, thresholds = self.curve
+        passed = bisect.bisect_right(thresholds, experience)
+        level = keys[passed - 1] + 1 if passed else 1
+        return level, self._next_exp(keys, thresholds, level, experience)
+
+    def levels_for(self, experiences):
+        """lookup() for many experience values at once, in input order."""
+        self.maybe_reload()
+        keys, thresholds = self.curve
+        np = _numpy()
+        if np:
+            passed = np.searchsorted(np.frombuffer(thresholds, dtype=np.int64),
+                                     np.asarray(experiences, dtype=np.int64), side="right")
+            key_arr = np.frombuffer(keys, dtype=np.int64)
+            levels = np.where(passed > 0, key_arr[np.maximum(passed - 1, 0)] + 1, 1).tolist()
+        else:
+            # one pass over thresholds for the whole batch, in experience order
+            levels = [1] * len(experiences)
+            passed = 0
+            for i in sorted(range(len(experiences)), key=experiences.__getitem__):
+                while passed < len(thresholds) and thresholds[passed] <= experiences[i]:
+                    passed += 1
+                levels[i] = keys[passed - 1] + 1 if passed else 1
+        return [(level, self._next_exp(keys, thresholds, level, exp)) for level, exp in zip(levels, experiences)]
+
+
+_curves = {}
+_curves_lock = threading.Lock()
+_reload_callbacks = []
+
+
+def get_curve(path=None):
+    """Shared curve for path (default LEVELS_FILE), loaded on first use."""
+    path = path or LEVELS_FILE
+    curve = _curves.get(path)
+    if curve is None:
+        with _curves_lock:
+            curve = _curves.get(path)
+            if curve is None:
+                curve = _curves[path] = LevelCurve(path)
+    return curve
+
+
+def on_reload(callback):
+    """Call callback(curve) in a background thread whenever a reload changes a curve's thresholds."""
+    _reload_callbacks.append(callback)
+
+
+def configure(levels_file=None):
+    global LEVELS_FILE
+    if levels_file is not None:
+        LEVELS_FILE = levels_file
+
+
+# ---- FLASK ----
+def init_app(app):
+    configure(levels_file=app.config.get("LEVELS_FILE"))
+    get_curve()
+
+    @app.before_request
+    def check_level_curve():
+        # a page served from cache never looks a level up, so an edited
+        # curve would never be noticed (and its pages never invalidated)
+        get_curve().maybe_reload()
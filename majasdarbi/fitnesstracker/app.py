@@ -1,13 +1,25 @@
 from flask import Flask, render_template, request, redirect, url_for, flash
 import os
+import sys
+
+# the shared modules (db.py, ...) live in the repository root; appended, so
+# this directory's models.py is still the one imported
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+import audit
+import db
 import models
 
 app = Flask(__name__)
 app.secret_key = "fitnesa_secret"
+db.init_app(app)
+# the same audit log as the main app (audit.py), so audit.replay_workouts reads it too
+audit.init_app(app)
 
-# Init DB if not exists
-if not os.path.exists("fitnesstracker.db"):
-    models.init_db()
+# Create or migrate the DB (same schema as the main app's fitness tracker)
+models.init_db()
+db.release_connections()
+# WAL is stored in the db file, so it is set once here instead of per connection
+db.init_storage(models.DB)
 
 # Home page
 @app.route("/")
@@ -51,15 +63,14 @@ def new_workout():
         sport_id = request.form["sport_id"]
         intensity = request.form["intensity"]
         day_time = request.form["day_time"]
-        if user_id and sport_id and intensity and day_time:
-            models.add_workout(user_id, sport_id, intensity, day_time)
-            # Print & log to file as required (Part 6, step 5)
-            print(f"Treniņš: Lietotājs {user_id}, Sports {sport_id}, Intensitāte {intensity}, Laiks {day_time}")
-            with open("kontrole.txt", "a", encoding="utf-8") as f:
-                f.write(f"Lietotājs {user_id}, Sports {sport_id}, Intensitāte {intensity}, Laiks {day_time}\n")
-            flash("Treniņš pievienots!")
-        else:
+        if not (user_id and sport_id and intensity and day_time):
             flash("Aizpildi visus laukus!")
+        elif not intensity.isdigit():
+            flash("Intensitātei jābūt veselam skaitlim!")
+        else:
+            # logged to the audit log (kontrole.jsonl) by the model once committed
+            models.add_workout(user_id, sport_id, int(intensity), day_time)
+            flash("Treniņš pievienots!")
         return redirect(url_for("index"))
     return render_template("new_workout.html", users=users, sports=sports)
 
@@ -78,18 +89,8 @@ def workouts_list():
 # List all users, with stats
 @app.route("/users")
 def users_list():
-    users = models.get_all_users()
-    # Get stats for each user
-    userstats = []
-    for user in users:
-        fav_sport, avg_intensity, fav_time = models.get_user_stats(user["id"])
-        userstats.append({
-            "name": user["name"],
-            "surname": user["surname"],
-            "fav_sport": fav_sport,
-            "avg_intensity": avg_intensity,
-            "fav_time": fav_time
-        })
+    # All users with stats in a single query
+    userstats = models.get_all_user_stats()
     return render_template("users_list.html", userstats=userstats)
 
 # Confirm delete workout
@@ -0,0 +1,493 @@
+import bisect
+import collections
+import functools
+import inspect
+import logging
+import re
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+
+from flask import Response, abort, has_request_context, request, session
+
+import db
+
+# ---- METRICS CONFIG ----
+# enabled        - record anything at all (off: the wrappers return at once)
+# sql            - time every statement (InstrumentedConnection in the pool);
+#                  about half of the cost on a short request like /play
+# buckets        - histogram upper bounds in seconds
+# allow_ips      - who may read /metrics and the other stats endpoints
+#                  (Prometheus on the same host)
+# slow_query_ms  - statements slower than this go to the slow-query log
+# slow_query_log - file for it (None: the "pseudoxfit.slow_queries" logger only)
+# profile        - allow ?profile=1 for users in profile_users (user ids)
+# profile_interval - seconds between profiler samples; the sampler thread
+#                    only runs when it gets the GIL, every 5 ms by default
+#                    (sys.getswitchinterval), so shorter doesn't help much
+#
+# Numbers are per worker process; Prometheus sees whichever worker answers
+# the scrape, so compare rates, not totals, across scrapes.
+METRICS_CONFIG = {
+    "enabled": True,
+    "sql": True,
+    "buckets": (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    "allow_ips": ("127.0.0.1", "::1"),
+    "slow_query_ms": 100.0,
+    "slow_query_log": "slow_queries.log",
+    "profile": False,
+    "profile_users": (),
+    "profile_interval": 0.005,
+}
+
+PREFIX = "pseudoxfit"
+
+slow_log = logging.getLogger("pseudoxfit.slow_queries")
+
+
+# ---- REGISTRY ----
+class Histogram:
+    """Counts per bucket plus sum and count, like a Prometheus histogram."""
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size):
+        self.counts = [0] * (size + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+
+class Registry:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.routes = {}            # (endpoint, method) -> Histogram
+        self.responses = collections.Counter()  # (endpoint, method, status) -> count
+        self.queries = {}           # (db, sql) -> [count, seconds, rows, errors] of closed connections
+        self.functions = {}         # name -> [count, seconds, errors]
+        self.slow_queries = 0
+
+    def observe_route(self, endpoint, method, status, seconds):
+        with self.lock:
+            hist = self.routes.get((endpoint, method))
+            if hist is None:
+                hist = self.routes[(endpoint, method)] = Histogram(len(self.buckets))
+            hist.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            hist.sum += seconds
+            hist.count += 1
+            self.responses[(endpoint, method, status)] += 1
+
+    def add_queries(self, dbfile, query_stats):
+        with self.lock:
+            for sql, stats in query_stats.items():
+                total = self.queries.setdefault((dbfile, sql), [0, 0.0, 0, 0])
+                for i, value in enumerate(stats):
+                    total[i] += value
+
+    def observe_function(self, name, seconds, error):
+        with self.lock:
+            stats = self.functions.get(name)
+            if stats is None:
+                stats = self.functions[name] = [0, 0.0, 0]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] += error
+
+
+_registry = Registry(METRICS_CONFIG["buckets"])
+
+
+def registry():
+    return _registry
+
+
+def reset():
+    global _registry
+    _registry = Registry(METRICS_CONFIG["buckets"])
+    for conn in list(_connections):
+        conn.query_stats.clear()
+
+
+# ---- SQL ----
+# Each pool connection counts its own statements: a connection is used by one
+# thread at a time, so this needs no lock. Statements are keyed by their text
+# as executed and merged on output by statement_label(): whitespace collapsed
+# and "?, ?, ?" lists folded, so IN (...) lists of any length share one
+# series. Parameters are never recorded.
+_placeholders = re.compile(r"\?(\s*,\s*\?)+")
+_connections = weakref.WeakSet()
+_slow_seconds = METRICS_CONFIG["slow_query_ms"] / 1000
+
+
+def statement_label(sql):
+    return _placeholders.sub("?, ...", " ".join(sql.split()))[:200]
+
+
+_clock = time.perf_counter
+_execute = sqlite3.Cursor.execute
+_executemany = sqlite3.Cursor.executemany
+_fetchone = sqlite3.Cursor.fetchone
+_fetchmany = sqlite3.Cursor.fetchmany
+_fetchall = sqlite3.Cursor.fetchall
+_cursor = sqlite3.Connection.cursor
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Times execute and fetch calls and counts fetched rows per statement."""
+    _stats = None  # [count, seconds, rows, errors] of the last statement
+    _sql = None
+
+    def _run(self, method, sql, params):
+        query_stats = self.connection.query_stats
+        stats = query_stats.get(sql)
+        if stats is None:
+            stats = query_stats[sql] = [0, 0.0, 0, 0]
+        self._stats = stats
+        self._sql = sql
+        start = _clock()
+        try:
+            method(self, sql, params)
+        except Exception:
+            stats[3] += 1
+            raise
+        finally:
+            seconds = _clock() - start
+            stats[0] += 1
+            stats[1] += seconds
+            if seconds >= _slow_seconds:
+                log_slow_query(self.connection.dbfile, sql, seconds)
+        return self
+
+    def execute(self, sql, params=()):
+        return self._run(_execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._run(_executemany, sql, seq_of_params)
+
+    def fetchone(self):
+        start = _clock()
+        row = _fetchone(self)
+        stats = self._stats
+        if stats is not None:
+            seconds = _clock() - start
+            stats[1] += seconds
+            stats[2] += row is not None
+            if seconds >= _slow_seconds:
+                log_slow_query(self.connection.dbfile, self._sql, seconds)
+        return row
+
+    def fetchmany(self, size=None):
+        return self._fetch_rows(_fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._fetch_rows(_fetchall)
+
+    def _fetch_rows(self, method, *args):
+        start = _clock()
+        rows = method(self, *args)
+        stats = self._stats
+        if stats is not None:
+            seconds = _clock() - start
+            stats[1] += seconds
+            stats[2] += len(rows)
+            if seconds >= _slow_seconds:
+                log_slow_query(self.connection.dbfile, self._sql, seconds)
+        return rows
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Pool connection (db.py) whose cursors are InstrumentedCursors."""
+
+    def __init__(self, database, *args, **kwargs):
+        super().__init__(database, *args, **kwargs)
+        self.dbfile = str(database)
+        self.query_stats = {}  # sql -> [count, seconds, rows, errors]
+        _connections.add(self)
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute would use a plain cursor internally
+    def execute(self, sql, params=()):
+        return _cursor(self, InstrumentedCursor)._run(_execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return _cursor(self, InstrumentedCursor)._run(_executemany, sql, seq_of_params)
+
+    def close(self):
+        # keep the counts of connections the pool closes
+        _registry.add_queries(self.dbfile, self.query_stats)
+        self.query_stats = {}
+        _connections.discard(self)
+        super().close()
+
+
+def query_totals():
+    """{(dbfile, statement label): [count, seconds, rows, errors]} over all connections."""
+    rows = [(conn.dbfile, sql, stats) for conn in list(_connections) for sql, stats in list(conn.query_stats.items())]
+    with _registry.lock:
+        rows += [(dbfile, sql, list(stats)) for (dbfile, sql), stats in _registry.queries.items()]
+    totals = {}
+    for dbfile, sql, stats in rows:
+        total = totals.setdefault((dbfile, statement_label(sql)), [0, 0.0, 0, 0])
+        for i, value in enumerate(stats):
+            total[i] += value
+    return totals
+
+
+def log_slow_query(dbfile, sql, seconds):
+    with _registry.lock:
+        _registry.slow_queries += 1
+    where = f" {request.method} {request.path}" if has_request_context() else ""
+    slow_log.warning("%.1f ms %s%s: %s", seconds * 1000, dbfile, where, statement_label(sql))
+
+
+# ---- MODEL FUNCTIONS ----
+def timed_function(func, name):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not METRICS_CONFIG["enabled"]:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            _registry.observe_function(name, time.perf_counter() - start, 1)
+            raise
+        _registry.observe_function(name, time.perf_counter() - start, 0)
+        return result
+    wrapper.__metrics_wrapped__ = True
+    return wrapper
+
+
+def instrument_module(module):
+    """Time every public function defined in module (e.g. models); returns how many.
+
+    Calls through the module (models.add_game, and calls inside models
+    itself) go through the wrapper; references taken before, like
+    writebehind handlers, stay unwrapped.
+    """
+    wrapped = 0
+    for name, func in list(vars(module).items()):
+        if (name.startswith("_") or not inspect.isfunction(func) or func.__module__ != module.__name__
+                or getattr(func, "__metrics_wrapped__", False)):
+            continue
+        setattr(module, name, timed_function(func, f"{module.__name__}.{name}"))
+        wrapped += 1
+    return wrapped
+
+
+# ---- SAMPLING PROFILER ----
+class Sampler:
+    """Samples one thread's stack every interval seconds from a helper thread."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="metrics-profiler", daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def report(self, seconds):
+        """Collapsed stacks (flamegraph.pl / speedscope input), most sampled first."""
+        lines = [f"# {self.samples} samples every {self.interval * 1000:g} ms over {seconds * 1000:.1f} ms"]
+        lines += [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+        return "\n".join(lines) + "\n"
+
+
+def _profile_requested():
+    return request.args.get("profile") == "1" and session.get("user_id") in METRICS_CONFIG["profile_users"]
+
+
+# ---- PROMETHEUS TEXT FORMAT ----
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _histogram_lines(name, buckets, counts, total, count, labels):
+    lines = []
+    cumulative = 0
+    for bound, n in zip(list(buckets) + ["+Inf"], counts):
+        cumulative += n
+        lines.append(f"{name}_bucket{_labels_text(labels + [('le', bound)])} {cumulative}")
+    lines.append(f"{name}_sum{_labels_text(labels)} {total}")
+    lines.append(f"{name}_count{_labels_text(labels)} {count}")
+    return lines
+
+
+def render():
+    reg = _registry
+    with reg.lock:
+        routes = {key: (list(h.counts), h.sum, h.count) for key, h in reg.routes.items()}
+        responses = dict(reg.responses)
+        functions = {name: list(stats) for name, stats in reg.functions.items()}
+        slow_queries = reg.slow_queries
+    queries = query_totals()
+
+    out = [f"# HELP {PREFIX}_request_duration_seconds Time to build the response, per route.",
+           f"# TYPE {PREFIX}_request_duration_seconds histogram"]
+    for (endpoint, method), (counts, total, count) in sorted(routes.items()):
+        out += _histogram_lines(f"{PREFIX}_request_duration_seconds", reg.buckets, counts, total, count,
+                                [("endpoint", endpoint), ("method", method)])
+
+    out += [f"# HELP {PREFIX}_responses_total Responses per route and status.",
+            f"# TYPE {PREFIX}_responses_total counter"]
+    for (endpoint, method, status), count in sorted(responses.items()):
+        out.append(f"{PREFIX}_responses_total"
+                   f"{_labels_text([('endpoint', endpoint), ('method', method), ('status', status)])} {count}")
+
+    series = [("queries_total", 0, "counter", "Statements executed."),
+              ("query_seconds_total", 1, "counter", "Time in execute and fetch."),
+              ("query_rows_total", 2, "counter", "Rows fetched."),
+              ("query_errors_total", 3, "counter", "Statements that raised.")]
+    for name, index, kind, help_text in series:
+        out += [f"# HELP {PREFIX}_{name} {help_text}", f"# TYPE {PREFIX}_{name} {kind}"]
+        for (dbfile, label), stats in sorted(queries.items()):
+            out.append(f"{PREFIX}_{name}{_labels_text([('db', dbfile), ('statement', label)])} {stats[index]}")
+    out += [f"# HELP {PREFIX}_slow_queries_total Statements over the slow-query threshold.",
+            f"# TYPE {PREFIX}_slow_queries_total counter",
+            f"{PREFIX}_slow_queries_total {slow_queries}"]
+
+    series = [("function_calls_total", 0, "Calls per model function."),
+              ("function_seconds_total", 1, "Time per model function, including nested calls."),
+              ("function_errors_total", 2, "Calls that raised.")]
+    for name, index, help_text in series:
+        out += [f"# HELP {PREFIX}_{name} {help_text}", f"# TYPE {PREFIX}_{name} counter"]
+        for function, stats in sorted(functions.items()):
+            out.append(f"{PREFIX}_{name}{_labels_text([('function', function)])} {stats[index]}")
+
+    pools = db.pool_stats()
+    for name, key, kind, help_text in [("db_connections_opened_total", "opened", "counter", "Connections opened."),
+                                       ("db_connections_open", "open", "gauge", "Connections open now."),
+                                       ("db_connections_idle", "idle", "gauge", "Open connections in the pool.")]:
+        out += [f"# HELP {PREFIX}_{name} {help_text}", f"# TYPE {PREFIX}_{name} {kind}"]
+        for dbfile, stats in sorted(pools.items()):
+            out.append(f"{PREFIX}_{name}{_labels_text([('db', dbfile)])} {stats[key]}")
+    return "\n".join(out) + "\n"
+
+
+def configure(**options):
+    global _slow_seconds
+    for name, value in options.items():
+        if value is not None:
+            METRICS_CONFIG[name] = value
+    _slow_seconds = METRICS_CONFIG["slow_query_ms"] / 1000
+    if options.get("buckets") is not None:
+        reset()
+    if options.get("enabled") is not None or options.get("sql") is not None:
+        # off: new pool connections are plain sqlite3 ones again
+        instrumented = METRICS_CONFIG["enabled"] and METRICS_CONFIG["sql"]
+        db.configure(factory=InstrumentedConnection if instrumented else sqlite3.Connection)
+
+
+# ---- ROUTES ----
+def _status(rv):
+    # what a view returned: a response, a body, or (body, status[, headers])
+    if isinstance(rv, tuple):
+        if len(rv) > 1 and isinstance(rv[1], int):
+            return rv[1]
+        rv = rv[0]
+    return getattr(rv, "status_code", 200)
+
+
+def timed_view(endpoint, view, method=None):
+    # method: the only one the route accepts, saves reading request.method
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not METRICS_CONFIG["enabled"]:
+            return view(*args, **kwargs)
+        sampler = None
+        if METRICS_CONFIG["profile"] and _profile_requested():
+            sampler = Sampler(threading.get_ident(), METRICS_CONFIG["profile_interval"]).start()
+        start = _clock()
+        try:
+            rv = view(*args, **kwargs)
+        except Exception:
+            _registry.observe_route(endpoint, method or request.method, 500, _clock() - start)
+            raise
+        finally:
+            if sampler is not None:
+                sampler.stop()
+        seconds = _clock() - start
+        _registry.observe_route(endpoint, method or request.method, _status(rv), seconds)
+        if sampler is not None:
+            rv = Response(sampler.report(seconds), mimetype="text/plain")
+            rv.cache_control.no_store = True
+        return rv
+    wrapper.__metrics_wrapped__ = True
+    return wrapper
+
+
+def internal_only(view):
+    """404 unless the request comes from allow_ips, like /metrics itself."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.remote_addr not in METRICS_CONFIG["allow_ips"]:
+            abort(404)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def instrument_views(app):
+    """Time every view registered so far; call once all routes and blueprints are added."""
+    methods = collections.defaultdict(set)
+    for rule in app.url_map.iter_rules():
+        methods[rule.endpoint].update(rule.methods - {"HEAD", "OPTIONS"})
+    for endpoint, view in list(app.view_functions.items()):
+        if endpoint != "static" and not getattr(view, "__metrics_wrapped__", False):
+            only = methods[endpoint]
+            app.view_functions[endpoint] = timed_view(endpoint, view, next(iter(only)) if len(only) == 1 else None)
+
+
+# ---- FLASK ----
+def init_app(app):
+    configure(
+        enabled=app.config.get("METRICS"),
+        sql=app.config.get("METRICS_SQL"),
+        allow_ips=app.config.get("METRICS_ALLOW_IPS"),
+        slow_query_ms=app.config.get("SLOW_QUERY_MS"),
+        slow_query_log=app.config.get("SLOW_QUERY_LOG"),
+        profile=app.config.get("PROFILE"),
+        profile_users=app.config.get("PROFILE_USERS"),
+    )
+    if METRICS_CONFIG["slow_query_log"] and not slow_log.handlers:
+        handler = logging.FileHandler(METRICS_CONFIG["slow_query_log"], encoding="utf-8", delay=True)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(process)d %(message)s"))
+        slow_log.addHandler(handler)
+        slow_log.propagate = False
+
+    @app.route("/metrics")
+    @internal_only
+    def metrics_endpoint():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,276 @@
+import os
+import sqlite3
+
+import db
+
+# ---- SCHEMA ----
+# The one definition of the databases. Each db records the last migration it
+# has run in schema_version; migrate() runs the missing ones in order.
+GAME_TABLES = [
+    """CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        level INTEGER NOT NULL DEFAULT 1,
+        experience INTEGER NOT NULL DEFAULT 0,
+        game_count INTEGER NOT NULL DEFAULT 0,
+        best_battle_points INTEGER NOT NULL DEFAULT 0,
+        battle_points_total INTEGER NOT NULL DEFAULT 0,
+        last_played DATETIME
+    )""",
+    """CREATE TABLE IF NOT EXISTS games (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        health INTEGER,
+        battle_points INTEGER,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )""",
+]
+
+FITNESS_TABLES = [
+    """CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        surname TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS sports (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS workouts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        sport_id INTEGER NOT NULL,
+        intensity INTEGER NOT NULL,
+        day_time TEXT NOT NULL,
+        created_at INTEGER,  -- unix seconds (UTC) when it was logged
+        FOREIGN KEY(user_id) REFERENCES users(id),
+        FOREIGN KEY(sport_id) REFERENCES sports(id)
+    )""",
+]
+
+# ---- LEADERBOARD (denormalized) ----
+# users.game_count / best_battle_points / battle_points_total / last_played are
+# kept by add_game and finish_game, so /rangs and /dashboard never read games.
+LEADERBOARD_SORTS = ("game_count", "experience", "level")
+
+# column -> (definition, backfill from games for dbs created before the column)
+LEADERBOARD_COLUMNS = {
+    "game_count": ("INTEGER NOT NULL DEFAULT 0",
+                   "(SELECT COUNT(*) FROM games WHERE games.user_id = users.id)"),
+    "best_battle_points": ("INTEGER NOT NULL DEFAULT 0",
+                           "IFNULL((SELECT MAX(battle_points) FROM games WHERE games.user_id = users.id), 0)"),
+    "battle_points_total": ("INTEGER NOT NULL DEFAULT 0",
+                            "IFNULL((SELECT SUM(battle_points) FROM games WHERE games.user_id = users.id), 0)"),
+    "last_played": ("DATETIME",
+                    "(SELECT MAX(timestamp) FROM games WHERE games.user_id = users.id)"),
+}
+
+LEADERBOARD_SCHEMA = [
+    "CREATE INDEX IF NOT EXISTS games_user_id ON games(user_id)",
+] + [
+    f"""CREATE INDEX IF NOT EXISTS users_rank_{col} ON users
+        ({col}, id, username, level, experience, game_count, best_battle_points)"""
+    for col in LEADERBOARD_SORTS
+]
+
+# ---- FITNESS USER STATS (materialized) ----
+# Per-user aggregates kept in sync with workouts by triggers, so they are
+# updated in the same transaction as add_workout / delete_workout.
+USER_STATS_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS user_stats (
+        user_id INTEGER PRIMARY KEY,
+        workout_count INTEGER NOT NULL,
+        intensity_sum INTEGER NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS user_sport_stats (
+        user_id INTEGER NOT NULL,
+        sport_id INTEGER NOT NULL,
+        cnt INTEGER NOT NULL,
+        PRIMARY KEY (user_id, sport_id)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS user_time_stats (
+        user_id INTEGER NOT NULL,
+        day_time TEXT NOT NULL,
+        cnt INTEGER NOT NULL,
+        PRIMARY KEY (user_id, day_time)
+    ) WITHOUT ROWID""",
+    """CREATE TRIGGER IF NOT EXISTS workouts_stats_insert AFTER INSERT ON workouts BEGIN
+        INSERT INTO user_stats (user_id, workout_count, intensity_sum) VALUES (NEW.user_id, 1, NEW.intensity)
+            ON CONFLICT(user_id) DO UPDATE SET workout_count = workout_count + 1,
+                                               intensity_sum = intensity_sum + NEW.intensity;
+        INSERT INTO user_sport_stats (user_id, sport_id, cnt) VALUES (NEW.user_id, NEW.sport_id, 1)
+            ON CONFLICT(user_id, sport_id) DO UPDATE SET cnt = cnt + 1;
+        INSERT INTO user_time_stats (user_id, day_time, cnt) VALUES (NEW.user_id, NEW.day_time, 1)
+            ON CONFLICT(user_id, day_time) DO UPDATE SET cnt = cnt + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS workouts_stats_delete AFTER DELETE ON workouts BEGIN
+        UPDATE user_stats SET workout_count = workout_count - 1, intensity_sum = intensity_sum - OLD.intensity
+            WHERE user_id = OLD.user_id;
+        DELETE FROM user_stats WHERE user_id = OLD.user_id AND workout_count <= 0;
+        UPDATE user_sport_stats SET cnt = cnt - 1 WHERE user_id = OLD.user_id AND sport_id = OLD.sport_id;
+        DELETE FROM user_sport_stats WHERE user_id = OLD.user_id AND sport_id = OLD.sport_id AND cnt <= 0;
+        UPDATE user_time_stats SET cnt = cnt - 1 WHERE user_id = OLD.user_id AND day_time = OLD.day_time;
+        DELETE FROM user_time_stats WHERE user_id = OLD.user_id AND day_time = OLD.day_time AND cnt <= 0;
+    END""",
+]
+
+# Same aggregates computed from scratch, used by rebuild and verify
+USER_STATS_SOURCES = {
+    "user_stats": """SELECT user_id, COUNT(*) AS workout_count, SUM(intensity) AS intensity_sum
+                     FROM workouts GROUP BY user_id""",
+    "user_sport_stats": "SELECT user_id, sport_id, COUNT(*) AS cnt FROM workouts GROUP BY user_id, sport_id",
+    "user_time_stats": "SELECT user_id, day_time, COUNT(*) AS cnt FROM workouts GROUP BY user_id, day_time",
+}
+
+# Indexes for the per-user / per-sport lookups and the name-ordered lists
+FITNESS_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS workouts_user_id ON workouts(user_id)",
+    "CREATE INDEX IF NOT EXISTS workouts_sport_id ON workouts(sport_id)",
+    "CREATE INDEX IF NOT EXISTS sports_title ON sports(title)",
+    "CREATE INDEX IF NOT EXISTS users_surname_name ON users(surname, name)",
+]
+
+# ---- GAME ARCHIVE (archive.py) ----
+# Games older than ARCHIVE_AFTER_DAYS move to a separate archive db; per user,
+# what was moved is summed up in archived_game_stats, so live games plus the
+# summary still add up to the users leaderboard columns.
+ARCHIVED_GAME_STATS = [
+    """CREATE TABLE IF NOT EXISTS archived_game_stats (
+        user_id INTEGER PRIMARY KEY,
+        game_count INTEGER NOT NULL,
+        battle_points_total INTEGER NOT NULL,
+        best_battle_points INTEGER NOT NULL,
+        first_played DATETIME,
+        last_played DATETIME
+    )""",
+]
+
+# The archive db: the moved rows, unchanged, with their original ids
+ARCHIVE_TABLES = [
+    """CREATE TABLE IF NOT EXISTS games (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        health INTEGER,
+        battle_points INTEGER,
+        timestamp DATETIME
+    )""",
+    "CREATE INDEX IF NOT EXISTS games_user_id ON games(user_id)",
+]
+
+
+# ---- MIGRATION STEPS ----
+# A step is a list of statements or a function(conn). Steps must not commit:
+# migrate() runs them and the version bump in one transaction. They are
+# written to also work on dbs from before schema_version existed.
+def add_leaderboard_columns(conn):
+    columns = [row["name"] for row in conn.execute("PRAGMA table_info(users)")]
+    for column, (definition, backfill) in LEADERBOARD_COLUMNS.items():
+        if column not in columns:
+            # db created before this column: add and backfill it
+            conn.execute(f"ALTER TABLE users ADD COLUMN {column} {definition}")
+            conn.execute(f"UPDATE users SET {column} = {backfill}")
+
+
+def fill_user_stats(conn):
+    for table, source in USER_STATS_SOURCES.items():
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"INSERT INTO {table} {source}")
+
+
+def add_workout_timestamps(conn):
+    columns = [row["name"] for row in conn.execute("PRAGMA table_info(workouts)")]
+    if "created_at" not in columns:
+        # workouts logged before the column keep NULL, their time is unknown
+        conn.execute("ALTER TABLE workouts ADD COLUMN created_at INTEGER")
+
+
+# schema -> [(version, description, step)], versions ascending
+MIGRATIONS = {
+    "game": [
+        (1, "users and games tables", GAME_TABLES),
+        (2, "leaderboard columns on users", add_leaderboard_columns),
+        (3, "games.user_id and leaderboard indexes", LEADERBOARD_SCHEMA),
+        (4, "archived game stats", ARCHIVED_GAME_STATS),
+    ],
+    "fitness": [
+        (1, "users, sports and workouts tables", FITNESS_TABLES),
+        (2, "materialized user stats", USER_STATS_SCHEMA + [fill_user_stats]),
+        (3, "workouts, sports and users indexes", FITNESS_INDEXES),
+        (4, "workouts.created_at", add_workout_timestamps),
+    ],
+    "archive": [
+        (1, "archived games table", ARCHIVE_TABLES),
+    ],
+}
+
+# db file name -> schema
+SCHEMAS = {
+    "playgame.db": "game",
+    "fitnesstracker.db": "fitness",
+    "playgame_archive.db": "archive",
+}
+
+
+class SchemaTooNew(Exception):
+    pass
+
+
+# ---- ENGINE ----
+def current_version(conn):
+    try:
+        row = conn.execute("SELECT version FROM schema_version").fetchone()
+    except sqlite3.OperationalError:  # no schema_version table yet
+        return 0
+    return row[0] if row else 0
+
+
+def latest_version(schema):
+    return MIGRATIONS[schema][-1][0]
+
+
+def _run(conn, step):
+    for part in (step if isinstance(step, list) else [step]):
+        if callable(part):
+            part(conn)
+        else:
+            conn.execute(part)
+
+
+def migrate(dbfile, schema=None):
+    """Create or upgrade dbfile; returns [(version, description)] of the steps run.
+
+    When the db is current this is a single one-row read.
+    """
+    schema = schema or SCHEMAS[os.path.basename(dbfile)]
+    latest = latest_version(schema)
+    conn = db.get_connection(dbfile)
+    version = current_version(conn)
+    if version == latest:
+        return []
+    if version > latest:
+        raise SchemaTooNew(f"{dbfile} is at schema version {version}, this code knows up to {latest}")
+    if conn.in_transaction:
+        conn.commit()
+    if version == 0 and not conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+        # auto_vacuum can only be chosen before the first table is created;
+        # older dbs switch with one full VACUUM (flask archive-games --full-vacuum)
+        conn.execute(f"PRAGMA auto_vacuum = {db.STORAGE_CONFIG['auto_vacuum']}")
+    # the write lock makes other workers starting at the same time wait here
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        version = current_version(conn)
+        applied = []
+        for number, description, step in MIGRATIONS[schema]:
+            if number > version:
+                _run(conn, step)
+                applied.append((number, description))
+        conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        conn.execute("DELETE FROM schema_version")
+        conn.execute("INSERT INTO schema_version (version) VALUES (?)", (max(version, latest),))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return applied
@@ -1,77 +1,82 @@
-import sqlite3
+import os
+import time
+
+import archive
+import audit
+import cache
+import db
+import levels
+import migrations
+import rules
+import versions
+import writebehind
 
 # ---- DATABASE CONNECTION ----
+# Pooled, one connection per thread per db file (see db.py).
+# Released back to the pool at the end of each Flask app context.
 def get_db(dbfile):
-    conn = sqlite3.connect(dbfile)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db.get_connection(dbfile)
 
 # ---- DATABASE INIT ----
+# The schema and its migrations live in migrations.py; this creates a db or
+# brings it up to date.
 def init_db(dbfile, fitness_mode=False):
+    return migrations.migrate(dbfile, "fitness" if fitness_mode else "game")
+
+USER_STATS_SOURCES = migrations.USER_STATS_SOURCES
+LEADERBOARD_SORTS = migrations.LEADERBOARD_SORTS
+
+# ---- FITNESS USER STATS (materialized, kept by triggers) ----
+@db.retry_on_busy
+def rebuild_user_stats(dbfile="fitnesstracker.db"):
     conn = get_db(dbfile)
     c = conn.cursor()
-    if not fitness_mode:
-        # PSEUDO GAME DB SETUP (playgame.db)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                level INTEGER NOT NULL DEFAULT 1,
-                experience INTEGER NOT NULL DEFAULT 0
-            )
-        """)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS games (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                health INTEGER,
-                battle_points INTEGER,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(user_id) REFERENCES users(id)
-            )
-        """)
-    else:
-        # FITNESS TRACKER DB SETUP (fitnesstracker.db)
-        c.execute("""CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            surname TEXT NOT NULL
-        );""")
-        c.execute("""CREATE TABLE IF NOT EXISTS sports (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL
-        );""")
-        c.execute("""CREATE TABLE IF NOT EXISTS workouts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            sport_id INTEGER NOT NULL,
-            intensity INTEGER NOT NULL,
-            day_time TEXT NOT NULL,
-            FOREIGN KEY(user_id) REFERENCES users(id),
-            FOREIGN KEY(sport_id) REFERENCES sports(id)
-        );""")
+    for table, source in USER_STATS_SOURCES.items():
+        c.execute(f"DELETE FROM {table}")
+        c.execute(f"INSERT INTO {table} {source}")
     conn.commit()
-    conn.close()
+    versions.bump("fit_workouts")
+
+def verify_user_stats(dbfile="fitnesstracker.db"):
+    """Rows that differ between each aggregate table and workouts: {table: (missing, extra)}."""
+    conn = get_db(dbfile)
+    c = conn.cursor()
+    drift = {}
+    for table, source in USER_STATS_SOURCES.items():
+        c.execute(f"{source} EXCEPT SELECT * FROM {table}")
+        missing = c.fetchall()
+        c.execute(f"SELECT * FROM {table} EXCEPT {source}")
+        extra = c.fetchall()
+        if missing or extra:
+            drift[table] = (missing, extra)
+    return drift
 
 # ===========================
 # ===== PSEUDO GAME =====
 # ===========================
 
 # ---- user (game) ----
+@db.retry_on_busy
 def add_game_user(username, password):
     conn = get_db("playgame.db")
     c = conn.cursor()
     c.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
     conn.commit()
-    conn.close()
+    cache.invalidate("rangs")
+    versions.bump("game_users")
+
+@db.retry_on_busy
+def update_game_user_password(user_id, password_hash):
+    conn = get_db("playgame.db")
+    c = conn.cursor()
+    c.execute("UPDATE users SET password = ? WHERE id = ?", (password_hash, user_id))
+    conn.commit()
 
 def get_game_user(username):
     conn = get_db("playgame.db")
     c = conn.cursor()
     c.execute("SELECT * FROM users WHERE username = ?", (username,))
     user = c.fetchone()
-    conn.close()
     return user
 
 def get_game_user_by_id(user_id):
@@ -79,148 +84,530 @@ def get_game_user_by_id(user_id):
     c = conn.cursor()
     c.execute("SELECT * FROM users WHERE id = ?", (user_id,))
     user = c.fetchone()
-    conn.close()
     return user
 
+@db.retry_on_busy
 def update_user_experience(user_id, gained_exp):
     conn = get_db("playgame.db")
     c = conn.cursor()
     c.execute("UPDATE users SET experience = experience + ? WHERE id = ?", (gained_exp, user_id))
+    # keep users.level in step with the new experience in the same transaction
+    c.execute("SELECT experience FROM users WHERE id = ?", (user_id,))
+    row = c.fetchone()
+    if row:
+        level, _ = levels.get_curve().lookup(row["experience"])
+        c.execute("UPDATE users SET level = ? WHERE id = ?", (level, user_id))
     conn.commit()
-    conn.close()
+    cache.invalidate("rangs", f"user:{user_id}")
+    versions.bump("game_users")
 
+@db.retry_on_busy
 def update_user_level(user_id, new_level):
     conn = get_db("playgame.db")
     c = conn.cursor()
     c.execute("UPDATE users SET level = ? WHERE id = ?", (new_level, user_id))
     conn.commit()
-    conn.close()
+    cache.invalidate("rangs", f"user:{user_id}")
+    versions.bump("game_users")
 
+@db.retry_on_busy
 def add_game(user_id, health, battle_points):
     conn = get_db("playgame.db")
     c = conn.cursor()
     c.execute("INSERT INTO games (user_id, health, battle_points) VALUES (?, ?, ?)", (user_id, health, battle_points))
+    c.execute("""UPDATE users SET game_count = game_count + 1, best_battle_points = MAX(best_battle_points, ?),
+                 battle_points_total = battle_points_total + ?, last_played = CURRENT_TIMESTAMP
+                 WHERE id = ?""", (battle_points, battle_points, user_id))
+    conn.commit()
+    cache.invalidate("rangs", f"user:{user_id}")
+    versions.bump("games", "game_users")
+
+# Whole game-over write path (game row, experience, level, leaderboard) in one commit.
+# With write-behind enabled, many finished games share one transaction.
+def finish_game(user_id, health, battle_points):
+    writebehind.submit("games", (user_id, health, battle_points), key=f"user:{user_id}")
+
+@db.retry_on_busy
+def _write_finished_games(games):
+    conn = get_db("playgame.db")
+    c = conn.cursor()
+    c.executemany("INSERT INTO games (user_id, health, battle_points) VALUES (?, ?, ?)", games)
+    c.executemany("""UPDATE users SET experience = experience + ?, game_count = game_count + 1,
+                     best_battle_points = MAX(best_battle_points, ?),
+                     battle_points_total = battle_points_total + ?, last_played = CURRENT_TIMESTAMP
+                     WHERE id = ?""",
+                  [(rules.experience_for(points), points, points, user_id) for user_id, _, points in games])
+    user_ids = sorted({user_id for user_id, _, _ in games})
+    c.execute(f"SELECT id, experience FROM users WHERE id IN ({','.join('?' * len(user_ids))})", user_ids)
+    users = c.fetchall()
+    computed = levels.get_curve().levels_for([u["experience"] for u in users])
+    c.executemany("UPDATE users SET level = ? WHERE id = ?",
+                  [(level, u["id"]) for u, (level, _) in zip(users, computed)])
     conn.commit()
-    conn.close()
+    cache.invalidate("rangs", *[f"user:{user_id}" for user_id in user_ids])
+    versions.bump("games", "game_users")
+
+writebehind.register("games", _write_finished_games)
 
-def get_user_games(user_id):
+@db.retry_on_busy
+def sync_user_levels():
+    """Recompute every stored level from experience; returns how many changed."""
     conn = get_db("playgame.db")
     c = conn.cursor()
-    c.execute("SELECT * FROM games WHERE user_id = ?", (user_id,))
-    games = c.fetchall()
-    conn.close()
-    return games
+    c.execute("SELECT id, level, experience FROM users")
+    users = c.fetchall()
+    computed = levels.get_curve().levels_for([u["experience"] for u in users])
+    changed = [(level, u["id"]) for u, (level, _) in zip(users, computed) if level != u["level"]]
+    c.executemany("UPDATE users SET level = ? WHERE id = ?", changed)
+    conn.commit()
+    if changed:
+        cache.invalidate("rangs")
+        versions.bump("game_users")
+    return len(changed)
+
+def _levels_reloaded(curve):
+    # a level curve edited while the app runs re-levels everyone once
+    if curve is not levels.get_curve():
+        return
+    try:
+        if not sync_user_levels():
+            # nobody moved level, but pages cached under game_users still
+            # show the old experience needed for the next one
+            versions.bump("game_users")
+    finally:
+        db.release_connections()
+
+levels.on_reload(_levels_reloaded)
 
-def get_ranga_tabula():
+# Primary-key lookup only: everything comes from the denormalized users columns
+DASHBOARD_SUMMARY_QUERY = """
+    SELECT id, username, level, experience, game_count AS games_count, best_battle_points,
+           CASE WHEN game_count > 0 THEN ROUND(battle_points_total * 1.0 / game_count, 1) END AS avg_battle_points,
+           last_played
+    FROM users WHERE id = ?
+"""
+
+def get_dashboard_summary(user_id):
     conn = get_db("playgame.db")
     c = conn.cursor()
-    c.execute("""
-        SELECT users.username, users.level, users.experience, COUNT(games.id) as game_count
-        FROM users
-        LEFT JOIN games ON users.id = games.user_id
-        GROUP BY users.id
-        ORDER BY game_count DESC
-    """)
-    ranga = c.fetchall()
-    conn.close()
+    c.execute(DASHBOARD_SUMMARY_QUERY, (user_id,))
+    row = c.fetchone()
+    return dict(row) if row else None
+
+# ---- paging / streaming ----
+# games_user_id is an index on (user_id) and so also holds the rowid: it already
+# gives "newest first" order for one user, without a sort.
+STREAM_CHUNK_ROWS = 500
+
+def _page(c, limit):
+    # one extra row tells us whether there is a next page
+    return _page_rows(c.fetchmany(limit + 1), limit)
+
+def _page_rows(rows, limit):
+    next_before = rows[limit - 1]["id"] if len(rows) > limit else None
+    return rows[:limit], next_before
+
+def _iter_rows(c):
+    while True:
+        rows = c.fetchmany(STREAM_CHUNK_ROWS)
+        if not rows:
+            return
+        yield from rows
+
+GAMES_BY_USER = "SELECT * FROM games WHERE user_id = ?"
+
+# Archived games (archive.py) all have lower ids than the live ones, so the
+# archive simply continues where a user's live games run out.
+def get_user_games_page(user_id, before=None, limit=50):
+    """Newest-first page of a user's games and the cursor (game id) for the next page."""
+    conn = get_db("playgame.db")
+    c = conn.cursor()
+    if before:
+        c.execute(GAMES_BY_USER + " AND id < ? ORDER BY id DESC", (user_id, before))
+    else:
+        c.execute(GAMES_BY_USER + " ORDER BY id DESC", (user_id,))
+    rows = c.fetchmany(limit + 1)
+    if len(rows) <= limit:
+        archived = archive.user_games(user_id, rows[-1]["id"] if rows else before)
+        if archived is not None:
+            rows += archived.fetchmany(limit + 1 - len(rows))
+    return _page_rows(rows, limit)
+
+def iter_user_games(user_id):
+    """All of a user's games, newest first, read from the cursors in chunks."""
+    conn = get_db("playgame.db")
+    c = conn.cursor()
+    c.execute(GAMES_BY_USER + " ORDER BY id DESC", (user_id,))
+    yield from _iter_rows(c)
+    archived = archive.user_games(user_id)
+    if archived is not None:
+        yield from _iter_rows(archived)
+
+def get_ranga_tabula(sort="game_count"):
+    ranga, _ = get_ranga_page(sort)
     return ranga
 
+def _parse_rank_cursor(after):
+    # cursor is "<sort value>.<user id>" of the last row on the previous page
+    try:
+        value, last_id = after.split(".")
+        return int(value), int(last_id)
+    except (AttributeError, ValueError):
+        return None
+
+def _ranga_query(sort, cursor, limit):
+    query = f"""SELECT id, username, level, experience, game_count, best_battle_points
+                FROM users INDEXED BY users_rank_{sort}"""
+    params = []
+    if cursor:
+        query += f" WHERE ({sort}, id) < (?, ?)"
+        params += cursor
+    query += f" ORDER BY {sort} DESC, id DESC"
+    if limit:
+        # one extra row tells us whether there is a next page
+        query += " LIMIT ?"
+        params.append(limit + 1)
+    return query, params
+
+def get_ranga_page(sort="game_count", after=None, limit=None):
+    """One page of the leaderboard and the cursor for the next page (or None)."""
+    if sort not in LEADERBOARD_SORTS:
+        sort = "game_count"
+    conn = get_db("playgame.db")
+    c = conn.cursor()
+    c.execute(*_ranga_query(sort, _parse_rank_cursor(after), limit))
+    ranga = c.fetchall()
+    next_after = None
+    if limit and len(ranga) > limit:
+        ranga = ranga[:limit]
+        next_after = f"{ranga[-1][sort]}.{ranga[-1]['id']}"
+    return ranga, next_after
+
+USER_RANK_QUERY = "SELECT COUNT(*) + 1 AS rank FROM users INDEXED BY users_rank_{sort} WHERE ({sort}, id) > (?, ?)"
+
+def get_user_rank(user_id, sort="game_count"):
+    """1-based place of user_id, counted on the index without loading the table."""
+    if sort not in LEADERBOARD_SORTS:
+        sort = "game_count"
+    conn = get_db("playgame.db")
+    c = conn.cursor()
+    c.execute(f"SELECT {sort}, id FROM users WHERE id = ?", (user_id,))
+    user = c.fetchone()
+    if user is None:
+        return None
+    c.execute(USER_RANK_QUERY.format(sort=sort), tuple(user))
+    return c.fetchone()["rank"]
+
+def get_rank_after(after, sort="game_count"):
+    """1-based place of the first row after a page cursor."""
+    cursor = _parse_rank_cursor(after)
+    if not cursor or sort not in LEADERBOARD_SORTS:
+        return 1
+    conn = get_db("playgame.db")
+    c = conn.cursor()
+    c.execute(f"SELECT COUNT(*) + 1 AS rank FROM users INDEXED BY users_rank_{sort} WHERE ({sort}, id) >= (?, ?)",
+              cursor)
+    return c.fetchone()["rank"]
+
 # ===========================
 # ===== FITNESS TRACKER =====
 # ===========================
 
 # -------- users
+@db.retry_on_busy
 def add_fit_user(name, surname):
     conn = get_db("fitnesstracker.db")
     c = conn.cursor()
     c.execute("INSERT INTO users (name, surname) VALUES (?, ?)", (name, surname))
     conn.commit()
-    conn.close()
+    versions.bump("fit_users")
+
+FIT_USERS_QUERY = "SELECT * FROM users ORDER BY surname ASC, name ASC"
 
 def get_all_fit_users():
     conn = get_db("fitnesstracker.db")
     c = conn.cursor()
-    c.execute("SELECT * FROM users ORDER BY surname ASC, name ASC")
+    c.execute(FIT_USERS_QUERY)
     users = c.fetchall()
-    conn.close()
     return users
 
 # -------- sports
+@db.retry_on_busy
 def add_sport(title):
     conn = get_db("fitnesstracker.db")
     c = conn.cursor()
     c.execute("INSERT INTO sports (title) VALUES (?)", (title,))
     conn.commit()
-    conn.close()
+    versions.bump("fit_sports")
 
 def get_all_sports():
     conn = get_db("fitnesstracker.db")
     c = conn.cursor()
     c.execute("SELECT * FROM sports ORDER BY title ASC")
     sports = c.fetchall()
-    conn.close()
     return sports
 
 # -------- workouts
 def add_workout(user_id, sport_id, intensity, day_time):
+    # stamped now, not when the write-behind queue gets to it
+    writebehind.submit("workouts", (user_id, sport_id, intensity, day_time, int(time.time())),
+                       key=f"fit_user:{user_id}")
+
+@db.retry_on_busy
+def add_workouts(workouts):
+    """Insert many (user_id, sport_id, intensity, day_time, created_at) rows in one transaction."""
+    added = insert_workouts(workouts)
+    get_db("fitnesstracker.db").commit()
+    workouts_added(added)
+
+# insert_* leave the rows uncommitted and don't retry: a retry's rollback
+# would drop whatever else the caller's transaction holds
+def insert_workouts(workouts):
+    """add_workouts() without the commit; the caller commits, then passes the returned rows to workouts_added()."""
     conn = get_db("fitnesstracker.db")
     c = conn.cursor()
-    c.execute("""INSERT INTO workouts (user_id, sport_id, intensity, day_time)
-                 VALUES (?, ?, ?, ?)""", (user_id, sport_id, intensity, day_time))
-    conn.commit()
-    conn.close()
+    c.execute("SELECT IFNULL(MAX(id), 0) AS last_id FROM workouts")
+    last_id = c.fetchone()["last_id"]
+    c.executemany("""INSERT INTO workouts (user_id, sport_id, intensity, day_time, created_at)
+                     VALUES (?, ?, ?, ?, ?)""", workouts)
+    # read back the stored rows, so the audit log has ids and typed values
+    c.execute("SELECT id, user_id, sport_id, intensity, day_time, created_at FROM workouts WHERE id > ?",
+              (last_id,))
+    return c.fetchall()
+
+def workouts_added(added):
+    versions.bump("fit_workouts")
+    for w in added:
+        audit.log("workout_added", workout_id=w["id"], user_id=w["user_id"], sport_id=w["sport_id"],
+                  intensity=w["intensity"], day_time=w["day_time"], created_at=w["created_at"])
+
+writebehind.register("workouts", add_workouts)
+
+WORKOUTS_QUERY = """SELECT w.id, u.name, u.surname, s.title as sport, w.intensity, w.day_time
+                    FROM workouts w
+                    JOIN users u ON w.user_id = u.id
+                    JOIN sports s ON w.sport_id = s.id"""
+
+def get_workouts_page(before=None, limit=50):
+    """Newest-first page of workouts and the cursor (workout id) for the next page."""
+    conn = get_db("fitnesstracker.db")
+    c = conn.cursor()
+    if before:
+        c.execute(WORKOUTS_QUERY + " WHERE w.id < ? ORDER BY w.id DESC", (before,))
+    else:
+        c.execute(WORKOUTS_QUERY + " ORDER BY w.id DESC")
+    return _page(c, limit)
 
-def get_all_workouts():
+def iter_all_workouts():
     conn = get_db("fitnesstracker.db")
     c = conn.cursor()
-    c.execute("""SELECT w.id, u.name, u.surname, s.title as sport, w.intensity, w.day_time
-                 FROM workouts w
-                 JOIN users u ON w.user_id = u.id
-                 JOIN sports s ON w.sport_id = s.id
-                 ORDER BY w.id DESC""")
-    workouts = c.fetchall()
-    conn.close()
-    return workouts
+    c.execute(WORKOUTS_QUERY + " ORDER BY w.id DESC")
+    yield from _iter_rows(c)
+
+USER_WORKOUTS_QUERY = "SELECT * FROM workouts WHERE user_id=?"
+
+# Plain tuples for the analytics loader (analytics.py), which reads every
+# dated workout once and then only the ones added since
+# CAST: rows stored before intensity was checked may hold text; it counts as 0
+WORKOUT_COLUMNS_QUERY = """SELECT user_id, sport_id, CAST(intensity AS INTEGER), created_at FROM workouts
+                           WHERE id > ? AND id <= ? AND created_at IS NOT NULL"""
+
+def iter_workout_columns(after_id=0):
+    """(last id read, iterator of (user_id, sport_id, intensity, created_at) after after_id)."""
+    conn = get_db("fitnesstracker.db")
+    c = conn.cursor()
+    c.row_factory = None
+    c.execute("SELECT IFNULL(MAX(id), 0) FROM workouts")
+    last_id = c.fetchone()[0]
+    c.execute(WORKOUT_COLUMNS_QUERY, (after_id, last_id))
+    return last_id, c
+
+def get_fit_user_names(user_ids):
+    """{id: "name surname"} for the given fitness user ids."""
+    conn = get_db("fitnesstracker.db")
+    c = conn.cursor()
+    names = {}
+    for start in range(0, len(user_ids), 500):
+        chunk = list(user_ids[start:start + 500])
+        c.execute(f"SELECT id, name, surname FROM users WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+        names.update((row["id"], f"{row['name']} {row['surname']}") for row in c)
+    return names
 
 def get_user_workouts(user_id):
     conn = get_db("fitnesstracker.db")
     c = conn.cursor()
-    c.execute("SELECT * FROM workouts WHERE user_id=?", (user_id,))
+    c.execute(USER_WORKOUTS_QUERY, (user_id,))
     items = c.fetchall()
-    conn.close()
     return items
 
+USER_STATS_QUERIES = {
+    # Favourite sport (sport w most workouts)
+    "fav_sport": """SELECT s.title FROM user_sport_stats us
+                    JOIN sports s ON s.id = us.sport_id
+                    WHERE us.user_id=? ORDER BY us.cnt DESC LIMIT 1""",
+    "avg_intensity": "SELECT intensity_sum * 1.0 / workout_count AS avg_i FROM user_stats WHERE user_id=?",
+    "fav_time": "SELECT day_time FROM user_time_stats WHERE user_id=? ORDER BY cnt DESC LIMIT 1",
+}
+
 def get_user_stats(user_id):
     conn = get_db("fitnesstracker.db")
     c = conn.cursor()
-    # Favourite sport (sport w most workouts)
-    c.execute("""SELECT sport_id, COUNT(*) as cnt
-                 FROM workouts WHERE user_id=?
-                 GROUP BY sport_id ORDER BY cnt DESC LIMIT 1""", (user_id,))
-    row = c.fetchone()
-    fav_sport_id = row["sport_id"] if row else None
+    c.execute(USER_STATS_QUERIES["fav_sport"], (user_id,))
+    sport_row = c.fetchone()
+    fav_sport_name = sport_row["title"] if sport_row else None
 
-    c.execute("SELECT AVG(intensity) as avg_i FROM workouts WHERE user_id=?", (user_id,))
+    c.execute(USER_STATS_QUERIES["avg_intensity"], (user_id,))
     avg_i_row = c.fetchone()
     avg_intensity = round(avg_i_row["avg_i"], 2) if avg_i_row and avg_i_row["avg_i"] else None
 
-    c.execute("""SELECT day_time, COUNT(*) as cnt FROM workouts WHERE user_id=?
-                 GROUP BY day_time ORDER BY cnt DESC LIMIT 1""", (user_id,))
+    c.execute(USER_STATS_QUERIES["fav_time"], (user_id,))
     time_row = c.fetchone()
     fav_day_time = time_row["day_time"] if time_row else None
-
-    fav_sport_name = None
-    if fav_sport_id:
-        c.execute("SELECT title FROM sports WHERE id=?", (fav_sport_id,))
-        sport_row = c.fetchone()
-        if sport_row:
-            fav_sport_name = sport_row['title']
-    conn.close()
     return fav_sport_name, avg_intensity, fav_day_time
 
+# All users with their stats, read from the materialized aggregates
+def get_all_user_stats():
+    conn = get_db("fitnesstracker.db")
+    c = conn.cursor()
+    # SQLite fills bare columns from the row holding MAX(cnt)
+    c.execute("""WITH fav_sports AS (
+                     SELECT user_id, sport_id, MAX(cnt) FROM user_sport_stats GROUP BY user_id
+                 ),
+                 fav_times AS (
+                     SELECT user_id, day_time, MAX(cnt) FROM user_time_stats GROUP BY user_id
+                 ),
+                 intensities AS (
+                     SELECT user_id, intensity_sum * 1.0 / workout_count AS avg_i FROM user_stats
+                 )
+                 SELECT u.id, u.name, u.surname, s.title AS fav_sport, i.avg_i, t.day_time AS fav_time
+                 FROM users u
+                 LEFT JOIN fav_sports fs ON fs.user_id = u.id
+                 LEFT JOIN sports s ON s.id = fs.sport_id
+                 LEFT JOIN intensities i ON i.user_id = u.id
+                 LEFT JOIN fav_times t ON t.user_id = u.id
+                 ORDER BY u.surname ASC, u.name ASC""")
+    userstats = []
+    for row in c.fetchall():
+        userstats.append({
+            "id": row["id"],
+            "name": row["name"],
+            "surname": row["surname"],
+            "fav_sport": row["fav_sport"],
+            "avg_intensity": round(row["avg_i"], 2) if row["avg_i"] else None,
+            "fav_time": row["fav_time"]
+        })
+    return userstats
+
+@db.retry_on_busy
 def delete_workout(workout_id):
     conn = get_db("fitnesstracker.db")
     c = conn.cursor()
     c.execute("DELETE FROM workouts WHERE id=?", (workout_id,))
+    deleted = c.rowcount
     conn.commit()
-    conn.close()
\ No newline at end of file
+    if deleted:
+        # fit_workouts_rewritten: the analytics columns can't just be appended to
+        versions.bump("fit_workouts", "fit_workouts_rewritten")
+        audit.log("workout_deleted", workout_id=int(workout_id))
+
+# -------- bulk import / export
+# Name -> id indexes, loaded once per import instead of one lookup per row.
+# Names are not unique; with duplicates the oldest row wins.
+def get_fit_user_ids():
+    conn = get_db("fitnesstracker.db")
+    c = conn.cursor()
+    c.execute("SELECT id, name, surname FROM users ORDER BY id DESC")
+    return {(row["name"], row["surname"]): row["id"] for row in c}
+
+def get_sport_ids():
+    conn = get_db("fitnesstracker.db")
+    c = conn.cursor()
+    c.execute("SELECT id, title FROM sports ORDER BY id DESC")
+    return {row["title"]: row["id"] for row in c}
+
+@db.retry_on_busy
+def add_fit_users(users):
+    insert_fit_users(users)
+    get_db("fitnesstracker.db").commit()
+    versions.bump("fit_users")
+
+def insert_fit_users(users):
+    get_db("fitnesstracker.db").executemany("INSERT INTO users (name, surname) VALUES (?, ?)", users)
+
+@db.retry_on_busy
+def add_sports(titles):
+    insert_sports(titles)
+    get_db("fitnesstracker.db").commit()
+    versions.bump("fit_sports")
+
+def insert_sports(titles):
+    get_db("fitnesstracker.db").executemany("INSERT INTO sports (title) VALUES (?)", [(t,) for t in titles])
+
+# Oldest first and by name, so an export can be imported into another db
+FIT_EXPORT_QUERIES = {
+    "users": "SELECT name, surname FROM users ORDER BY id",
+    "sports": "SELECT title FROM sports ORDER BY id",
+    "workouts": """SELECT u.name, u.surname, s.title AS sport, w.intensity, w.day_time, w.created_at
+                   FROM workouts w
+                   JOIN users u ON w.user_id = u.id
+                   JOIN sports s ON w.sport_id = s.id
+                   ORDER BY w.id""",
+}
+
+def iter_fit_export(kind):
+    conn = get_db("fitnesstracker.db")
+    c = conn.cursor()
+    c.execute(FIT_EXPORT_QUERIES[kind])
+    yield from _iter_rows(c)
+
+# -------- audit log replay
+def verify_workouts_against_log(logged, since_id):
+    """Compare workouts from id since_id on with {id: row} replayed from the audit log: (missing, extra, changed) ids."""
+    conn = get_db("fitnesstracker.db")
+    c = conn.cursor()
+    c.execute("SELECT id, user_id, sport_id, intensity, day_time, created_at FROM workouts WHERE id >= ?",
+              (since_id,))
+    stored = {row["id"]: tuple(row)[1:] for row in c.fetchall()}
+    missing = sorted(set(logged) - set(stored))
+    extra = sorted(set(stored) - set(logged))
+    changed = sorted(i for i in set(logged) & set(stored) if tuple(logged[i]) != stored[i])
+    return missing, extra, changed
+
+@db.retry_on_busy
+def rebuild_workouts_from_log(logged, since_id):
+    """Replace the workouts from id since_id on with the replayed ones; older rows predate the log and stay."""
+    conn = get_db("fitnesstracker.db")
+    c = conn.cursor()
+    c.execute("DELETE FROM workouts WHERE id >= ?", (since_id,))
+    c.executemany("""INSERT INTO workouts (id, user_id, sport_id, intensity, day_time, created_at)
+                     VALUES (?, ?, ?, ?, ?, ?)""", [(i,) + tuple(w) for i, w in sorted(logged.items())])
+    conn.commit()
+    versions.bump("fit_workouts", "fit_workouts_rewritten")
+
+# ---- HOT QUERIES ----
+# Per-request queries that must stay on an index, with sample parameters:
+# (name, db file, sql, params, tables the query must not read).
+# `flask check-plans` and tests/test_query_plans.py fail if one of them
+# starts scanning a whole table.
+# The first (cursor-less) pages of /my_games and the workouts list read
+# newest-first rows and stop after one page, so only the cursor form is listed.
+def hot_queries():
+    queries = [
+        ("dashboard summary", "playgame.db", DASHBOARD_SUMMARY_QUERY, (1,), ["games"]),
+        ("user games page", "playgame.db", GAMES_BY_USER + " AND id < ? ORDER BY id DESC", (1, 1000), []),
+        ("archived game stats", "playgame.db", archive.STATS_QUERY, (1,), ["games"]),
+    ]
+    if os.path.exists(archive.ARCHIVE_CONFIG["path"]):
+        queries.append(("archived games page", archive.ARCHIVE_CONFIG["path"],
+                        archive.GAMES_BY_USER + " AND id < ? ORDER BY id DESC", (1, 1000), []))
+    for sort in LEADERBOARD_SORTS:
+        queries.append((f"rangs page by {sort}", "playgame.db", *_ranga_query(sort, (1, 1), 50), ["games"]))
+        queries.append((f"rank by {sort}", "playgame.db", USER_RANK_QUERY.format(sort=sort), (1, 1), ["games"]))
+    queries += [
+        ("workouts page", "fitnesstracker.db", WORKOUTS_QUERY + " WHERE w.id < ? ORDER BY w.id DESC", (1000,), []),
+        ("user workouts", "fitnesstracker.db", USER_WORKOUTS_QUERY, (1,), []),
+        ("fitness users list", "fitnesstracker.db", FIT_USERS_QUERY, (), []),
+    ]
+    for name, sql in USER_STATS_QUERIES.items():
+        queries.append((f"user stats {name}", "fitnesstracker.db", sql, (1,), ["workouts"]))
+    return queries
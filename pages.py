@@ -0,0 +1,20 @@
+from flask import current_app, request, stream_with_context
+
+# ---- PAGED AND STREAMED LISTS ----
+# Shared by the game pages (app.py) and the fitness tracker (fitness.py)
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+STREAM_BUFFER = 200
+
+
+def stream_template(template_name, **context):
+    # like flask.stream_template, but sends STREAM_BUFFER template pieces per chunk
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    stream.enable_buffering(STREAM_BUFFER)
+    return app.response_class(stream_with_context(stream))
+
+
+def page_size_arg():
+    return min(max(request.args.get("size", PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
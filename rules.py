@@ -0,0 +1,31 @@
+import random
+
+# ---- FIGHT RULES ----
+# The one definition of a game, used by the web handlers (app.py), the game
+# state backends (gamestate.py), the game-over write (models.py) and the
+# balance simulator (simulate.py), so the simulation can't drift from play.
+START_HEALTH = 100
+DAMAGE = (12, 26)  # health lost per fight, inclusive like random.randint
+POINTS = (10, 30)  # battle points won per fight
+
+
+def fight(game, rng=random):
+    """One fight: changes game in place, True when the player is dead."""
+    game.health -= rng.randint(*DAMAGE)
+    game.battle_points += rng.randint(*POINTS)
+    return game.health <= 0
+
+
+def final_health(health):
+    # what a finished game stores; a deadly last fight can take it below 0
+    return max(health, 0)
+
+
+def experience_for(battle_points):
+    """Experience a finished game adds to the player."""
+    return battle_points
+
+
+def max_fights():
+    """Fights a game can last at most: until the smallest damage kills."""
+    return -(-START_HEALTH // DAMAGE[0])
@@ -0,0 +1,220 @@
+import concurrent.futures
+import multiprocessing
+import os
+import random
+
+import numpy as np
+
+import levels
+import rules
+
+# ---- BALANCE SIMULATOR ----
+# Plays games in batches of NumPy arrays with the fight rules from rules.py.
+# Run through `flask simulate`; results are histograms, so chunks
+# played in different processes add up exactly, and the same seed gives the
+# same numbers whatever the number of workers.
+CHUNK_GAMES = 250000
+
+# A strategy is the health at or below which the player runs instead of
+# fighting; 0 fights until death. On the command line: "fight", "run-at:40".
+def parse_strategy(text):
+    if text == "fight":
+        return 0
+    name, _, health = text.partition(":")
+    if name != "run-at" or not health.isdigit():
+        raise ValueError(f'strategy {text!r}: expected "fight" or "run-at:HEALTH"')
+    return int(health)
+
+def strategy_name(run_at):
+    return "fight" if run_at == 0 else f"run-at:{run_at}"
+
+
+# ---- GAMES ----
+def play_games(count, run_at, rng):
+    """(battle points, final health, fights) of count games, one array each."""
+    fights = rules.max_fights()
+    rows = np.arange(count)
+    damage = rng.integers(rules.DAMAGE[0], rules.DAMAGE[1] + 1, size=(count, fights), dtype=np.int32)
+    won = rng.integers(rules.POINTS[0], rules.POINTS[1] + 1, size=(count, fights), dtype=np.int32)
+    # column k: health and points after k fights
+    health = np.empty((count, fights + 1), dtype=np.int32)
+    health[:, 0] = rules.START_HEALTH
+    np.subtract(rules.START_HEALTH, np.cumsum(damage, axis=1), out=health[:, 1:])
+    points = np.zeros((count, fights + 1), dtype=np.int32)
+    np.cumsum(won, axis=1, out=points[:, 1:])
+    # health only goes down, so the player fights while it is above run_at
+    # (a death leaves it at or below 0, which also stops the game)
+    played = np.count_nonzero(health[:, :-1] > run_at, axis=1)
+    # rules.final_health, for an array
+    return points[rows, played], np.maximum(health[rows, played], 0), played
+
+def _games_chunk(count, run_at, seed):
+    points, health, fights = play_games(count, run_at, np.random.default_rng(seed))
+    return (np.bincount(points, minlength=rules.POINTS[1] * rules.max_fights() + 1),
+            np.bincount(health, minlength=rules.START_HEALTH + 1),
+            np.bincount(fights, minlength=rules.max_fights() + 1))
+
+
+class GameStats:
+    """Histograms of battle points, final health and fights per game."""
+
+    def __init__(self, run_at):
+        self.run_at = run_at
+        self.points = self.health = self.fights = 0
+
+    def add(self, chunk):
+        points, health, fights = chunk
+        self.points = self.points + points
+        self.health = self.health + health
+        self.fights = self.fights + fights
+
+    @property
+    def games(self):
+        return int(self.points.sum())
+
+    def mean(self, hist):
+        return float(np.arange(len(hist)) @ hist / hist.sum())
+
+    def std(self, hist):
+        values = np.arange(len(hist))
+        return float(np.sqrt(((values - self.mean(hist)) ** 2) @ hist / hist.sum()))
+
+    def percentile(self, hist, p):
+        return int(np.searchsorted(np.cumsum(hist), p / 100 * hist.sum()))
+
+    def summary(self):
+        return {
+            "strategy": strategy_name(self.run_at),
+            "games": self.games,
+            "battle_points": {"mean": self.mean(self.points), "std": self.std(self.points),
+                              **{f"p{p}": self.percentile(self.points, p) for p in (1, 10, 50, 90, 99)}},
+            "experience_per_game": float(rules.experience_for(np.arange(len(self.points))) @ self.points / self.games),
+            "fights_per_game": self.mean(self.fights),
+            "deaths": float(self.health[0] / self.health.sum()),
+            "final_health_mean": self.mean(self.health),
+        }
+
+
+# ---- CAREERS (games to level) ----
+def _careers_chunk(players, games, run_at, thresholds, seed):
+    rng = np.random.default_rng(seed)
+    points, _, _ = play_games(players * games, run_at, rng)
+    experience = np.cumsum(rules.experience_for(points).reshape(players, games), axis=1, dtype=np.int64)
+    # one searchsorted for every player and threshold: row i is shifted up by
+    # i * span, so the flattened rows stay sorted and never overlap
+    span = int(experience[:, -1].max()) + 1
+    offsets = np.arange(players, dtype=np.int64)[:, None]
+    found = np.searchsorted((experience + offsets * span).ravel(),
+                            np.minimum(np.asarray(thresholds, dtype=np.int64), span)[None, :] + offsets * span)
+    index = found - offsets * games  # game (0-based) that reached the threshold; games: never
+    reached = index < games
+    arrival = np.where(reached, experience[offsets, np.minimum(index, games - 1)], 0)
+    # games played to reach each level, games + 1 meaning "not within the budget"
+    to_level = np.where(reached, index + 1, games + 1)
+    return (np.stack([np.bincount(column, minlength=games + 2) for column in to_level.T]),
+            arrival.sum(axis=0))
+
+
+class CareerStats:
+    """Per level: histogram of games needed to reach it, experience on arrival."""
+
+    def __init__(self, run_at, curve, games):
+        self.run_at = run_at
+        self.levels, self.thresholds = curve
+        self.games = games
+        self.to_level = self.arrival = 0
+
+    def add(self, chunk):
+        to_level, arrival = chunk
+        self.to_level = self.to_level + to_level
+        self.arrival = self.arrival + arrival
+
+    def summary(self):
+        rows = []
+        previous_games = previous_threshold = 0
+        values = np.arange(self.games + 2)
+        for level, threshold, hist, arrival in zip(self.levels, self.thresholds, self.to_level, self.arrival):
+            reached = hist[:-1]
+            count = int(reached.sum())
+            players = int(hist.sum())
+            mean = float(values[:-1] @ reached / count) if count else None
+            cumulative = np.cumsum(reached)
+            rows.append({
+                "level": level + 1,
+                "threshold": threshold,
+                "experience_needed": threshold - previous_threshold,
+                "reached": count / players,
+                "games_mean": mean,
+                "games_p50": int(np.searchsorted(cumulative, 0.5 * players)) if count >= 0.5 * players else None,
+                "games_p90": int(np.searchsorted(cumulative, 0.9 * players)) if count >= 0.9 * players else None,
+                "games_at_previous_level": mean - previous_games if mean is not None else None,
+                "experience_on_arrival": float(arrival / count) if count else None,
+            })
+            previous_games, previous_threshold = mean or 0, threshold
+        return {"strategy": strategy_name(self.run_at), "players": int(self.to_level[0].sum()),
+                "games_budget": self.games, "levels": rows}
+
+
+# ---- RUNNING ----
+def _split(total, size):
+    return [min(size, total - start) for start in range(0, total, size)]
+
+def career_games(curve, run_at, seed):
+    """Games per simulated career: about twice what reaching the top level takes on average."""
+    points, _, _ = play_games(10000, run_at, np.random.default_rng(seed))
+    per_game = float(rules.experience_for(points).mean())
+    return max(int(2 * curve[1][-1] / per_game) + 10, 10) if per_game > 0 else 10
+
+def run(strategies, games, players, levels_file=levels.LEVELS_FILE, workers=None, seed=None):
+    """Simulate every strategy: ({strategy name: {"games": ..., "careers": ...}}, seed used)."""
+    curve = levels.LevelCurve(levels_file).curve
+    keys, thresholds = list(curve[0]), list(curve[1])
+    seed = random.randrange(2 ** 32) if seed is None else seed
+    workers = workers or os.cpu_count()
+
+    results = {}
+    jobs = []
+    for run_at, sequence in zip(strategies, np.random.SeedSequence(seed).spawn(len(strategies))):
+        # every chunk gets the next child seed of its strategy's sequence
+        game_stats = GameStats(run_at)
+        budget = career_games(curve, run_at, sequence.spawn(1)[0])
+        career_stats = CareerStats(run_at, (keys, thresholds), budget)
+        results[strategy_name(run_at)] = (game_stats, career_stats)
+        jobs += [(game_stats, _games_chunk, (count, run_at, sequence.spawn(1)[0]))
+                 for count in _split(games, CHUNK_GAMES)]
+        jobs += [(career_stats, _careers_chunk, (count, budget, run_at, thresholds, sequence.spawn(1)[0]))
+                 for count in _split(players, max(CHUNK_GAMES // budget, 1))]
+
+    if workers > 1:
+        # spawn: the caller (a Flask app) may have threads that fork would copy mid-lock
+        context = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context) as pool:
+            futures = [(stats, pool.submit(func, *args)) for stats, func, args in jobs]
+            for stats, future in futures:
+                stats.add(future.result())
+    else:
+        for stats, func, args in jobs:
+            stats.add(func(*args))
+    return {name: {"games": g.summary(), "careers": c.summary()} for name, (g, c) in results.items()}, seed
+
+
+def check_rules(run_at, games, seed=0):
+    """Mean battle points from playing games one by one with rules.fight, the
+    way the web handlers do, against the batched simulation."""
+    rng = random.Random(seed)
+    total = 0
+    for _ in range(games):
+        game = _Game()
+        while game.health > run_at and not rules.fight(game, rng):
+            pass
+        total += game.battle_points
+    points, _, _ = play_games(games, run_at, np.random.default_rng(seed))
+    return total / games, float(points.mean())
+
+
+class _Game:
+    __slots__ = ("health", "battle_points")
+
+    def __init__(self):
+        self.health = rules.START_HEALTH
+        self.battle_points = 0
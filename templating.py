@@ -0,0 +1,86 @@
+import os
+import tempfile
+
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+import cache
+import versions
+
+# ---- TEMPLATE CONFIG ----
+# bytecode_dir - compiled templates, shared by all workers; a cold worker
+#                loads them instead of parsing and compiling the sources
+# fragments    - cache {% fragment %} blocks (off: always render them)
+TEMPLATE_CONFIG = {
+    "bytecode_dir": os.path.join(tempfile.gettempdir(), "pseudoxfit_jinja"),
+    "fragments": True,
+}
+
+
+# ---- FRAGMENT CACHE ----
+# {% fragment "fit_sports" %} ... {% endfragment %}
+# {% fragment ["fit_users", "fit_workouts"], page %} ... {% endfragment %}
+#
+# The first argument names the data versions (see versions.py) the block
+# depends on, the rest are extra key parts. Each block has its own cache
+# namespace, "fragments/<template>:<line>", keyed by the parts and versions.
+# Renderings for older versions can never be hit again, so the namespace is
+# dropped whenever a process sees the versions change (and on its first
+# render, for what earlier processes left behind). Pass data as a callable
+# and call it inside the block, so a hit skips the query too.
+class FragmentCacheExtension(Extension):
+    tags = {"fragment"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        key = nodes.Const(f"{parser.name}:{lineno}")
+        body = parser.parse_statements(("name:endfragment",), drop_needle=True)
+        call = self.call_method("_render", [key, args[0], nodes.List(args[1:])])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, key, tables, parts, caller):
+        if not TEMPLATE_CONFIG["fragments"]:
+            return caller()
+        if isinstance(tables, str):
+            tables = [tables]
+        current = versions.get(*tables)
+        namespace = f"fragments/{key}"
+        if _seen_versions.get(key) != current:
+            cache.invalidate(namespace)
+            _seen_versions[key] = current
+        return Markup(cache.get_or_set(namespace, (tuple(parts), current), lambda: str(caller())))
+
+
+# fragment -> versions this process last rendered it with
+_seen_versions = {}
+
+
+# ---- PRECOMPILE ----
+def precompile(app):
+    """Compile every template now (or load it from the bytecode cache); returns how many."""
+    env = app.jinja_env
+    names = env.list_templates(filter_func=lambda name: name.endswith(".html"))
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def configure(**options):
+    for name, value in options.items():
+        if value is not None:
+            TEMPLATE_CONFIG[name] = value
+
+
+# ---- FLASK ----
+def init_app(app):
+    configure(
+        bytecode_dir=app.config.get("TEMPLATE_BYTECODE_DIR"),
+        fragments=app.config.get("TEMPLATE_FRAGMENTS"),
+    )
+    os.makedirs(TEMPLATE_CONFIG["bytecode_dir"], exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CONFIG["bytecode_dir"])
+    app.jinja_env.add_extension(FragmentCacheExtension)
@@ -0,0 +1,42 @@
+"""Query-plan regression check: what `flask check-plans` does, on fresh databases."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive  # noqa: E402
+import db  # noqa: E402
+import migrations  # noqa: E402
+import models  # noqa: E402
+
+
+@pytest.fixture
+def databases(tmp_path, monkeypatch):
+    # the models use relative db file names; pools are keyed by them
+    db.close_all()
+    monkeypatch.chdir(tmp_path)
+    migrations.migrate("playgame.db")
+    migrations.migrate("fitnesstracker.db")
+    archive.init_db()
+    yield tmp_path
+    db.close_all()
+
+
+def test_dashboard_summary_is_one_users_lookup(databases):
+    assert db.plan_problems("playgame.db", models.DASHBOARD_SUMMARY_QUERY, (1,), forbid_tables=["games"]) == []
+
+
+def test_hot_queries_stay_on_an_index(databases):
+    queries = models.hot_queries()
+    assert "archived games page" in [name for name, *_ in queries]
+    problems = {name: db.plan_problems(dbfile, sql, params, forbid_tables=forbid)
+                for name, dbfile, sql, params, forbid in queries}
+    assert {name: found for name, found in problems.items() if found} == {}
+
+
+def test_forbidden_table_is_caught_through_its_alias(databases):
+    sql = "SELECT * FROM users u JOIN games AS g ON g.user_id = u.id WHERE u.id = ?"
+    assert [p.split(":")[0] for p in db.plan_problems("playgame.db", sql, (1,), forbid_tables=["games"])] == [
+        "reads games"]
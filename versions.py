@@ -0,0 +1,115 @@
+import fcntl
+import os
+import tempfile
+import threading
+import time
+
+# ---- DATA VERSIONS ----
+# One counter per table (e.g. "fit_sports", "games"), bumped after every
+# committed write. Anything derived from a table -- an ETag, a rendered
+# fragment -- stays valid for as long as the table's version is unchanged.
+#
+# backend - "file": one small file per counter, shared by all workers on the
+#           host (point dir at /dev/shm to keep it in shared memory)
+#           "memory": per process; only correct with a single worker
+#
+# A new counter starts at the current time in ns, and a bump never goes
+# below it, so versions seen before a restart or a wiped dir are not reused.
+VERSIONS_CONFIG = {
+    "backend": "file",
+    "dir": os.path.join(tempfile.gettempdir(), "pseudoxfit_versions"),
+}
+
+
+class MemoryVersions:
+    def __init__(self):
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def get(self, name):
+        with self.lock:
+            return self.versions.setdefault(name, time.time_ns())
+
+    def bump(self, name):
+        with self.lock:
+            self.versions[name] = max(self.versions.get(name, 0) + 1, time.time_ns())
+
+
+class FileVersions:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _update(self, name, bump):
+        fd = os.open(os.path.join(self.directory, name), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # other workers bump the same file
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.read(fd, 32)
+            version = int(data) if data else 0
+            if bump or not data:
+                version = max(version + 1, time.time_ns())
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, str(version).encode())
+            return version
+        finally:
+            os.close(fd)
+
+    def get(self, name):
+        try:
+            with open(os.path.join(self.directory, name), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        if not data:
+            # missing, or being rewritten right now
+            return self._update(name, bump=False)
+        return int(data)
+
+    def bump(self, name):
+        self._update(name, bump=True)
+
+
+_versions = None
+_versions_lock = threading.Lock()
+
+
+def _get_versions():
+    global _versions
+    if _versions is None:
+        with _versions_lock:
+            if _versions is None:
+                if VERSIONS_CONFIG["backend"] == "memory":
+                    _versions = MemoryVersions()
+                else:
+                    _versions = FileVersions(VERSIONS_CONFIG["dir"])
+    return _versions
+
+
+def get(*names):
+    versions = _get_versions()
+    return tuple(versions.get(name) for name in names)
+
+
+def bump(*names):
+    versions = _get_versions()
+    for name in names:
+        versions.bump(name)
+
+
+def configure(backend=None, directory=None):
+    global _versions
+    if backend is not None:
+        VERSIONS_CONFIG["backend"] = backend
+    if directory is not None:
+        VERSIONS_CONFIG["dir"] = directory
+    _versions = None
+
+
+# ---- FLASK ----
+def init_app(app):
+    configure(
+        backend=app.config.get("VERSIONS_BACKEND"),
+        directory=app.config.get("VERSIONS_DIR"),
+    )
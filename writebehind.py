@@ -0,0 +1,205 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+import db
+
+log = logging.getLogger(__name__)
+
+# ---- WRITE-BEHIND CONFIG ----
+# enabled     - off by default: every submit() writes and commits inline
+# flush_ms    - max time a row waits in the queue before its batch is written
+# batch_rows  - write as soon as this many rows are waiting
+# max_queue   - bounded queue; when full, submit() blocks for put_timeout
+#               seconds and then writes the row inline (backpressure)
+WRITE_BEHIND_CONFIG = {
+    "enabled": False,
+    "flush_ms": 50,
+    "batch_rows": 500,
+    "max_queue": 10000,
+    "put_timeout": 2.0,
+}
+
+# kind -> function(rows) that writes and commits a whole batch
+HANDLERS = {}
+
+_FLUSH = object()
+
+
+def register(kind, handler):
+    HANDLERS[kind] = handler
+
+
+def _write(kind, rows):
+    try:
+        HANDLERS[kind](rows)
+        return
+    except Exception:
+        # the failed batch may have run some of its inserts: they must not be
+        # committed together with the row-by-row retry below
+        db.rollback_held()
+        if len(rows) == 1:
+            log.exception("write-behind: failed to write %s row %r", kind, rows[0])
+            return
+    # one bad row must not sink the whole batch: retry them one by one
+    for row in rows:
+        _write(kind, [row])
+
+
+# ---- WRITER THREAD ----
+class WriteBehind:
+    def __init__(self, flush_ms, batch_rows, max_queue, put_timeout):
+        self.flush_s = flush_ms / 1000.0
+        self.batch_rows = batch_rows
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(max_queue)
+        self.cond = threading.Condition()
+        # key (e.g. "user:5") and ("kind", kind) -> rows submitted but not yet committed
+        self.pending = {}
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.thread.start()
+
+    def submit(self, kind, row, key=None):
+        with self.cond:
+            for name in (key, ("kind", kind)):
+                self.pending[name] = self.pending.get(name, 0) + 1
+        try:
+            self.queue.put((kind, row, key), timeout=self.put_timeout)
+        except queue.Full:
+            _write(kind, [row])
+            self._done([(kind, row, key)])
+
+    def wait_for(self, key, timeout=5.0):
+        """Block until every row submitted under key is committed (read-your-writes)."""
+        with self.cond:
+            if not self.pending.get(key):
+                return True
+        try:
+            self.queue.put_nowait(_FLUSH)
+        except queue.Full:
+            pass  # a full queue is being flushed anyway
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.pending.get(key), timeout)
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_s)
+            except queue.Empty:
+                if self.stopping:
+                    return
+                continue
+            batch = [] if item is _FLUSH else [item]
+            deadline = time.monotonic() + self.flush_s
+            while item is not _FLUSH and len(batch) < self.batch_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is not _FLUSH:
+                    batch.append(item)
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        by_kind = {}
+        for kind, row, _ in batch:
+            by_kind.setdefault(kind, []).append(row)
+        for kind, rows in by_kind.items():
+            _write(kind, rows)
+        self._done(batch)
+
+    def _done(self, batch):
+        with self.cond:
+            for kind, _, key in batch:
+                for name in (key, ("kind", kind)):
+                    self.pending[name] -= 1
+                    if not self.pending[name]:
+                        del self.pending[name]
+            self.cond.notify_all()
+
+    def stop(self):
+        self.stopping = True
+        self.queue.put(_FLUSH)
+        self.thread.join()
+        # anything submitted while we were stopping
+        rest = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _FLUSH:
+                rest.append(item)
+        if rest:
+            self._flush(rest)
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer():
+    # started lazily, so a forked worker gets its own thread
+    global _writer, _writer_pid
+    if not WRITE_BEHIND_CONFIG["enabled"]:
+        return None
+    if _writer is None or _writer_pid != os.getpid():
+        with _writer_lock:
+            if _writer is None or _writer_pid != os.getpid():
+                _writer = WriteBehind(WRITE_BEHIND_CONFIG["flush_ms"], WRITE_BEHIND_CONFIG["batch_rows"],
+                                      WRITE_BEHIND_CONFIG["max_queue"], WRITE_BEHIND_CONFIG["put_timeout"])
+                _writer_pid = os.getpid()
+    return _writer
+
+
+def submit(kind, row, key=None):
+    writer = _get_writer()
+    if writer is None:
+        HANDLERS[kind]([row])
+    else:
+        writer.submit(kind, row, key)
+
+
+def wait_for(key, timeout=5.0):
+    if _writer is not None and _writer_pid == os.getpid():
+        return _writer.wait_for(key, timeout)
+    return True
+
+
+def wait_for_kind(kind, timeout=5.0):
+    """Like wait_for, for every queued row of kind (pages that list them all)."""
+    return wait_for(("kind", kind), timeout)
+
+
+@atexit.register
+def shutdown():
+    global _writer
+    if _writer is not None and _writer_pid == os.getpid():
+        _writer.stop()
+    _writer = None
+
+
+def configure(**options):
+    shutdown()
+    for name, value in options.items():
+        if value is not None:
+            WRITE_BEHIND_CONFIG[name] = value
+
+
+# ---- FLASK ----
+def init_app(app):
+    configure(
+        enabled=app.config.get("WRITE_BEHIND"),
+        flush_ms=app.config.get("WRITE_BEHIND_FLUSH_MS"),
+        batch_rows=app.config.get("WRITE_BEHIND_BATCH_ROWS"),
+        max_queue=app.config.get("WRITE_BEHIND_MAX_QUEUE"),
+    )